@@ -0,0 +1,219 @@
+"""API HTTP assíncrona do assistente: consulta de ISP, métricas, chat e SQL.
+
+Execute com: uvicorn api:app --host 0.0.0.0 --port 8000
+
+As chamadas ao banco (SQLAlchemy síncrono) rodam no threadpool sobre o pool
+compartilhado de db.get_engine, limitadas por semáforo ao tamanho do pool;
+o chat usa o LLM de forma assíncrona (astream) com limite próprio.
+
+/stats, /telemetria e /metrics exigem o cabeçalho X-Admin-Token igual a
+ADMIN_TOKEN; sem ADMIN_TOKEN definido esses endpoints ficam desativados.
+"""
+import asyncio
+import hmac
+import os
+import threading
+from typing import Optional
+from fastapi import Depends, FastAPI, Header, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+from db import all_pool_stats, dispose_engines, get_pool_config
+from models import ISPRecord
+from name_index import get_name_index
+from intent import intent_stats
+from market_benchmarks import market_benchmark_stats
+from prefetch import prefetch_stats, start_prefetch_worker, stop_prefetch_worker
+from result_store import get_result
+from telemetry import prometheus_text, telemetry_snapshot
+from utils import (
+    astream_follow_up_question, get_business_metrics, isp_cache_stats, llm_cache_stats,
+    llm_gateway_stats, llm_latency_stats, metrics_cache_stats, query_isp_info,
+)
+
+_pool_config = get_pool_config()
+API_MAX_DB_CONCURRENCY = int(os.getenv(
+    "API_MAX_DB_CONCURRENCY", str(_pool_config["pool_size"] + _pool_config["max_overflow"])
+))
+API_MAX_LLM_CONCURRENCY = int(os.getenv("API_MAX_LLM_CONCURRENCY", "8"))
+
+app = FastAPI(title="Assistente Inteligente ISP", version="1.0.0")
+
+# Limites de concorrência: o banco nunca espera por conexão além do pool
+_db_slots = asyncio.Semaphore(API_MAX_DB_CONCURRENCY)
+_llm_slots = asyncio.Semaphore(API_MAX_LLM_CONCURRENCY)
+
+_sql_agent = None
+_sql_agent_lock = threading.Lock()
+
+
+class ChatRequest(BaseModel):
+    question: str
+    identifier: Optional[str] = None
+    isp: Optional[dict] = None  # prontuário já carregado pelo cliente (ISPRecord.to_dict)
+    stream: bool = False
+    use_cache: bool = True
+
+
+class SQLRequest(BaseModel):
+    question: str
+    isp: Optional[dict] = None  # ISP em foco (perguntas de histórico usam os agregados dele)
+
+
+async def _run_db(func, *args):
+    async with _db_slots:
+        return await run_in_threadpool(func, *args)
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Mesma regra do painel do main.py: desativado sem ADMIN_TOKEN, comparação em tempo constante"""
+    expected = os.getenv("ADMIN_TOKEN")
+    if not expected:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(x_admin_token or "", expected):
+        raise HTTPException(status_code=403, detail="Token de administração inválido.")
+
+
+def _get_sql_agent():
+    global _sql_agent
+    if _sql_agent is None:
+        with _sql_agent_lock:
+            if _sql_agent is None:
+                from sql_agent import SQLQueryAgent
+                _sql_agent = SQLQueryAgent(os.getenv("DATABASE_URL"))
+    return _sql_agent
+
+
+def _sql_query(question, isp_data=None):
+    return _get_sql_agent().query_result(question, isp_data)
+
+
+async def _load_isp(identifier):
+    data, response = await _run_db(query_isp_info, identifier)
+    if not data:
+        raise HTTPException(status_code=404, detail=response)
+    return data, response
+
+
+@app.on_event("startup")
+def _startup():
+    # Constrói o índice de Razão Social e aquece os ISPs mais procurados em segundo plano
+    get_name_index()
+    start_prefetch_worker()
+
+
+@app.on_event("shutdown")
+def _shutdown():
+    stop_prefetch_worker()
+    dispose_engines()
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.get("/isps/sugestoes")
+async def suggest_isps(q: str, limit: int = 8):
+    return {"sugestoes": get_name_index().suggest(q, limit)}
+
+
+@app.get("/isps/{identifier}")
+async def get_isp(identifier: str):
+    data, response = await _load_isp(identifier)
+    return {"isp": data.to_dict(), "resposta": response}
+
+
+@app.get("/isps/{identifier}/metricas")
+async def get_isp_metrics(identifier: str):
+    data, _ = await _load_isp(identifier)
+    return {"isp": data.sf_id, "metricas": await run_in_threadpool(get_business_metrics, data)}
+
+
+class MetricsRequest(BaseModel):
+    isp: dict
+
+
+@app.post("/metricas")
+async def calculate_metrics(request: MetricsRequest):
+    isp_data = ISPRecord.from_dict(request.isp)
+    return {"isp": isp_data.sf_id, "metricas": await run_in_threadpool(get_business_metrics, isp_data)}
+
+
+@app.post("/chat")
+async def chat(request: ChatRequest):
+    if request.isp is not None:
+        isp_data = ISPRecord.from_dict(request.isp)
+    elif request.identifier:
+        isp_data, _ = await _load_isp(request.identifier)
+    else:
+        raise HTTPException(status_code=422, detail="Informe 'identifier' ou 'isp'.")
+    metrics = await run_in_threadpool(get_business_metrics, isp_data)
+
+    if request.stream:
+        async def chunks():
+            async with _llm_slots:
+                async for chunk in astream_follow_up_question(
+                    request.question, isp_data, metrics, request.use_cache
+                ):
+                    yield chunk
+        return StreamingResponse(chunks(), media_type="text/plain; charset=utf-8")
+
+    async with _llm_slots:
+        parts = [chunk async for chunk in astream_follow_up_question(
+            request.question, isp_data, metrics, request.use_cache
+        )]
+    return {"resposta": "".join(parts).strip()}
+
+
+@app.post("/sql")
+async def sql_query(request: SQLRequest):
+    # Geração do SQL e execução protegida rodam juntas no threadpool
+    isp_data = ISPRecord.from_dict(request.isp) if request.isp else None
+    answer = await _run_db(_sql_query, request.question, isp_data)
+    return {"resposta": answer.text, "result_id": answer.result_id}
+
+
+@app.get("/sql/resultados/{result_id}")
+async def sql_result(result_id: str):
+    result = get_result(result_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Resultado expirado ou inexistente.")
+    return {
+        "question": result.question,
+        "query_type": result.query_type,
+        "columns": result.columns,
+        "rows": result.rows,
+        "total_rows": result.total_rows,
+        "truncated": result.truncated,
+    }
+
+
+@app.get("/telemetria", dependencies=[Depends(require_admin)])
+async def telemetry():
+    return telemetry_snapshot()
+
+
+@app.get("/metrics", response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+async def metrics():
+    # Formato texto do Prometheus
+    return PlainTextResponse(prometheus_text(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/stats", dependencies=[Depends(require_admin)])
+async def stats():
+    return {
+        "isp_cache": isp_cache_stats(),
+        "metrics_cache": metrics_cache_stats(),
+        "llm_cache": llm_cache_stats(),
+        "llm_latency": llm_latency_stats(),
+        "intent": intent_stats(),
+        "llm_gateway": llm_gateway_stats(),
+        "benchmarks": market_benchmark_stats(),
+        "prefetch": prefetch_stats(),
+        "pools": all_pool_stats(),
+        "concurrency": {
+            "db_max": API_MAX_DB_CONCURRENCY,
+            "llm_max": API_MAX_LLM_CONCURRENCY,
+        },
+    }
@@ -0,0 +1,142 @@
+"""Cliente fino do serviço api.py, com as mesmas funções que o main.py usa localmente.
+
+Ativado quando ASSISTENTE_API_URL está definida (ex.: http://localhost:8000).
+"""
+import codecs
+import json
+import os
+from urllib.error import HTTPError
+from urllib.parse import quote, urlencode
+from urllib.request import Request, urlopen
+from models import ISPRecord
+from result_store import StoredResult
+
+ASSISTENTE_API_URL = os.getenv("ASSISTENTE_API_URL", "").rstrip("/")
+API_TIMEOUT = float(os.getenv("ASSISTENTE_API_TIMEOUT", "120"))
+# Enviado só para /stats, /telemetria e /metrics
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+
+class AdminUnavailable(Exception):
+    """Endpoint administrativo recusado: ADMIN_TOKEN ausente no serviço ou diferente do local"""
+
+
+class APIAnswer:
+    def __init__(self, text, result_id=None):
+        self.text = text
+        self.result_id = result_id
+
+
+def _request(method, path, payload=None, admin=False):
+    body = json.dumps(payload).encode("utf-8") if payload is not None else None
+    headers = {"Content-Type": "application/json"} if body else {}
+    if admin and ADMIN_TOKEN:
+        headers["X-Admin-Token"] = ADMIN_TOKEN
+    request = Request(f"{ASSISTENTE_API_URL}{path}", data=body, method=method, headers=headers)
+    return urlopen(request, timeout=API_TIMEOUT)
+
+
+def _admin_get(path):
+    try:
+        return _request("GET", path, admin=True)
+    except HTTPError as e:
+        if e.code in (403, 404):
+            raise AdminUnavailable(path) from e
+        raise
+
+
+def _json(method, path, payload=None):
+    with _request(method, path, payload) as response:
+        return json.loads(response.read().decode("utf-8"))
+
+
+def query_isp_info(identifier):
+    try:
+        payload = _json("GET", f"/isps/{quote(identifier.strip(), safe='')}")
+    except HTTPError as e:
+        if e.code == 404:
+            return None, json.loads(e.read().decode("utf-8"))["detail"]
+        raise
+    return ISPRecord.from_dict(payload["isp"]), payload["resposta"]
+
+
+def get_business_metrics(isp_data):
+    return _json("POST", "/metricas", {"isp": isp_data.to_dict()})["metricas"]
+
+
+def stream_follow_up_question(question, isp_data, business_metrics=None, use_cache=True):
+    """Lê a resposta do chat do serviço em pedaços, à medida que chegam"""
+    payload = {"question": question, "isp": isp_data.to_dict(), "stream": True, "use_cache": use_cache}
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    with _request("POST", "/chat", payload) as response:
+        while True:
+            chunk = response.read1(1024)
+            if not chunk:
+                break
+            text = decoder.decode(chunk)
+            if text:
+                yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def sql_query_result(question, isp_data=None):
+    payload = _json("POST", "/sql", {"question": question, "isp": isp_data.to_dict() if isp_data else None})
+    return APIAnswer(payload["resposta"], payload["result_id"])
+
+
+def get_result(result_id):
+    try:
+        payload = _json("GET", f"/sql/resultados/{quote(result_id, safe='')}")
+    except HTTPError as e:
+        if e.code == 404:
+            return None
+        raise
+    return StoredResult(
+        question=payload["question"],
+        query_type=payload["query_type"],
+        columns=payload["columns"],
+        rows=[tuple(row) for row in payload["rows"]],
+        total_rows=payload["total_rows"],
+        truncated=payload["truncated"],
+    )
+
+
+def suggest_isps(term, limit=8):
+    return _json("GET", f"/isps/sugestoes?{urlencode({'q': term, 'limit': limit})}")["sugestoes"]
+
+
+def _stats():
+    with _admin_get("/stats") as response:
+        return json.loads(response.read().decode("utf-8"))
+
+
+def telemetry_snapshot():
+    with _admin_get("/telemetria") as response:
+        return json.loads(response.read().decode("utf-8"))
+
+
+def prometheus_text():
+    with _admin_get("/metrics") as response:
+        return response.read().decode("utf-8")
+
+
+def metrics_cache_stats():
+    return _stats()["metrics_cache"]
+
+
+def llm_cache_stats():
+    return _stats()["llm_cache"]
+
+
+def intent_stats():
+    return _stats()["intent"]
+
+
+def llm_gateway_stats():
+    return _stats()["llm_gateway"]
+
+
+def prefetch_stats():
+    return _stats()["prefetch"]
@@ -0,0 +1,365 @@
+"""Benchmark offline do assistente: banco SQLite sintético e LLM falso determinístico.
+
+Uso:
+    python benchmark.py --accounts 10000 --price-rows 5000000 --output bench.json
+    python benchmark.py --compare bench.json
+
+Mede query_isp_info (CNPJ e Razão Social, pela CTE e pelo resumo),
+benchmarks de mercado, calculate_business_metrics, montagem do prompt, chat, SQLQueryAgent.query e
+exportação do chat; o resultado sai em JSON para comparar execuções.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date
+
+PRODUTOS = [
+    # (produto, valor unitário, método, tickets por pacote)
+    ("HBO MAX", 19.10, "Mínimo", 200),
+    ("WATCH LIGHT", 0.30, "Uso", 1000),
+    ("PARAMOUNT+ AVULSO", 4.80, "Mínimo", 500),
+    ("WATCH BRASIL", 9.90, "Mínimo", 300),
+    ("DEEZER", 6.50, "Uso", 400),
+]
+NOME_PARTES = (
+    ["Conexão", "Net", "Fibra", "Link", "Giga", "Mega", "Ultra", "Rede", "Tele", "Speed"],
+    ["Rápida", "Sul", "Norte", "Brasil", "Vale", "Serra", "Litoral", "Centro", "Total", "Prime"],
+    ["Telecom", "Internet", "Fibra", "Provedor", "Comunicações", "Digital"],
+)
+
+BENCH_SQL = "SELECT Name, CA_CNPJ__c FROM DIM_SF_CONTAS ORDER BY Name LIMIT 100"
+BENCH_ANSWER = (
+    "📈 **Análise de Performance**\n* Utilização abaixo do benchmark em HBO MAX.\n\n"
+    "💡 **Oportunidades**\n* Campanha de ativação para elevar a utilização.\n\n"
+    "📋 **Próximos Passos**\n1. Agendar reunião com o ISP."
+)
+
+
+def _cnpj(i):
+    return f"{10000000 + i:08d}0001{i % 100:02d}"
+
+
+def _nome(i):
+    a, b, c = NOME_PARTES
+    return f"{a[i % len(a)]} {b[(i // len(a)) % len(b)]} {c[(i // 7) % len(c)]} {i}"
+
+
+def _vencimento(months_ago):
+    year, month = divmod(2024 * 12 + 4 - months_ago, 12)
+    return date(year, month + 1, 10).isoformat()
+
+
+def build_synthetic_db(path, accounts, price_rows, seed=42, batch_size=50000):
+    """Cria (ou reaproveita, se a escala bater) o banco sintético"""
+    meta = {"accounts": accounts, "price_rows": price_rows, "seed": seed}
+    if os.path.exists(path):
+        conn = sqlite3.connect(path)
+        try:
+            row = conn.execute("SELECT value FROM bench_meta WHERE key = 'scale'").fetchone()
+            if row and json.loads(row[0]) == meta:
+                return False
+        except sqlite3.Error:
+            pass
+        finally:
+            conn.close()
+        os.remove(path)
+
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.executescript("""
+        CREATE TABLE bench_meta (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE DIM_SF_CONTAS (
+            Id TEXT PRIMARY KEY, CA_CNPJ__c TEXT, Name TEXT, CA_SituacaoFinanceira__c TEXT,
+            ERP__c TEXT, CA_DataUltFaturamento__c TEXT
+        );
+        CREATE TABLE COM_MATRIZ_PRECO_V2 (
+            isp_sf_id TEXT, produto_sf_code TEXT, pacote_id TEXT, pacote_valor_unit REAL,
+            valor_total REAL, isp_vencimento TEXT, isp_sf_status TEXT, tickets_contratados INTEGER,
+            tickets_distribuidos INTEGER, pacote_metodo TEXT, tickets_metodo INTEGER
+        );
+    """)
+    conn.executemany("INSERT INTO DIM_SF_CONTAS VALUES (?, ?, ?, ?, ?, ?)", (
+        (
+            f"001BENCH{i:07d}",
+            _cnpj(i),
+            _nome(i),
+            "Inadimplente" if rng.random() < 0.1 else "Adimplente",
+            rng.choice(["IXC", "SGP", "MK", "Voalle", None]),
+            _vencimento(rng.randint(0, 3)),
+        )
+        for i in range(accounts)
+    ))
+
+    per_account = max(1, price_rows // max(1, accounts))
+
+    def price_matrix():
+        produced = 0
+        for i in range(accounts):
+            sf_id = f"001BENCH{i:07d}"
+            status = "Suspenso" if rng.random() < 0.05 else "Ativo"
+            for k in range(per_account):
+                if produced >= price_rows:
+                    return
+                produto, valor_unit, metodo, pacote = PRODUTOS[k % len(PRODUTOS)]
+                contratados = pacote * rng.randint(1, 5)
+                yield (
+                    sf_id, produto, f"P{k % len(PRODUTOS) + 1}", valor_unit,
+                    round(contratados * valor_unit, 2), _vencimento(k // len(PRODUTOS)), status,
+                    contratados, rng.randint(0, contratados), metodo, contratados,
+                )
+                produced += 1
+
+    rows = price_matrix()
+    while True:
+        batch = [row for _, row in zip(range(batch_size), rows)]
+        if not batch:
+            break
+        conn.executemany("INSERT INTO COM_MATRIZ_PRECO_V2 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", batch)
+    conn.executescript("""
+        CREATE INDEX idx_contas_cnpj ON DIM_SF_CONTAS (CA_CNPJ__c);
+        CREATE INDEX idx_matriz_isp ON COM_MATRIZ_PRECO_V2 (isp_sf_id, produto_sf_code, isp_vencimento);
+    """)
+    conn.execute("INSERT INTO bench_meta VALUES ('scale', ?)", (json.dumps(meta),))
+    conn.commit()
+    conn.close()
+    return True
+
+
+def make_fake_llm(latency_ms=0.0):
+    """Chat model determinístico: SQL fixo para o agente, análise fixa para o chat"""
+    from langchain_core.language_models.chat_models import BaseChatModel
+    from langchain_core.messages import AIMessage, AIMessageChunk
+    from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+    class BenchmarkChatModel(BaseChatModel):
+        latency_ms: float = 0.0
+
+        @property
+        def _llm_type(self):
+            return "benchmark-fake"
+
+        def _respond(self, messages):
+            if self.latency_ms:
+                time.sleep(self.latency_ms / 1000)
+            prompt = messages[-1].content
+            return BENCH_SQL if "Gere uma query SQL" in prompt else BENCH_ANSWER
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._respond(messages)))])
+
+        def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+            for token in self._respond(messages).split(" "):
+                yield ChatGenerationChunk(message=AIMessageChunk(content=token + " "))
+
+    return BenchmarkChatModel(latency_ms=latency_ms)
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    n = len(ordered)
+    return {
+        "n": n,
+        "min_ms": round(ordered[0] * 1000, 3),
+        "p50_ms": round(ordered[n // 2] * 1000, 3),
+        "p95_ms": round(ordered[min(n - 1, int(n * 0.95))] * 1000, 3),
+        "mean_ms": round(sum(ordered) / n * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def timeit(func, args_list):
+    samples = []
+    for args in args_list:
+        started = time.perf_counter()
+        func(*args)
+        samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+
+def run_benchmarks(accounts, repeat, history, llm_latency_ms, seed=42):
+    # Importados só aqui: o ambiente (DATABASE_URL, caches) já aponta para o banco sintético
+    import utils
+    from langchain.prompts import ChatPromptTemplate
+    from main import build_chat_export
+    from history_store import refresh_history
+    from market_benchmarks import refresh_benchmarks
+    from name_index import ensure_name_index
+    from prompt_context import build_prompt_context
+    from sql_agent import SQLQueryAgent, evict_sql_cache
+    from summary_table import refresh_summary
+    from telemetry import reset_telemetry, telemetry_snapshot
+
+    utils.set_llm(make_fake_llm(llm_latency_ms))
+    rng = random.Random(seed)
+    sample = [rng.randrange(accounts) for _ in range(repeat)]
+    results = {}
+    reset_telemetry()
+
+    started = time.perf_counter()
+    ensure_name_index()
+    results["name_index_build"] = summarize([time.perf_counter() - started])
+
+    results["query_isp_info_cnpj"] = timeit(
+        lambda i: utils.query_isp_info(_cnpj(i), use_cache=False), [(i,) for i in sample]
+    )
+    utils.query_isp_info(_cnpj(sample[0]))
+    results["query_isp_info_cnpj_cache"] = timeit(
+        lambda i: utils.query_isp_info(_cnpj(i)), [(sample[0],)] * repeat
+    )
+    results["query_isp_info_nome"] = timeit(
+        lambda i: utils.query_isp_info(_nome(i), use_cache=False), [(i,) for i in sample]
+    )
+
+    # Mesmas buscas lendo da tabela de resumo (ISP_PRODUTO_ATUAL)
+    results["summary_refresh_full"] = timeit(lambda: refresh_summary(full=True), [()])
+    results["query_isp_info_cnpj_resumo"] = timeit(
+        lambda i: utils.query_isp_info(_cnpj(i), use_cache=False), [(i,) for i in sample]
+    )
+    results["query_isp_info_nome_resumo"] = timeit(
+        lambda i: utils.query_isp_info(_nome(i), use_cache=False), [(i,) for i in sample]
+    )
+
+    # Benchmarks de mercado: varredura completa e atualização incremental (sem linhas novas)
+    results["market_benchmarks_full"] = timeit(lambda: refresh_benchmarks(full=True), [()])
+    results["market_benchmarks_incremental"] = timeit(refresh_benchmarks, [()] * repeat)
+
+    isp_data, _ = utils.query_isp_info(_cnpj(sample[0]), use_cache=False)
+    if isp_data is None:
+        raise RuntimeError("banco sintético sem o ISP amostrado")
+    results["calculate_business_metrics"] = timeit(
+        utils.calculate_business_metrics, [(isp_data,)] * repeat
+    )
+
+    metrics = utils.calculate_business_metrics(isp_data)
+    prompt = ChatPromptTemplate.from_template(utils.FOLLOW_UP_PROMPT)
+    questions = [
+        "Qual produto tem maior potencial de crescimento?",
+        "Como está o faturamento e o vencimento?",
+        "Explique o método de cobrança do WATCH LIGHT",
+    ]
+
+    def build_prompt(question):
+        context = build_prompt_context(question, isp_data, metrics)
+        prompt.format_messages(isp_name=isp_data.nome, question=question, data=context.text)
+
+    results["prompt_construction"] = timeit(build_prompt, [(questions[i % len(questions)],) for i in range(repeat)])
+    results["process_follow_up_question"] = timeit(
+        lambda question: utils.process_follow_up_question(
+            question, isp_data, metrics, use_cache=False, use_fast_path=False
+        ),
+        [(questions[i % len(questions)],) for i in range(repeat)],
+    )
+    metric_questions = [
+        f"Qual a taxa de utilização do {isp_data.produtos[0].nome}?",
+        "Qual o faturamento total?",
+        "Quantos tickets contratados?",
+    ]
+    results["process_follow_up_question_local"] = timeit(
+        lambda question: utils.process_follow_up_question(question, isp_data, metrics, use_cache=False),
+        [(metric_questions[i % len(metric_questions)],) for i in range(repeat)],
+    )
+
+    agent = SQLQueryAgent(os.environ["DATABASE_URL"])
+
+    def sql_query(question, cached):
+        if not cached:
+            evict_sql_cache()
+        agent.query(question)
+
+    results["sql_agent_query"] = timeit(sql_query, [("Liste os ISPs por nome", False)] * repeat)
+    results["sql_agent_query_cache"] = timeit(sql_query, [("Liste os ISPs por nome", True)] * repeat)
+
+    # Perguntas de histórico respondidas pelos agregados mensais (ISP_PRODUTO_MENSAL)
+    results["history_refresh_full"] = timeit(lambda: refresh_history(full=True), [()])
+    results["sql_agent_historico"] = timeit(
+        lambda question: agent.query(question, isp_data),
+        [("Qual a evolução do faturamento no histórico?",)] * repeat,
+    )
+
+    messages = [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": questions[i % 3] if i % 2 == 0 else BENCH_ANSWER}
+        for i in range(history)
+    ]
+    results["export_chat"] = timeit(build_chat_export, [(messages, isp_data)] * max(1, repeat // 4))
+    return results, telemetry_snapshot()
+
+
+def compare(results, baseline):
+    """Razão p50 atual / base por cenário (> 1 indica regressão)"""
+    comparison = {}
+    for name, current in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if previous and previous.get("p50_ms"):
+            comparison[name] = round(current["p50_ms"] / previous["p50_ms"], 3)
+    return comparison
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark offline com banco sintético e LLM falso")
+    parser.add_argument("--accounts", type=int, default=10000, help="contas em DIM_SF_CONTAS")
+    parser.add_argument("--price-rows", type=int, default=500000, help="linhas em COM_MATRIZ_PRECO_V2")
+    parser.add_argument("--db", help="arquivo SQLite (reaproveitado se a escala for a mesma)")
+    parser.add_argument("--repeat", type=int, default=30, help="execuções por cenário")
+    parser.add_argument("--history", type=int, default=5000, help="mensagens no chat exportado")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="latência simulada do LLM falso")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", "-o", help="grava o JSON neste arquivo (padrão: stdout)")
+    parser.add_argument("--compare", help="JSON de uma execução anterior para comparar")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="assistente-bench-")
+    db_path = os.path.abspath(args.db or os.path.join(workdir, "bench.sqlite3"))
+    started = time.perf_counter()
+    built = build_synthetic_db(db_path, args.accounts, args.price_rows, args.seed)
+    setup_s = time.perf_counter() - started
+
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    os.environ["LLM_CACHE_DISABLED"] = "1"
+    os.environ["LLM_CACHE_PATH"] = os.path.join(workdir, "llm_cache.sqlite3")
+    os.environ["SCHEMA_CACHE_DIR"] = workdir
+    os.environ.setdefault("GROQ_API_KEY", "benchmark")
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "accounts": args.accounts,
+            "price_rows": args.price_rows,
+            "repeat": args.repeat,
+            "history": args.history,
+            "llm_latency_ms": args.llm_latency_ms,
+            "db_built": built,
+            "db_setup_s": round(setup_s, 3),
+        },
+    }
+    report["results"], report["telemetry"] = run_benchmarks(
+        args.accounts, args.repeat, args.history, args.llm_latency_ms, args.seed
+    )
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            report["comparison_p50"] = compare(report["results"], json.load(f))
+
+    if not args.db:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+CHAT_STORE_PATH = os.getenv("CHAT_STORE_PATH", os.path.join(".cache", "chat_store.sqlite3"))
+# Sessões sem atividade há mais que isso são apagadas
+CHAT_STORE_TTL = int(os.getenv("CHAT_STORE_TTL", str(30 * 24 * 3600)))
+CHAT_EXPORT_BATCH = int(os.getenv("CHAT_EXPORT_BATCH", "200"))
+
+
+class ChatStore:
+    """Histórico persistente (SQLite) das conversas: a sessão do Streamlit guarda só uma janela recente"""
+
+    def __init__(self, path=CHAT_STORE_PATH, ttl=CHAT_STORE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._writes = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS chat_sessions (
+                session_id TEXT PRIMARY KEY,
+                isp_sf_id TEXT,
+                isp_nome TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS chat_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL REFERENCES chat_sessions (session_id) ON DELETE CASCADE,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                result_id TEXT,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_chat_messages_session ON chat_messages (session_id, id);
+            CREATE INDEX IF NOT EXISTS idx_chat_sessions_updated ON chat_sessions (updated_at);
+        """)
+        self._conn.commit()
+
+    @staticmethod
+    def _message(row):
+        message = {"id": row[0], "role": row[1], "content": row[2]}
+        if row[3]:
+            message["result_id"] = row[3]
+        return message
+
+    def create_session(self, isp_data=None):
+        session_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO chat_sessions (session_id, isp_sf_id, isp_nome, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (session_id, getattr(isp_data, "sf_id", None), getattr(isp_data, "nome", None), now, now)
+            )
+            self._writes += 1
+            # Limpeza periódica para não pagar a varredura a cada escrita
+            if self._writes % 50 == 1:
+                self._conn.execute("DELETE FROM chat_sessions WHERE updated_at < ?", (now - self.ttl,))
+            self._conn.commit()
+        return session_id
+
+    def get_session(self, session_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT session_id, isp_sf_id, isp_nome, created_at, updated_at FROM chat_sessions WHERE session_id = ?",
+                (session_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("session_id", "isp_sf_id", "isp_nome", "created_at", "updated_at"), row))
+
+    def append(self, session_id, message):
+        """Grava a mensagem e devolve uma cópia com o id atribuído pelo banco"""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO chat_messages (session_id, role, content, result_id, created_at) VALUES (?, ?, ?, ?, ?)",
+                (session_id, message["role"], message["content"], message.get("result_id"), now)
+            )
+            self._conn.execute("UPDATE chat_sessions SET updated_at = ? WHERE session_id = ?", (now, session_id))
+            self._conn.commit()
+        return {**message, "id": cursor.lastrowid}
+
+    def recent(self, session_id, limit, before_id=None):
+        """As `limit` mensagens mais recentes (anteriores a before_id, se informado), em ordem cronológica"""
+        query = "SELECT id, role, content, result_id FROM chat_messages WHERE session_id = ?"
+        params = [session_id]
+        if before_id is not None:
+            query += " AND id < ?"
+            params.append(before_id)
+        query += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [self._message(row) for row in reversed(rows)]
+
+    def has_older(self, session_id, before_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM chat_messages WHERE session_id = ? AND id < ? LIMIT 1", (session_id, before_id)
+            ).fetchone()
+        return row is not None
+
+    def count(self, session_id):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM chat_messages WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+
+    def iter_messages(self, session_id, batch_size=CHAT_EXPORT_BATCH):
+        """Todas as mensagens da sessão em lotes (paginação por id, sem carregar o histórico inteiro)"""
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT id, role, content, result_id FROM chat_messages "
+                    "WHERE session_id = ? AND id > ? ORDER BY id LIMIT ?",
+                    (session_id, last_id, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield self._message(row)
+            last_id = rows[-1][0]
+
+    def top_isps(self, since, limit):
+        """ISPs com mais conversas abertas desde `since`: [(sf_id, conversas)]"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT isp_sf_id, COUNT(*) FROM chat_sessions WHERE created_at >= ? AND isp_sf_id IS NOT NULL "
+                "GROUP BY isp_sf_id ORDER BY COUNT(*) DESC LIMIT ?",
+                (since, limit)
+            ).fetchall()
+
+    def stats(self):
+        with self._lock:
+            sessions = self._conn.execute("SELECT COUNT(*) FROM chat_sessions").fetchone()[0]
+            messages = self._conn.execute("SELECT COUNT(*) FROM chat_messages").fetchone()[0]
+        return {"sessions": sessions, "messages": messages, "ttl": self.ttl}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_chat_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ChatStore()
+    return _store
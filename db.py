@@ -0,0 +1,162 @@
+import os
+import threading
+import time
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+
+# Registro de engines por processo: (nome, url) -> Engine
+_engines = {}
+_lock = threading.Lock()
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+def env_bool(name, default):
+    value = os.getenv(name)
+    if value in (None, ""):
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "sim", "on")
+
+
+class PoolStats:
+    """Contadores de uso do pool de conexões"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.connect_time_total = 0.0
+        self.connect_time_max = 0.0
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def record_connect(self, elapsed):
+        with self._lock:
+            self.connects += 1
+            self.connect_time_total += elapsed
+            self.connect_time_max = max(self.connect_time_max, elapsed)
+
+    def record_checkout(self, elapsed, waited):
+        with self._lock:
+            self.checkouts += 1
+            if waited:
+                self.waits += 1
+                self.wait_time_total += elapsed
+                self.wait_time_max = max(self.wait_time_max, elapsed)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "connects": self.connects,
+                "connect_time_avg_ms": (self.connect_time_total / self.connects * 1000) if self.connects else 0.0,
+                "connect_time_max_ms": self.connect_time_max * 1000,
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "wait_time_total_ms": self.wait_time_total * 1000,
+                "wait_time_max_ms": self.wait_time_max * 1000,
+            }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool que mede tempo de conexão e esperas por conexão livre"""
+
+    stats = None
+
+    def _saturated(self):
+        return self._pool.empty() and -1 < self._max_overflow <= self._overflow
+
+    def _do_get(self):
+        waited = self._saturated()
+        started = time.perf_counter()
+        conn = super()._do_get()
+        if self.stats is not None:
+            self.stats.record_checkout(time.perf_counter() - started, waited)
+        return conn
+
+    def _create_connection(self):
+        started = time.perf_counter()
+        record = super()._create_connection()
+        if self.stats is not None:
+            self.stats.record_connect(time.perf_counter() - started)
+        return record
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+def get_pool_config(**overrides):
+    """Configuração do pool a partir das variáveis de ambiente DB_POOL_*"""
+    config = {
+        "pool_size": _env_int("DB_POOL_SIZE", 5),
+        "max_overflow": _env_int("DB_MAX_OVERFLOW", 10),
+        "pool_timeout": _env_int("DB_POOL_TIMEOUT", 30),
+        "pool_recycle": _env_int("DB_POOL_RECYCLE", 1800),
+        "pool_pre_ping": env_bool("DB_POOL_PRE_PING", True),
+    }
+    config.update(overrides)
+    return config
+
+
+def get_engine(database_url=None, name="default", **pool_overrides):
+    """Retorna a engine compartilhada do processo para a URL informada.
+
+    A primeira chamada cria a engine com pool configurável; as seguintes
+    reutilizam o mesmo pool. `name` permite pools separados para a mesma URL.
+    """
+    url = database_url or os.getenv("DATABASE_URL")
+    key = (name, url)
+    engine = _engines.get(key)
+    if engine is None:
+        with _lock:
+            engine = _engines.get(key)
+            if engine is None:
+                engine = create_engine(
+                    url,
+                    poolclass=InstrumentedQueuePool,
+                    **get_pool_config(**pool_overrides)
+                )
+                engine.pool.stats = PoolStats()
+                _engines[key] = engine
+    return engine
+
+
+def pool_stats(name="default", database_url=None):
+    """Estatísticas em tempo real do pool da engine registrada"""
+    url = database_url or os.getenv("DATABASE_URL")
+    engine = _engines.get((name, url))
+    if engine is None:
+        return None
+    return _describe(engine)
+
+
+def all_pool_stats():
+    with _lock:
+        engines = dict(_engines)
+    return {name: _describe(engine) for (name, _url), engine in engines.items()}
+
+
+def _describe(engine):
+    pool = engine.pool
+    stats = {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow(),
+    }
+    if pool.stats is not None:
+        stats.update(pool.stats.snapshot())
+    return stats
+
+
+def dispose_engines():
+    """Fecha todos os pools registrados (útil em testes e no shutdown)"""
+    with _lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
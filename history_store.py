@@ -0,0 +1,271 @@
+"""Agregados mensais por ISP e produto (ISP_PRODUTO_MENSAL) para perguntas de histórico/evolução.
+
+Cada linha soma, para um ISP, produto e mês de vencimento, os tickets
+contratados e distribuídos e o valor faturado de COM_MATRIZ_PRECO_V2. A
+atualização é incremental (incremental_table): só os meses dos ISPs com linhas
+a partir da marca d'água (ISP_SUMMARY_UPDATED_COLUMN ou isp_vencimento) são
+recalculados.
+As perguntas de histórico são respondidas direto desses agregados, com
+tendência e variação mês a mês, sem SQL gerado pelo LLM.
+
+Uso:
+    python history_store.py           # cria a tabela (se preciso) e atualiza
+    python history_store.py --full    # reconstrói do zero
+"""
+import os
+import re
+import sys
+from sqlalchemy import Column, Float, Index, Integer, MetaData, String, Table, and_, bindparam, func, select, text
+from db import env_bool, get_engine
+from incremental_table import IncrementalTable, run_cli
+from intent import match_products
+from models import format_currency
+from name_index import fold
+
+HISTORY_ENABLED = env_bool("ISP_HISTORY_ENABLED", True)
+HISTORY_REFRESH_SECONDS = int(os.getenv("ISP_HISTORY_REFRESH_SECONDS", "3600"))
+HISTORY_FULL_REFRESH_SECONDS = int(os.getenv("ISP_HISTORY_FULL_REFRESH_SECONDS", str(24 * 3600)))
+HISTORY_CHUNK_SIZE = int(os.getenv("ISP_HISTORY_CHUNK_SIZE", "500"))
+HISTORY_DEFAULT_MONTHS = int(os.getenv("ISP_HISTORY_DEFAULT_MONTHS", "12"))
+HISTORY_TABLE = "ISP_PRODUTO_MENSAL"
+
+metadata = MetaData()
+history = Table(
+    HISTORY_TABLE, metadata,
+    Column("isp_sf_id", String(18), primary_key=True),
+    Column("produto_sf_code", String(255), primary_key=True),
+    Column("mes", String(7), primary_key=True),  # AAAA-MM do isp_vencimento
+    Column("tickets_contratados", Integer),
+    Column("tickets_distribuidos", Integer),
+    Column("valor_total", Float),
+    Column("linhas", Integer),
+    Index(f"idx_{HISTORY_TABLE.lower()}_mes", "mes"),
+)
+_table = IncrementalTable(
+    history, HISTORY_ENABLED, HISTORY_REFRESH_SECONDS, HISTORY_FULL_REFRESH_SECONDS,
+    lambda engine, full: refresh_history(engine, full=full),
+)
+history_meta = _table.meta
+
+# Mesmo agrupamento de REFRESH_QUERY (MAX dos tickets por pacote, vencimento e método):
+# itens repetidos do mesmo pacote não dobram os tickets em relação ao prontuário
+_ROWS_QUERY = """
+    SELECT
+        isp_sf_id,
+        produto_sf_code,
+        isp_vencimento,
+        MAX(tickets_contratados) as tickets_contratados,
+        MAX(tickets_distribuidos) as tickets_distribuidos,
+        SUM(valor_total) as valor_total,
+        COUNT(*) as linhas
+    FROM COM_MATRIZ_PRECO_V2
+    WHERE isp_sf_id IN :ids AND produto_sf_code IS NOT NULL AND isp_vencimento >= :desde
+    GROUP BY
+        isp_sf_id,
+        produto_sf_code,
+        pacote_id,
+        pacote_valor_unit,
+        isp_vencimento,
+        isp_sf_status,
+        pacote_metodo,
+        tickets_metodo
+"""
+
+def _month(vencimento):
+    return str(vencimento)[:7]
+
+
+def _refresh_chunk(conn, changed):
+    """Recalcula, para cada ISP do lote, os meses a partir do primeiro mês alterado"""
+    since_by_isp = {sf_id: since for sf_id, since in changed}
+    # Do primeiro dia do mês: o mês inteiro é recalculado, não só as linhas alteradas
+    desde = min(_month(since) for since in since_by_isp.values()) + "-01"
+    query = text(_ROWS_QUERY).bindparams(bindparam("ids", expanding=True))
+    totals = {}
+    for sf_id, produto, vencimento, contratados, distribuidos, valor, linhas in conn.execute(
+        query, {"ids": list(since_by_isp), "desde": desde}
+    ):
+        mes = _month(vencimento)
+        if mes < _month(since_by_isp[sf_id]):
+            continue
+        row = totals.get((sf_id, produto, mes))
+        if row is None:
+            row = totals[(sf_id, produto, mes)] = [0, 0, 0.0, 0]
+        row[0] += contratados or 0
+        row[1] += distribuidos or 0
+        row[2] += valor or 0.0
+        row[3] += linhas
+
+    for sf_id, since in since_by_isp.items():
+        conn.execute(history.delete().where(and_(history.c.isp_sf_id == sf_id, history.c.mes >= _month(since))))
+    if totals:
+        conn.execute(history.insert(), [
+            {
+                "isp_sf_id": sf_id, "produto_sf_code": produto, "mes": mes, "tickets_contratados": contratados,
+                "tickets_distribuidos": distribuidos, "valor_total": valor, "linhas": linhas,
+            }
+            for (sf_id, produto, mes), (contratados, distribuidos, valor, linhas) in totals.items()
+        ])
+    return len(totals)
+
+
+def refresh_history(engine=None, full=False, chunk_size=HISTORY_CHUNK_SIZE):
+    """Cria a tabela se preciso e recalcula os meses alterados desde a última marca d'água"""
+    # Primeiro vencimento alterado por ISP: dali em diante os meses são recalculados
+    report, _changed = _table.refresh(
+        engine, full, chunk_size,
+        "SELECT isp_sf_id, MIN(isp_vencimento) FROM COM_MATRIZ_PRECO_V2 "
+        "WHERE {condition} AND isp_vencimento IS NOT NULL GROUP BY isp_sf_id",
+        _refresh_chunk,
+    )
+    return report
+
+
+def mark_history_unavailable():
+    _table.mark_unavailable()
+
+
+def history_available(engine=None, recheck_seconds=60):
+    """True se os agregados existem; dispara a atualização em segundo plano quando expiram"""
+    return _table.available(engine, recheck_seconds)
+
+
+def monthly_series(engine=None, sf_id=None, produtos=None, months=HISTORY_DEFAULT_MONTHS):
+    """Totais por mês (dos últimos `months` meses com dados), opcionalmente de um ISP e de alguns produtos"""
+    engine = engine or get_engine()
+    conditions = []
+    if sf_id:
+        conditions.append(history.c.isp_sf_id == sf_id)
+    if produtos:
+        conditions.append(history.c.produto_sf_code.in_(produtos))
+    query = (
+        select(
+            history.c.mes,
+            func.sum(history.c.tickets_contratados),
+            func.sum(history.c.tickets_distribuidos),
+            func.sum(history.c.valor_total),
+        )
+        .where(*conditions)
+        .group_by(history.c.mes)
+        .order_by(history.c.mes.desc())
+        .limit(months)
+    )
+    with engine.connect() as conn:
+        rows = conn.execute(query).fetchall()
+    return [
+        {
+            "mes": mes,
+            "tickets_contratados": int(contratados or 0),
+            "tickets_distribuidos": int(distribuidos or 0),
+            "utilizacao": (distribuidos or 0) / contratados if contratados else 0.0,
+            "valor_total": float(valor or 0.0),
+        }
+        for mes, contratados, distribuidos, valor in reversed(rows)
+    ]
+
+
+# Métrica em foco na pergunta: (chave, rótulo, palavras)
+_FOCUS = [
+    ("utilizacao", "utilização", ["utilizacao", "uso", "ativacao"]),
+    ("tickets_contratados", "tickets contratados", ["contratados", "contratacao"]),
+    ("tickets_distribuidos", "tickets distribuídos", ["distribuidos", "tickets"]),
+    ("valor_total", "valor faturado", ["faturamento", "faturado", "receita", "valor"]),
+]
+_MONTHS_PATTERN = re.compile(r"(?:ultimos|ultimas)\s+(\d{1,2})\s+mes")
+
+
+def _focus(folded):
+    for key, label, words in _FOCUS:
+        if any(re.search(rf"(?<!\w){word}", folded) for word in words):
+            return key, label
+    return "valor_total", "valor faturado"
+
+
+def _format_value(key, value):
+    if key == "utilizacao":
+        return f"{value:.1%}"
+    if key == "valor_total":
+        return format_currency(value)
+    return f"{value:,}"
+
+
+def _trend(series, key):
+    """Direção pela inclinação da reta (mínimos quadrados), relativa à média do período"""
+    values = [point[key] for point in series]
+    n = len(values)
+    mean_x, mean_y = (n - 1) / 2, sum(values) / n
+    variance = sum((x - mean_x) ** 2 for x in range(n))
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in enumerate(values)) / variance if variance else 0.0
+    relative = slope / abs(mean_y) if mean_y else 0.0
+    if relative > 0.01:
+        return f"📈 Tendência de alta (≈ {relative:+.1%} ao mês)"
+    if relative < -0.01:
+        return f"📉 Tendência de queda (≈ {relative:+.1%} ao mês)"
+    return "➡️ Estável no período"
+
+
+def format_history(series, key, label, title):
+    first, last = series[0], series[-1]
+    linhas = [
+        f"📊 **Evolução — {title}** ({first['mes']} a {last['mes']})",
+        "",
+        "| Mês | Tickets contratados | Tickets distribuídos | Utilização | Valor faturado | Δ mês anterior |",
+        "|---|---:|---:|---:|---:|---:|",
+    ]
+    previous = None
+    for point in series:
+        delta = "—"
+        if previous is not None:
+            change = point[key] - previous[key]
+            delta = f"{change * 100:+.1f} p.p." if key == "utilizacao" else (
+                f"{change / previous[key]:+.1%}" if previous[key] else _format_value(key, change)
+            )
+        linhas.append(
+            f"| {point['mes']} | {point['tickets_contratados']:,} | {point['tickets_distribuidos']:,} | "
+            f"{point['utilizacao']:.1%} | {format_currency(point['valor_total'])} | {delta} |"
+        )
+        previous = point
+    resumo = [
+        "",
+        f"**{label.capitalize()}:** {_format_value(key, first[key])} → {_format_value(key, last[key])}",
+    ]
+    if len(series) > 1:
+        resumo.append(_trend(series, key))
+        best = max(series, key=lambda point: point[key])
+        worst = min(series, key=lambda point: point[key])
+        resumo.append(f"Melhor mês: {best['mes']} ({_format_value(key, best[key])}) · "
+                      f"pior mês: {worst['mes']} ({_format_value(key, worst[key])})")
+    resumo.append("")
+    resumo.append("💡 Calculado dos agregados mensais (ISP_PRODUTO_MENSAL).")
+    return "\n".join(linhas + resumo)
+
+
+def answer_history(question, isp_data=None, engine=None):
+    """Resposta de histórico/evolução a partir dos agregados; None quando não dá para responder por eles"""
+    engine = engine or get_engine()
+    if not history_available(engine):
+        return None
+    folded = fold(question)
+    months = _MONTHS_PATTERN.search(folded)
+    months = max(1, min(int(months.group(1)), 60)) if months else HISTORY_DEFAULT_MONTHS
+    produtos = match_products(folded, [produto.nome for produto in isp_data.produtos]) if isp_data else []
+    try:
+        series = monthly_series(engine, isp_data.sf_id if isp_data else None, produtos, months)
+    except Exception:
+        mark_history_unavailable()
+        return None
+    if not series:
+        return None
+    key, label = _focus(folded)
+    title = isp_data.nome if isp_data else "todos os ISPs"
+    if produtos:
+        title += " · " + ", ".join(produtos)
+    return format_history(series, key, label, title)
+
+
+def main(argv=None):
+    return run_cli(f"Atualiza os agregados mensais {HISTORY_TABLE}", refresh_history, HISTORY_CHUNK_SIZE, argv)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""Perfil de tempo de importação (python -X importtime) dos módulos do assistente.
+
+Uso:
+    python import_profile.py                      # perfil de `import main`
+    python import_profile.py utils sql_agent --top 15
+    python import_profile.py --budget-ms 1500     # sai com código 1 se estourar
+
+Cada módulo é importado em um processo novo (cold start), sem caches de
+importação já aquecidos pelo próprio script.
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+_LINE_PATTERN = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( +)(\S+)\s*$")
+
+
+def profile_import(module, python=sys.executable, cwd=None):
+    """Importa `module` em um subprocesso e devolve as linhas do importtime"""
+    completed = subprocess.run(
+        [python, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd or os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+    )
+    entries = []
+    for line in completed.stderr.splitlines():
+        match = _LINE_PATTERN.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append({
+                "module": name,
+                "depth": (len(indent) - 1) // 2,
+                "self_ms": int(self_us) / 1000,
+                "cumulative_ms": int(cumulative_us) / 1000,
+            })
+    if completed.returncode != 0:
+        raise RuntimeError(f"falha ao importar {module}:\n{completed.stderr[-2000:]}")
+    return entries
+
+
+def summarize(module, entries, top=20):
+    target = next((e for e in reversed(entries) if e["module"] == module and e["depth"] == 0), None)
+    by_package = {}
+    for entry in entries:
+        package = entry["module"].split(".")[0]
+        by_package[package] = by_package.get(package, 0.0) + entry["self_ms"]
+    return {
+        "module": module,
+        "total_ms": round(target["cumulative_ms"] if target else sum(e["self_ms"] for e in entries), 1),
+        "modules_imported": len(entries),
+        "slowest_cumulative": [
+            {"module": e["module"], "ms": round(e["cumulative_ms"], 1)}
+            for e in sorted(entries, key=lambda e: e["cumulative_ms"], reverse=True)[:top]
+        ],
+        "slowest_self": [
+            {"module": e["module"], "ms": round(e["self_ms"], 1)}
+            for e in sorted(entries, key=lambda e: e["self_ms"], reverse=True)[:top]
+        ],
+        "by_package": [
+            {"package": package, "ms": round(ms, 1)}
+            for package, ms in sorted(by_package.items(), key=lambda item: item[1], reverse=True)[:top]
+        ],
+    }
+
+
+def _print_report(report, budget_ms=None):
+    status = ""
+    if budget_ms:
+        status = "  ✅ dentro do orçamento" if report["total_ms"] <= budget_ms else f"  ❌ acima de {budget_ms:.0f} ms"
+    print(f"\n== import {report['module']}: {report['total_ms']:.1f} ms ({report['modules_imported']} módulos){status}")
+    print("-- pacotes (tempo próprio somado)")
+    for item in report["by_package"]:
+        print(f"   {item['ms']:9.1f} ms  {item['package']}")
+    print("-- importações mais lentas (acumulado)")
+    for item in report["slowest_cumulative"]:
+        print(f"   {item['ms']:9.1f} ms  {item['module']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perfil de tempo de importação (cold start)")
+    parser.add_argument("modules", nargs="*", default=["main"], help="módulos a importar (padrão: main)")
+    parser.add_argument("--top", type=int, default=15, help="quantidade de itens por ranking")
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", "0")),
+                        help="orçamento por módulo; acima dele o script sai com código 1")
+    parser.add_argument("--json", action="store_true", help="saída em JSON")
+    args = parser.parse_args(argv)
+
+    reports = [summarize(module, profile_import(module), args.top) for module in args.modules]
+    if args.json:
+        print(json.dumps(reports, ensure_ascii=False, indent=2))
+    else:
+        for report in reports:
+            _print_report(report, args.budget_ms)
+    over_budget = args.budget_ms and any(report["total_ms"] > args.budget_ms for report in reports)
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
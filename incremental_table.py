@@ -0,0 +1,162 @@
+"""Base das tabelas derivadas de COM_MATRIZ_PRECO_V2 atualizadas por marca d'água.
+
+Cada tabela tem uma tabela irmã <NOME>_META (chave/valor) com a marca d'água e
+o horário da última atualização. A cada atualização, os ISPs com linhas cujo
+marcador (ISP_SUMMARY_UPDATED_COLUMN ou isp_vencimento) chegou à marca d'água
+são recalculados em lotes; a disponibilidade é verificada pela META e a
+atualização é disparada em segundo plano quando expira. Como o marcador não
+enxerga edições em linhas antigas, a tabela é reconstruída do zero
+periodicamente (full_refresh_seconds).
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from sqlalchemy import Column, String, Table, text
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from db import get_engine
+
+# Coluna de alteração em COM_MATRIZ_PRECO_V2 (ex.: updated_at); sem ela usa isp_vencimento
+ISP_SUMMARY_UPDATED_COLUMN = os.getenv("ISP_SUMMARY_UPDATED_COLUMN", "")
+
+
+def marker_column():
+    return ISP_SUMMARY_UPDATED_COLUMN or "isp_vencimento"
+
+
+class IncrementalTable:
+    """Tabela derivada com META, marca d'água e estado de disponibilidade"""
+
+    def __init__(self, table, enabled, refresh_seconds, full_refresh_seconds, updater):
+        """updater(engine, full): atualização da tabela, disparada quando a META expira"""
+        self.table = table
+        self.meta = Table(
+            f"{table.name}_META", table.metadata,
+            Column("chave", String(64), primary_key=True),
+            Column("valor", String(255)),
+        )
+        self.enabled = enabled
+        self.refresh_seconds = refresh_seconds
+        self.full_refresh_seconds = full_refresh_seconds
+        self._updater = updater
+        self.refresh_lock = threading.Lock()
+        self._state = {"available": None, "checked_at": 0.0, "refreshed_at": None}
+        self._state_lock = threading.Lock()
+
+    def read_meta(self, conn):
+        return {row[0]: row[1] for row in conn.execute(self.meta.select())}
+
+    def write_meta(self, conn, **values):
+        for key, value in values.items():
+            conn.execute(self.meta.delete().where(self.meta.c.chave == key))
+            conn.execute(self.meta.insert().values(chave=key, valor=None if value is None else str(value)))
+
+    def refresh(self, engine, full, chunk_size, changed_query, refresh_chunk):
+        """Recalcula os ISPs alterados desde a última marca d'água.
+
+        changed_query: SELECT com isp_sf_id na primeira coluna e {condition} no WHERE.
+        refresh_chunk(conn, rows): recalcula um lote dessas linhas e devolve quantas gravou.
+        Na reconstrução completa, a limpeza e todos os lotes vão em uma única transação.
+        """
+        engine = engine or get_engine()
+        started = time.perf_counter()
+        self.table.metadata.create_all(engine, checkfirst=True)
+        marker = marker_column()
+
+        with self.refresh_lock:
+            with engine.connect() as conn:
+                watermark = None if full else self.read_meta(conn).get("watermark")
+                # Marca lida antes da varredura: o que chegar durante a atualização entra na próxima
+                new_watermark = conn.execute(text(f"SELECT MAX({marker}) FROM COM_MATRIZ_PRECO_V2")).scalar()
+                condition, params = "isp_sf_id IS NOT NULL", {}
+                if watermark is not None:
+                    # >= reprocessa a fronteira: linhas com a mesma marca gravadas depois não se perdem
+                    condition += f" AND {marker} >= :watermark"
+                    params["watermark"] = watermark
+                changed = conn.execute(text(changed_query.format(condition=condition)), params).fetchall()
+
+            written = 0
+            if watermark is None:
+                # Reconstrução em uma transação: as consultas seguem vendo a tabela anterior até o commit
+                with engine.begin() as conn:
+                    conn.execute(self.table.delete())
+                    for start in range(0, len(changed), chunk_size):
+                        written += refresh_chunk(conn, changed[start:start + chunk_size])
+            else:
+                for start in range(0, len(changed), chunk_size):
+                    with engine.begin() as conn:
+                        written += refresh_chunk(conn, changed[start:start + chunk_size])
+
+            refreshed_at = time.time()
+            values = {"watermark": new_watermark if new_watermark is not None else watermark, "refreshed_at": refreshed_at}
+            if watermark is None:
+                values["full_refreshed_at"] = refreshed_at
+            with engine.begin() as conn:
+                self.write_meta(conn, **values)
+
+        with self._state_lock:
+            self._state.update(available=True, checked_at=time.monotonic(), refreshed_at=refreshed_at)
+        report = {
+            "modo": "completo" if watermark is None else "incremental",
+            "isps_recalculados": len(changed),
+            "linhas": written,
+            "marca_dagua": None if new_watermark is None else str(new_watermark),
+            "duracao_s": round(time.perf_counter() - started, 3),
+        }
+        return report, [row[0] for row in changed]
+
+    def refresh_in_background(self, full=False):
+        """Atualiza sempre pela engine padrão: pools dedicados (ex.: prefetch) não seguram a carga"""
+        if self.refresh_lock.locked():
+            return
+        def run():
+            try:
+                self._updater(get_engine(), full)
+            except Exception:
+                self.mark_unavailable()
+        threading.Thread(target=run, name=f"{self.table.name.lower()}-refresh", daemon=True).start()
+
+    def mark_unavailable(self):
+        with self._state_lock:
+            self._state.update(available=False, checked_at=time.monotonic())
+
+    def available(self, engine=None, recheck_seconds=60):
+        """True se a tabela já foi carregada; dispara a atualização em segundo plano quando expira"""
+        if not self.enabled:
+            return False
+        now = time.monotonic()
+        with self._state_lock:
+            available, checked_at = self._state["available"], self._state["checked_at"]
+        if available is None or now - checked_at > recheck_seconds:
+            engine = engine or get_engine()
+            try:
+                with engine.connect() as conn:
+                    meta = self.read_meta(conn)
+            except PoolTimeout:
+                # Pool esgotado não diz nada sobre a tabela: mantém o estado anterior
+                return bool(available)
+            except Exception:
+                meta = {}
+            refreshed_at, full_refreshed_at = meta.get("refreshed_at"), meta.get("full_refreshed_at")
+            available = refreshed_at is not None
+            with self._state_lock:
+                self._state.update(
+                    available=available,
+                    checked_at=now,
+                    refreshed_at=float(refreshed_at) if refreshed_at else None,
+                )
+            if available and time.time() - float(refreshed_at) > self.refresh_seconds:
+                full = not full_refreshed_at or time.time() - float(full_refreshed_at) > self.full_refresh_seconds
+                self.refresh_in_background(full)
+        return available
+
+
+def run_cli(description, refresh, chunk_size, argv=None):
+    """CLI comum: --full reconstrói do zero; imprime o relatório da atualização em JSON"""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--full", action="store_true", help="reconstrói a tabela do zero")
+    parser.add_argument("--chunk-size", type=int, default=chunk_size, help="ISPs por transação")
+    args = parser.parse_args(argv)
+    print(json.dumps(refresh(full=args.full, chunk_size=args.chunk_size), ensure_ascii=False))
+    return 0
@@ -0,0 +1,231 @@
+"""Respostas locais (sem LLM) para perguntas diretas sobre as métricas do ISP.
+
+Casa o nome do produto e o vocabulário das métricas já calculadas por
+calculate_business_metrics; perguntas abertas (estratégia, explicações,
+comparações) continuam indo para o LLM.
+"""
+import re
+import threading
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+from models import format_currency
+from name_index import fold
+
+# Pedem raciocínio, não um número: sempre vão para o LLM
+OPEN_ENDED = [
+    "por que", "porque", "como melhorar", "como aumentar", "o que fazer", "estrategia", "sugira", "sugestao",
+    "recomenda", "devo", "explique", "explica", "o que significa", "como funciona", "analise", "compare",
+    "comparar", "plano", "historico", "evolucao", "tendencia", "maior", "menor", "melhor", "pior",
+    # Perguntas técnicas (tipo "tecnico" de prompt_context) e de distância até uma meta
+    "o que e", "o que sao", "conceito", "significa", "faltam", "falta para", "quanto falta", "para bater",
+    "para atingir", "para alcancar", "para chegar",
+]
+# Pedem explicitamente todos os produtos (intenções por produto sem produto citado)
+ALL_PRODUCTS = ["todos", "todas", "cada produto", "por produto", "produtos"]
+# Palavras de nomes de produto que não identificam um produto sozinhas
+GENERIC_PRODUCT_WORDS = {"max", "plus", "avulso", "light", "premium", "basico", "pacote", "plano"}
+
+
+def _percent(value):
+    return f"{value:.1%}"
+
+
+@dataclass
+class MetricIntent:
+    key: str
+    keywords: List[str]
+    title: str
+    por_produto: bool
+    render: Callable
+
+
+def _render_utilizacao(nome, m, produto, isp_data):
+    diferenca = (m["utilizacao_atual"] - m["benchmark_utilizacao"]) * 100
+    return [
+        f"Utilização atual: {_percent(m['utilizacao_atual'])} "
+        f"({produto.tickets_distribuidos:,} de {produto.tickets_contratados:,} tickets)",
+        f"Benchmark de mercado (mediana): {_percent(m['benchmark_utilizacao'])} ({diferenca:+.1f} p.p.)",
+        f"Quartil superior do mercado (p75): {_percent(m['benchmark_p75_utilizacao'])}",
+    ]
+
+
+def _render_potencial(nome, m, produto, isp_data):
+    return [
+        f"Potencial de crescimento: {_percent(m['potencial_crescimento'])} até o benchmark",
+        f"Tickets potenciais: {m['tickets_potenciais']:,}",
+        f"Receita potencial: {format_currency(m['receita_potencial'])}",
+    ]
+
+
+def _render_roi(nome, m, produto, isp_data):
+    roi = m["roi_estimado"]
+    return [
+        f"ROI estimado: {roi:.1f}x" if roi > 0 else "ROI estimado: N/A (sem receita potencial)",
+        f"Receita potencial: {format_currency(m['receita_potencial'])}",
+    ]
+
+
+def _render_ticket(nome, m, produto, isp_data):
+    return [
+        f"Valor unitário atual: {format_currency(m['ticket_medio_atual'])}",
+        f"Ticket médio de mercado: {format_currency(m['benchmark_ticket'])}",
+        f"Potencial de upsell por ticket: {format_currency(m['potencial_upsell'])}",
+    ]
+
+
+def _render_participacao(nome, m, produto, isp_data):
+    return [
+        f"Participação na receita: {m['percentual_receita']:.1f}%",
+        f"Valor calculado: {format_currency(produto.valor_calculado)}",
+    ]
+
+
+def _render_tickets(nome, m, produto, isp_data):
+    return [
+        f"Tickets contratados: {produto.tickets_contratados:,}",
+        f"Tickets distribuídos: {produto.tickets_distribuidos:,}",
+        f"Tickets para faturamento: {produto.tickets_metodo:,} (método {produto.pacote_metodo})",
+    ]
+
+
+def _render_faturamento(isp_data, metrics):
+    linhas = [f"Faturamento total: {format_currency(isp_data.total_faturamento)}"]
+    linhas += [
+        f"{nome}: {percentual:.1f}% da receita"
+        for nome, percentual in sorted(metrics["distribuicao_receita"].items(), key=lambda item: -item[1])
+    ]
+    return linhas
+
+
+def _render_vencimento(isp_data, metrics):
+    return [f"Vencimento: {isp_data.vencimento}", f"Último faturamento: {isp_data.ultimo_faturamento}"]
+
+
+def _render_situacao(isp_data, metrics):
+    return [f"Situação financeira: {isp_data.situacao_financeira}", f"Status: {isp_data.status}"]
+
+
+def _render_erp(isp_data, metrics):
+    return [f"ERP: {isp_data.erp}"]
+
+
+# Ordem importa: intenções mais específicas primeiro
+INTENTS = [
+    MetricIntent("roi", ["roi", "retorno sobre", "retorno do investimento"], "ROI Estimado", True, _render_roi),
+    # Antes de "potencial": "potencial de upsell" pede o ticket médio, não a receita potencial
+    MetricIntent("ticket", ["ticket medio", "upsell", "valor unitario", "preco"], "Ticket Médio", True, _render_ticket),
+    MetricIntent("potencial", ["receita potencial", "potencial de receita", "potencial de crescimento",
+                               "tickets potenciais", "oportunidade de receita", "potencial"],
+                 "Potencial de Crescimento", True, _render_potencial),
+    MetricIntent("participacao", ["participacao", "percentual da receita", "fatia da receita", "representa"],
+                 "Participação na Receita", True, _render_participacao),
+    MetricIntent("utilizacao", ["taxa de utilizacao", "utilizacao", "taxa de uso"],
+                 "Taxa de Utilização", True, _render_utilizacao),
+    MetricIntent("tickets", ["tickets contratados", "tickets distribuidos", "quantos tickets", "tickets"],
+                 "Tickets", True, _render_tickets),
+    MetricIntent("vencimento", ["vencimento", "vence", "ultimo faturamento"], "Vencimento", False, _render_vencimento),
+    MetricIntent("faturamento", ["faturamento total", "quanto fatura", "faturamento", "receita total"],
+                 "Faturamento", False, _render_faturamento),
+    MetricIntent("situacao", ["situacao financeira", "inadimpl", "adimplente", "status"],
+                 "Situação", False, _render_situacao),
+    MetricIntent("erp", ["erp", "sistema de gestao"], "ERP", False, _render_erp),
+]
+
+
+def _has_phrase(folded, phrase):
+    return re.search(r"(?<!\w)" + re.escape(phrase) + r"(?!\w)", folded) is not None
+
+
+def match_products(folded, nomes):
+    """Produtos citados na pergunta: nome completo ou uma palavra distintiva do nome"""
+    found = [nome for nome in nomes if _has_phrase(folded, fold(nome))]
+    if found:
+        return found
+    for nome in nomes:
+        palavras = [p for p in fold(nome).split() if len(p) >= 3 and p not in GENERIC_PRODUCT_WORDS]
+        if any(_has_phrase(folded, palavra) for palavra in palavras):
+            found.append(nome)
+    return found
+
+
+def match_intent(question, nomes):
+    """(intenção, produtos) para perguntas diretas; None quando a pergunta precisa do LLM"""
+    folded = fold(question)
+    if any(_has_phrase(folded, phrase) for phrase in OPEN_ENDED):
+        return None
+    matched = [intent for intent in INTENTS if any(_has_phrase(folded, k) for k in intent.keywords)]
+    if not matched:
+        return None
+    return matched[0], match_products(folded, nomes)
+
+
+def _format(title, sections):
+    blocos = []
+    for subtitle, linhas in sections:
+        header = f"📊 **{title} — {subtitle}**" if subtitle else f"📊 **{title}**"
+        blocos.append(header + "\n" + "\n".join(f"* {linha}" for linha in linhas))
+    return "\n\n".join(blocos) + "\n\n💡 Resposta calculada diretamente das métricas do prontuário."
+
+
+class _IntentStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.perguntas = 0
+        self.respondidas = 0
+        self.por_intencao = {}
+
+    def record(self, intent_key):
+        with self._lock:
+            self.perguntas += 1
+            if intent_key:
+                self.respondidas += 1
+                self.por_intencao[intent_key] = self.por_intencao.get(intent_key, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "perguntas": self.perguntas,
+                "llm_evitado": self.respondidas,
+                "taxa_local": self.respondidas / self.perguntas if self.perguntas else 0.0,
+                "por_intencao": dict(self.por_intencao),
+            }
+
+
+_stats = _IntentStats()
+
+
+def intent_stats():
+    """Quantas perguntas foram respondidas sem chamar o Groq"""
+    return _stats.snapshot()
+
+
+def answer_locally(question, isp_data, business_metrics) -> Optional[str]:
+    """Resposta pronta para perguntas diretas de métricas; None para cair no LLM"""
+    produtos_metrics = business_metrics.get("produtos", {})
+    matched = match_intent(question, list(produtos_metrics))
+    if matched is None:
+        _stats.record(None)
+        return None
+    intent, produtos = matched
+
+    if intent.por_produto:
+        if not produtos:
+            # Sem produto reconhecido só responde para todos quando a pergunta pede todos
+            # (ex.: um produto que o ISP não tem cai no LLM em vez de listar o portfólio)
+            folded = fold(question)
+            if not any(_has_phrase(folded, phrase) for phrase in ALL_PRODUCTS):
+                _stats.record(None)
+                return None
+            produtos = list(produtos_metrics)
+        if not produtos:
+            _stats.record(None)
+            return None
+        sections = [
+            (nome, intent.render(nome, produtos_metrics[nome], isp_data.produto(nome), isp_data))
+            for nome in produtos
+        ]
+    else:
+        sections = [(isp_data.nome, intent.render(isp_data, business_metrics))]
+
+    _stats.record(intent.key)
+    return _format(intent.title, sections)
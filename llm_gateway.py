@@ -0,0 +1,251 @@
+"""Gateway compartilhado das chamadas ao LLM (Groq).
+
+Um único cliente por processo. Chamadas idênticas em andamento viram uma só
+(single-flight): quem chega depois acompanha o mesmo stream. No máximo
+LLM_MAX_CONCURRENCY requisições simultâneas; as demais esperam na fila.
+Respostas 429 são repetidas com backoff exponencial e jitter.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from telemetry import observe
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "120"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "1.0"))
+LLM_RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", "30"))
+
+_DONE = object()
+
+
+class LLMQueueTimeout(Exception):
+    """A requisição esperou mais que LLM_QUEUE_TIMEOUT por uma vaga"""
+
+
+def _status_code(exc):
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status
+
+
+def is_rate_limited(exc):
+    if _status_code(exc) == 429:
+        return True
+    message = str(exc).lower()
+    return "429" in message or "rate limit" in message
+
+
+def _retry_after(exc):
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, exc=None):
+    """Backoff exponencial com jitter completo; respeita o Retry-After quando o Groq envia"""
+    delay = random.uniform(0, min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * 2 ** attempt))
+    retry_after = _retry_after(exc) if exc is not None else None
+    return max(delay, min(retry_after, LLM_RETRY_MAX_SECONDS)) if retry_after else delay
+
+
+class _Flight:
+    """Uma chamada em andamento: os pedaços ficam disponíveis para todos os que a acompanham"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self._subscribers = []  # (loop, asyncio.Queue) dos que acompanham via astream
+
+    def _notify(self, item):
+        for loop, queue in self._subscribers:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                pass  # loop já encerrado
+
+    def publish(self, chunk):
+        with self._cond:
+            self.chunks.append(chunk)
+            self._notify(chunk)
+            self._cond.notify_all()
+
+    def finish(self, error=None):
+        with self._cond:
+            self.done = True
+            self.error = error
+            self._notify(_DONE)
+            self._cond.notify_all()
+
+    def subscribe(self, loop):
+        """Fila asyncio que recebe os pedaços já publicados e os próximos (termina com _DONE)"""
+        queue = asyncio.Queue()
+        with self._cond:
+            for chunk in self.chunks:
+                queue.put_nowait(chunk)
+            if self.done:
+                queue.put_nowait(_DONE)
+            else:
+                self._subscribers.append((loop, queue))
+        return queue
+
+    def follow(self):
+        position = 0
+        while True:
+            with self._cond:
+                while position >= len(self.chunks) and not self.done:
+                    self._cond.wait()
+                pending = self.chunks[position:]
+                done, error = self.done, self.error
+            position += len(pending)
+            yield from pending
+            if done and position >= len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+
+class LLMGateway:
+    def __init__(self, llm_factory, max_concurrency=LLM_MAX_CONCURRENCY):
+        self._llm_factory = llm_factory
+        self.max_concurrency = max_concurrency
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._waits = deque(maxlen=500)
+        self.calls = 0
+        self.deduplicated = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.queue_depth = 0
+        self.in_flight = 0
+
+    @staticmethod
+    def _key(llm, messages, stop):
+        payload = json.dumps({
+            "model": getattr(llm, "model_name", type(llm).__name__),
+            "messages": [(message.type, message.content) for message in messages],
+            "stop": stop,
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @contextmanager
+    def _slot(self):
+        with self._lock:
+            self.queue_depth += 1
+        started = time.perf_counter()
+        acquired = self._slots.acquire(timeout=LLM_QUEUE_TIMEOUT)
+        waited = time.perf_counter() - started
+        with self._lock:
+            self.queue_depth -= 1
+            self._waits.append(waited)
+            if acquired:
+                self.in_flight += 1
+        observe("llm.queue_wait", waited)
+        if not acquired:
+            raise LLMQueueTimeout(f"sem vaga para o LLM após {LLM_QUEUE_TIMEOUT:.0f}s")
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+
+    def _stream_with_retry(self, llm, messages, stop):
+        attempt = 0
+        while True:
+            emitted = False
+            try:
+                with self._slot():
+                    for chunk in llm.stream(messages, stop=stop):
+                        emitted = True
+                        yield chunk.content
+                return
+            except Exception as exc:
+                # Depois do primeiro pedaço não dá para repetir sem duplicar a resposta
+                if emitted or not is_rate_limited(exc) or attempt >= LLM_MAX_RETRIES:
+                    raise
+                delay = backoff_delay(attempt, exc)
+                attempt += 1
+                with self._lock:
+                    self.rate_limited += 1
+                    self.retries += 1
+                time.sleep(delay)
+
+    def _run(self, key, flight, llm, messages, stop):
+        try:
+            for chunk in self._stream_with_retry(llm, messages, stop):
+                flight.publish(chunk)
+            flight.finish()
+        except Exception as exc:
+            flight.finish(exc)
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+
+    def _join(self, messages, stop):
+        """Chamada em andamento com a mesma chave, ou uma nova iniciada em thread própria"""
+        llm = self._llm_factory()
+        key = self._key(llm, messages, stop)
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.calls += 1
+            else:
+                self.deduplicated += 1
+        if leader:
+            # A chamada roda em thread própria: não depende de quem a iniciou continuar lendo
+            threading.Thread(
+                target=self._run, args=(key, flight, llm, messages, stop), name="llm-gateway", daemon=True
+            ).start()
+        return flight
+
+    def stream(self, messages, stop=None):
+        """Texto da resposta em pedaços; chamadas idênticas em andamento compartilham o stream"""
+        return self._join(messages, stop).follow()
+
+    def invoke(self, messages, stop=None):
+        return "".join(self.stream(messages, stop))
+
+    async def astream(self, messages, stop=None):
+        """Versão assíncrona de stream: os pedaços chegam por uma asyncio.Queue alimentada pela
+        thread da chamada, sem ocupar uma thread do executor por stream ativo"""
+        # Só o início vai para o executor (o primeiro get_llm pode importar o cliente)
+        flight = await asyncio.to_thread(self._join, messages, stop)
+        queue = flight.subscribe(asyncio.get_running_loop())
+        while True:
+            chunk = await queue.get()
+            if chunk is _DONE:
+                if flight.error is not None:
+                    raise flight.error
+                return
+            yield chunk
+
+    def stats(self):
+        with self._lock:
+            waits = sorted(self._waits)
+            return {
+                "calls": self.calls,
+                "deduplicated": self.deduplicated,
+                "retries": self.retries,
+                "rate_limited": self.rate_limited,
+                "queue_depth": self.queue_depth,
+                "in_flight": self.in_flight,
+                "max_concurrency": self.max_concurrency,
+                "wait_ms_avg": sum(waits) / len(waits) * 1000 if waits else 0.0,
+                "wait_ms_p95": waits[min(len(waits) - 1, int(0.95 * len(waits)))] * 1000 if waits else 0.0,
+            }
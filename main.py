@@ -1,18 +1,57 @@
 # main.py
 import streamlit as st
-from utils import query_isp_info, process_follow_up_question, calculate_business_metrics
-from sql_agent import SQLQueryAgent
-import base64
+from models import format_currency
+from chat_store import get_chat_store
+from api_client import AdminUnavailable
 from datetime import datetime
+import hmac
 import os
 
+API_URL = os.getenv("ASSISTENTE_API_URL")
+# Mensagens mantidas na sessão; as anteriores ficam no histórico persistente
+CHAT_HISTORY_WINDOW = int(os.getenv("CHAT_HISTORY_WINDOW", "20"))
+if API_URL:
+    # Cliente fino: consultas, métricas, chat e SQL rodam no serviço api.py
+    from api_client import (
+        query_isp_info, stream_follow_up_question, get_business_metrics, metrics_cache_stats,
+        llm_cache_stats, suggest_isps, sql_query_result, get_result, telemetry_snapshot, prometheus_text,
+        intent_stats, llm_gateway_stats, prefetch_stats,
+    )
+else:
+    from utils import (
+        query_isp_info, stream_follow_up_question, get_business_metrics, metrics_cache_stats, llm_cache_stats,
+        llm_gateway_stats,
+    )
+    from name_index import get_name_index
+    from result_store import get_result
+    from intent import intent_stats
+    from prefetch import prefetch_stats, start_prefetch_worker
+    from telemetry import telemetry_snapshot, prometheus_text
+    
+    def suggest_isps(term):
+        return get_name_index().suggest(term)
+    
+    def sql_query_result(question, isp_data=None):
+        return get_sql_agent().query_result(question, isp_data)
+
 def init_session_state():
     if 'messages' not in st.session_state:
         st.session_state.messages = []
     if 'current_isp_data' not in st.session_state:
         st.session_state.current_isp_data = None
+    if 'current_metrics' not in st.session_state:
+        st.session_state.current_metrics = None
     if 'sql_agent' not in st.session_state:
-        st.session_state.sql_agent = SQLQueryAgent(os.getenv("DATABASE_URL"))
+        # Criado sob demanda na primeira pergunta do tipo SQL
+        st.session_state.sql_agent = None
+    if 'chat_session_id' not in st.session_state:
+        st.session_state.chat_session_id = None
+        st.session_state.history_limit = CHAT_HISTORY_WINDOW
+        resume_chat_session(st.query_params.get("sessao"))
+    # Constrói (ou atualiza) o índice de Razão Social e aquece os ISPs mais procurados em segundo plano
+    if not API_URL:
+        get_name_index()
+        start_prefetch_worker()
 
 def setup_sidebar():
     with st.sidebar:
@@ -23,6 +62,9 @@ def setup_sidebar():
         if st.button("📋 Nova Consulta"):
             st.session_state.messages = []
             st.session_state.current_isp_data = None
+            st.session_state.current_metrics = None
+            st.session_state.chat_session_id = None
+            st.query_params.pop("sessao", None)
             st.rerun()
         
         if st.session_state.messages:
@@ -37,51 +79,108 @@ def setup_sidebar():
         """)
         
         st.markdown("### ℹ️ Sistema")
+        linhas = [
+            "* Versão: 1.0.0",
+            f"* Última atualização: {datetime.now().strftime('%d/%m/%Y %H:%M')}",
+        ]
+        try:
+            linhas += [
+                f"* Recálculos de métricas evitados: {metrics_cache_stats()['recalculos_evitados']:,}",
+                f"* Respostas do chat servidas do cache: {llm_cache_stats()['hit_rate']:.0%}",
+                f"* Chamadas ao Groq evitadas (respostas locais): {intent_stats()['llm_evitado']:,}",
+            ]
+        except AdminUnavailable:
+            # Modo API sem ADMIN_TOKEN válido: o serviço não expõe as estatísticas
+            pass
+        st.markdown("\n".join(linhas))
+
+def is_admin():
+    """Painel oculto: ?admin=<ADMIN_TOKEN> na URL; sem ADMIN_TOKEN definido o painel fica desativado"""
+    expected = os.getenv("ADMIN_TOKEN")
+    if not expected:
+        return False
+    return hmac.compare_digest(st.query_params.get("admin", ""), expected)
+
+def display_admin_panel():
+    with st.sidebar:
+        st.markdown("### 🛠️ Telemetria")
+        try:
+            snapshot = telemetry_snapshot()
+        except AdminUnavailable:
+            st.caption("Telemetria indisponível: ADMIN_TOKEN não definido no serviço ou diferente do local.")
+            return
+        if not snapshot["stages"]:
+            st.caption("Nenhuma etapa medida ainda.")
+            return
+        import pandas as pd
+        stages = pd.DataFrame.from_dict(snapshot["stages"], orient="index")
+        st.dataframe(
+            stages[["count", "p50_ms", "p95_ms", "p99_ms", "max_ms", "errors"]].round(1),
+            use_container_width=True
+        )
+        if snapshot["counters"]:
+            st.markdown("**Tokens e chamadas ao LLM (estimados)**")
+            st.dataframe(pd.DataFrame(snapshot["counters"]), use_container_width=True, hide_index=True)
+        gateway = llm_gateway_stats()
         st.markdown(f"""
-        * Versão: 1.0.0
-        * Última atualização: {datetime.now().strftime('%d/%m/%Y %H:%M')}
+        **Gateway do LLM**
+        * Chamadas: {gateway['calls']:,} (deduplicadas: {gateway['deduplicated']:,})
+        * Fila: {gateway['queue_depth']} aguardando, {gateway['in_flight']}/{gateway['max_concurrency']} em execução
+        * Espera na fila: média {gateway['wait_ms_avg']:.0f} ms, p95 {gateway['wait_ms_p95']:.0f} ms
+        * Retentativas por 429: {gateway['retries']:,}
         """)
+        prefetch = prefetch_stats()
+        if prefetch["ultima"]:
+            ultima = prefetch["ultima"]
+            st.markdown(f"""
+            **Pré-aquecimento**
+            * {ultima['aquecidos']:,} ISPs aquecidos (cobertura {ultima['cobertura']:.0%}) em {ultima['duracao_s']:.1f} s
+            * Rodadas: {prefetch['rodadas']:,}
+            """)
+        st.download_button(
+            "⬇️ Exportar (Prometheus)",
+            prometheus_text(),
+            file_name="assistente_metrics.prom",
+            mime="text/plain"
+        )
 
 def display_metrics(isp_data):
-    total_tickets_metodo = sum(produto['tickets_metodo'] for produto in isp_data['produtos'])
+    total_tickets_metodo = sum(produto.tickets_metodo for produto in isp_data.produtos)
     
     col1, col2, col3, col4 = st.columns(4)
     with col1:
-        st.metric("Status", isp_data['status'])
+        st.metric("Status", isp_data.status)
     with col2:
         st.metric("Tickets Faturados", f"{total_tickets_metodo:,}")
     with col3:
-        st.metric("Faturamento Total", isp_data['total_faturamento'])
+        st.metric("Faturamento Total", format_currency(isp_data.total_faturamento))
 
-def display_business_metrics(isp_data):
+def display_business_metrics(isp_data, metrics):
     st.markdown("### 📊 Análise de Performance por Produto")
     
-    metrics = calculate_business_metrics(isp_data)
     current_date = datetime.now()
     month_name = current_date.strftime('%B/%Y')
     
     # Visão Geral
-    total_faturamento = float(isp_data['total_faturamento'].replace('R$ ', '').replace(',', ''))
-    
     st.markdown(f"""
     #### 📈 Visão Geral
-    * Faturamento Total: R$ {total_faturamento:,.2f}
+    * Faturamento Total: {format_currency(isp_data.total_faturamento)}
     * Mês de Referência: {month_name}
     """)
     
     for produto_nome, produto_metrics in metrics["produtos"].items():
         with st.expander(f"📦 {produto_nome} ({produto_metrics['percentual_receita']:.1f}% da receita)"):
-            produto_info = next((p for p in isp_data['produtos'] if p['nome'] == produto_nome), {})
+            produto_info = isp_data.produto(produto_nome)
             
             # Detalhes do produto
             st.markdown(f"""
             #### Informações do Produto
-            * **Pacote**: {produto_info.get('pacote', 'N/A')}
-            * **Método de Contratação**: {produto_info.get('pacote_metodo', 'N/A')}
-            * **Valor Unitário**: {produto_info.get('valor_unitario', 'N/A')}
-            * **Tickets Contratados**: {produto_info.get('tickets_contratados', 0):,}
-            * **Tickets Distribuídos**: {produto_info.get('tickets_distribuidos', 0):,}
-            * **Tickets para Faturamento**: {produto_info.get('tickets_metodo', 0):,}
+            * **Pacote**: {produto_info.pacote or 'N/A'}
+            * **Método de Contratação**: {produto_info.pacote_metodo}
+            * **Valor Unitário**: {format_currency(produto_info.valor_unitario)}
+            * **Tickets Contratados**: {produto_info.tickets_contratados:,}
+            * **Tickets Distribuídos**: {produto_info.tickets_distribuidos:,}
+            * **Tickets para Faturamento**: {produto_info.tickets_metodo:,}
             """)
             
             # Métricas de performance
@@ -111,9 +210,7 @@ def display_business_metrics(isp_data):
                     help="Retorno sobre investimento estimado para atingir o benchmark\nConsiderando custos de ativação"
                 )
 
-def display_opportunities(isp_data):
-    metrics = calculate_business_metrics(isp_data)
-    
+def display_opportunities(metrics):
     st.markdown("### 💡 Oportunidades Identificadas")
     
     opportunity_found = False
@@ -131,31 +228,159 @@ def display_opportunities(isp_data):
     if not opportunity_found:
         st.success("👏 Parabéns! Os produtos estão com boa performance em relação ao mercado.")
 
+def iter_chat_export(messages, isp_data=None):
+    """Texto do histórico em pedaços, mensagem a mensagem"""
+    yield "Histórico de Chat - ISP Assistant\n\n"
+    yield f"Data: {datetime.now().strftime('%d/%m/%Y %H:%M')}\n"
+    if isp_data:
+        yield f"ISP: {isp_data.nome}\n\n"
+    
+    for msg in messages:
+        role = "👤 Usuário" if msg["role"] == "user" else "🤖 Assistente"
+        yield f"{role}:\n{msg['content']}\n\n"
+
+def build_chat_export(messages, isp_data=None):
+    return "".join(iter_chat_export(messages, isp_data))
+
 def export_chat():
-    if st.session_state.messages:
-        chat_text = "Histórico de Chat - ISP Assistant\n\n"
-        chat_text += f"Data: {datetime.now().strftime('%d/%m/%Y %H:%M')}\n"
-        if st.session_state.current_isp_data:
-            chat_text += f"ISP: {st.session_state.current_isp_data['nome']}\n\n"
-        
-        for msg in st.session_state.messages:
-            role = "👤 Usuário" if msg["role"] == "user" else "🤖 Assistente"
-            chat_text += f"{role}:\n{msg['content']}\n\n"
-        
-        b64 = base64.b64encode(chat_text.encode()).decode()
-        filename = f"chat_historico_{datetime.now().strftime('%Y%m%d_%H%M')}.txt"
-        st.sidebar.markdown(
-            f'<a href="data:text/plain;base64,{b64}" download="{filename}" style="display: inline-block; padding: 0.5rem 1rem; background-color: #1E3D59; color: white; text-decoration: none; border-radius: 5px;">📥 Download Histórico</a>',
-            unsafe_allow_html=True
+    session_id = st.session_state.chat_session_id
+    if not session_id:
+        return
+    # Histórico completo lido do banco em lotes, direto para os bytes do download (sem base64 na página)
+    messages = get_chat_store().iter_messages(session_id)
+    data = b"".join(chunk.encode("utf-8") for chunk in iter_chat_export(messages, st.session_state.current_isp_data))
+    st.sidebar.download_button(
+        "📥 Download Histórico",
+        data,
+        file_name=f"chat_historico_{datetime.now().strftime('%Y%m%d_%H%M')}.txt",
+        mime="text/plain"
+    )
+
+def start_chat_session(isp_data, response):
+    """Nova conversa persistida; o id vai para a URL para retomar depois (?sessao=...)"""
+    store = get_chat_store()
+    session_id = store.create_session(isp_data)
+    st.session_state.chat_session_id = session_id
+    st.session_state.history_limit = CHAT_HISTORY_WINDOW
+    st.session_state.messages = [store.append(session_id, {"role": "assistant", "content": response})]
+    st.query_params["sessao"] = session_id
+
+def resume_chat_session(session_id):
+    """Retoma uma conversa salva depois de recarregar a página ou reiniciar o app"""
+    if not session_id:
+        return
+    store = get_chat_store()
+    session = store.get_session(session_id)
+    if session is None or not session["isp_sf_id"]:
+        return
+    data, _ = query_isp_info(session["isp_sf_id"])
+    if data is None:
+        return
+    st.session_state.current_isp_data = data
+    st.session_state.current_metrics = get_business_metrics(data)
+    st.session_state.chat_session_id = session_id
+    st.session_state.messages = store.recent(session_id, CHAT_HISTORY_WINDOW)
+
+def append_message(message):
+    """Grava a mensagem no histórico persistente e mantém só a janela recente na sessão"""
+    if st.session_state.chat_session_id:
+        message = get_chat_store().append(st.session_state.chat_session_id, message)
+    st.session_state.messages.append(message)
+    del st.session_state.messages[:-st.session_state.history_limit]
+
+def load_older_messages():
+    messages = st.session_state.messages
+    older = get_chat_store().recent(st.session_state.chat_session_id, CHAT_HISTORY_WINDOW, before_id=messages[0]["id"])
+    st.session_state.messages = older + messages
+    st.session_state.history_limit += len(older)
+
+def has_older_messages():
+    messages = st.session_state.messages
+    if not st.session_state.chat_session_id or not messages or "id" not in messages[0]:
+        return False
+    return get_chat_store().has_older(st.session_state.chat_session_id, messages[0]["id"])
+
+def pick_suggestion():
+    suggestion = st.session_state.get("search_suggestion")
+    if suggestion:
+        st.session_state.pending_lookup = suggestion["cnpj"] or suggestion["nome"]
+
+def display_suggestions(identifier):
+    term = identifier.strip()
+    if len(term) < 3 or term.isdigit():
+        return
+    suggestions = suggest_isps(term)
+    if suggestions:
+        st.selectbox(
+            "Sugestões",
+            suggestions,
+            index=None,
+            format_func=lambda s: f"{s['nome']} ({s['cnpj'] or 'CNPJ não informado'})",
+            placeholder="Selecione um ISP sugerido",
+            key="search_suggestion",
+            on_change=pick_suggestion,
+            label_visibility="collapsed"
         )
 
-def process_question(question, isp_data):
+def get_sql_agent():
+    if st.session_state.sql_agent is None:
+        # LangChain e o agente SQL só carregam na primeira pergunta desse tipo
+        from sql_agent import SQLQueryAgent
+        st.session_state.sql_agent = SQLQueryAgent(os.getenv("DATABASE_URL"))
+    return st.session_state.sql_agent
+
+def is_sql_question(question):
     sql_keywords = ['consulta', 'busca', 'procura', 'encontra', 'mostra', 'lista', 'histórico']
-    
-    if any(keyword in question.lower() for keyword in sql_keywords):
-        return st.session_state.sql_agent.query(question)
-    else:
-        return process_follow_up_question(question, isp_data)
+    return any(keyword in question.lower() for keyword in sql_keywords)
+
+def render_stream(chunks):
+    """Renderiza os tokens no chat conforme chegam e devolve o texto final"""
+    placeholder = st.empty()
+    placeholder.markdown("▌")
+    text = ""
+    for chunk in chunks:
+        text += chunk
+        placeholder.markdown(text + "▌")
+    text = text.strip()
+    placeholder.markdown(text)
+    return text
+
+def display_result_pages(result_id):
+    """Tabela paginada do resultado completo (guardado fora do histórico do chat)"""
+    result = get_result(result_id)
+    if result is None:
+        st.caption("ℹ️ O resultado completo expirou; refaça a pergunta para consultá-lo novamente.")
+        return
+    import pandas as pd
+    with st.expander(f"📄 Ver resultado completo ({len(result.rows)} linhas)"):
+        page = 1
+        if result.page_count > 1:
+            page = st.number_input(
+                f"Página (de {result.page_count})",
+                min_value=1,
+                max_value=result.page_count,
+                value=1,
+                key=f"page_{result_id}"
+            )
+        st.dataframe(
+            pd.DataFrame(result.page(int(page)), columns=result.columns),
+            use_container_width=True,
+            hide_index=True
+        )
+
+def process_question(question, isp_data, metrics):
+    """Responde a pergunta dentro da mensagem do assistente e devolve a mensagem para o histórico"""
+    with st.chat_message("assistant"):
+        if is_sql_question(question):
+            with st.spinner('Processando pergunta...'):
+                answer = sql_query_result(question, isp_data)
+            st.markdown(answer.text)
+            # No histórico fica só o resumo; o resultado completo é paginado sob demanda
+            if answer.result_id:
+                display_result_pages(answer.result_id)
+            return {"role": "assistant", "content": answer.text, "result_id": answer.result_id}
+        response = render_stream(stream_follow_up_question(question, isp_data, metrics))
+        return {"role": "assistant", "content": response}
 
 def main():
     st.set_page_config(
@@ -167,6 +392,8 @@ def main():
     
     init_session_state()
     setup_sidebar()
+    if is_admin():
+        display_admin_panel()
     
     st.title("Assistente Inteligente ISP 🎯")
     st.write("Digite o CNPJ (sem pontos) ou Razão Social do ISP para começar.")
@@ -187,17 +414,27 @@ def main():
             use_container_width=True
         )
     
+    if identifier:
+        display_suggestions(identifier)
+    
+    lookup = st.session_state.pop("pending_lookup", None)
     if search_button and identifier:
+        lookup = identifier
+    
+    if lookup:
         with st.spinner('Consultando informações...'):
-            data, response = query_isp_info(identifier)
+            data, response = query_isp_info(lookup)
             if data:
                 st.session_state.current_isp_data = data
-                st.session_state.messages = []
-                st.session_state.messages.append({"role": "assistant", "content": response})
+                # Métricas calculadas uma vez por ISP carregado e reaproveitadas nos reruns
+                st.session_state.current_metrics = get_business_metrics(data)
+                start_chat_session(data, response)
             else:
                 st.error(response)
     
     if st.session_state.current_isp_data:
+        if st.session_state.current_metrics is None:
+            st.session_state.current_metrics = get_business_metrics(st.session_state.current_isp_data)
         st.markdown("---")
         
         # 1. Métricas principais
@@ -205,15 +442,19 @@ def main():
         
         # 2. Prontuário
         st.markdown("### 📋 Prontuário")
+        if has_older_messages():
+            st.button("⬆️ Carregar mensagens anteriores", on_click=load_older_messages)
         for message in st.session_state.messages:
             with st.chat_message(message["role"]):
                 st.markdown(message["content"])
+                if message.get("result_id"):
+                    display_result_pages(message["result_id"])
         
         st.markdown("---")
         
         # 3. Análise de Performance e Oportunidades
-        display_business_metrics(st.session_state.current_isp_data)
-        display_opportunities(st.session_state.current_isp_data)
+        display_business_metrics(st.session_state.current_isp_data, st.session_state.current_metrics)
+        display_opportunities(st.session_state.current_metrics)
         
         st.markdown("---")
         
@@ -225,15 +466,14 @@ def main():
         
         if question:
             st.chat_message("user").markdown(question)
-            st.session_state.messages.append({"role": "user", "content": question})
+            append_message({"role": "user", "content": question})
             
-            with st.spinner('Processando pergunta...'):
-                response = process_question(
-                    question,
-                    st.session_state.current_isp_data
-                )
-                st.chat_message("assistant").markdown(response)
-                st.session_state.messages.append({"role": "assistant", "content": response})
+            message = process_question(
+                question,
+                st.session_state.current_isp_data,
+                st.session_state.current_metrics
+            )
+            append_message(message)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
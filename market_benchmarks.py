@@ -0,0 +1,380 @@
+"""Benchmarks de mercado por produto calculados a partir de COM_MATRIZ_PRECO_V2.
+
+A utilização (tickets distribuídos / contratados) de cada linha alimenta um
+sketch de quantis mesclável por produto; o ticket médio é a média de
+pacote_valor_unit. A tabela é lida em streaming (nunca inteira em memória) e,
+depois da primeira carga, só as linhas com marcador a partir da marca d'água são
+lidas. As linhas do próprio valor da marca d'água ficam num sketch de fronteira
+à parte, refeito a cada atualização: linhas com a mesma data gravadas depois
+entram sem contar duas vezes as anteriores. O estado é persistido em disco
+para sobreviver a reinícios; uma reconstrução completa periódica corrige
+linhas alteradas.
+
+Uso:
+    python market_benchmarks.py           # atualiza (incremental) e mostra os benchmarks
+    python market_benchmarks.py --full    # reconstrói do zero
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import sys
+import threading
+import time
+from sqlalchemy import text
+from db import env_bool, get_engine
+from incremental_table import marker_column
+from schema_cache import SCHEMA_CACHE_DIR
+
+BENCHMARKS_ENABLED = env_bool("MARKET_BENCHMARKS_ENABLED", True)
+BENCHMARK_REFRESH_SECONDS = int(os.getenv("BENCHMARK_REFRESH_SECONDS", "3600"))
+BENCHMARK_FULL_REFRESH_SECONDS = int(os.getenv("BENCHMARK_FULL_REFRESH_SECONDS", str(24 * 3600)))
+# Abaixo disso o produto usa o benchmark de referência
+BENCHMARK_MIN_SAMPLES = int(os.getenv("BENCHMARK_MIN_SAMPLES", "30"))
+BENCHMARK_FETCH_BATCH = int(os.getenv("BENCHMARK_FETCH_BATCH", "5000"))
+BENCHMARK_RELATIVE_ACCURACY = float(os.getenv("BENCHMARK_RELATIVE_ACCURACY", "0.01"))
+
+# Referência usada enquanto não há dados suficientes do produto
+REFERENCE_BENCHMARKS = {
+    "PARAMOUNT+ AVULSO": {"media_utilizacao": 0.65, "ticket_medio": 4.80, "penetracao_mercado": 0.45, "churn_aceitavel": 0.15},
+    "HBO MAX": {"media_utilizacao": 0.70, "ticket_medio": 19.10, "penetracao_mercado": 0.35, "churn_aceitavel": 0.12},
+    "WATCH LIGHT": {"media_utilizacao": 0.75, "ticket_medio": 0.30, "penetracao_mercado": 0.60, "churn_aceitavel": 0.20},
+}
+DEFAULT_BENCHMARK = {"media_utilizacao": 0.60, "ticket_medio": 0.0, "penetracao_mercado": 0.40, "churn_aceitavel": 0.15}
+
+_SCAN_QUERY = """
+    SELECT produto_sf_code, tickets_contratados, tickets_distribuidos, pacote_valor_unit, {marker}
+    FROM COM_MATRIZ_PRECO_V2
+    WHERE produto_sf_code IS NOT NULL AND tickets_contratados > 0 AND {marker} <= :upper {incremental}
+"""
+
+
+class QuantileSketch:
+    """Sketch de quantis com erro relativo limitado (buckets logarítmicos, estilo DDSketch).
+
+    Dois sketches se combinam somando os buckets, então cargas parciais e
+    incrementais dão o mesmo resultado de uma varredura única.
+    """
+
+    def __init__(self, relative_accuracy=BENCHMARK_RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value, weight=1):
+        if value <= 0:
+            self.zero_count += weight
+        else:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.buckets[index] = self.buckets.get(index, 0) + weight
+        self.count += weight
+
+    def merge(self, other):
+        for index, weight in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + weight
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                return 2 * self._gamma ** index / (self._gamma + 1)
+        return 2 * self._gamma ** max(self.buckets) / (self._gamma + 1)
+
+    def to_dict(self):
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "buckets": {str(index): weight for index, weight in self.buckets.items()},
+            "zero_count": self.zero_count,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["relative_accuracy"])
+        sketch.buckets = {int(index): weight for index, weight in data["buckets"].items()}
+        sketch.zero_count = data["zero_count"]
+        sketch.count = sketch.zero_count + sum(sketch.buckets.values())
+        return sketch
+
+
+class ProductAccumulator:
+    """Distribuição de utilização e soma dos valores unitários de um produto"""
+
+    def __init__(self):
+        self.utilizacao = QuantileSketch()
+        self.ticket_total = 0.0
+        self.ticket_count = 0
+
+    def add(self, contratados, distribuidos, valor_unit):
+        self.utilizacao.add((distribuidos or 0) / contratados)
+        if valor_unit is not None:
+            self.ticket_total += valor_unit
+            self.ticket_count += 1
+
+    def merge(self, other):
+        self.utilizacao.merge(other.utilizacao)
+        self.ticket_total += other.ticket_total
+        self.ticket_count += other.ticket_count
+
+    def summary(self):
+        return {
+            "media_utilizacao": self.utilizacao.quantile(0.5),
+            "p75_utilizacao": self.utilizacao.quantile(0.75),
+            "ticket_medio": self.ticket_total / self.ticket_count if self.ticket_count else 0.0,
+            "amostras": self.utilizacao.count,
+        }
+
+    def to_dict(self):
+        return {"utilizacao": self.utilizacao.to_dict(), "ticket_total": self.ticket_total, "ticket_count": self.ticket_count}
+
+    @classmethod
+    def from_dict(cls, data):
+        accumulator = cls()
+        accumulator.utilizacao = QuantileSketch.from_dict(data["utilizacao"])
+        accumulator.ticket_total = data["ticket_total"]
+        accumulator.ticket_count = data["ticket_count"]
+        return accumulator
+
+
+_accumulators = {}  # linhas com marcador abaixo da marca d'água
+_boundary = {}  # linhas com marcador igual à marca d'água (relidas a cada atualização)
+_state = {
+    "benchmarks": {}, "version": "referencia", "watermark": None, "refreshed_at": None,
+    "full_refreshed_at": None, "loaded": False, "refreshing": False, "attempted_at": 0.0,
+}
+_state_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+
+
+def _state_path(engine):
+    url_key = hashlib.sha256(str(engine.url).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(SCHEMA_CACHE_DIR, f"benchmarks_{url_key}.json")
+
+
+def _version(benchmarks):
+    payload = json.dumps(
+        {nome: [round(value or 0.0, 4) for value in (b["media_utilizacao"], b["p75_utilizacao"], b["ticket_medio"])]
+         for nome, b in sorted(benchmarks.items())},
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:12]
+
+
+def _combined():
+    combined = {}
+    for accumulators in (_accumulators, _boundary):
+        for nome, accumulator in accumulators.items():
+            if nome not in combined:
+                combined[nome] = ProductAccumulator()
+            combined[nome].merge(accumulator)
+    return combined
+
+
+def _publish(watermark, refreshed_at, full_refreshed_at):
+    benchmarks = {
+        nome: accumulator.summary()
+        for nome, accumulator in _combined().items()
+        if accumulator.utilizacao.count >= BENCHMARK_MIN_SAMPLES
+    }
+    with _state_lock:
+        _state.update(
+            benchmarks=benchmarks, version=_version(benchmarks), watermark=watermark,
+            refreshed_at=refreshed_at, full_refreshed_at=full_refreshed_at, loaded=True,
+        )
+
+
+def _load_from_disk(engine):
+    try:
+        with open(_state_path(engine), encoding="utf-8") as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        with _state_lock:
+            _state["loaded"] = True
+        return False
+    if saved.get("marker") != marker_column():
+        with _state_lock:
+            _state["loaded"] = True
+        return False
+    _accumulators.clear()
+    _accumulators.update({nome: ProductAccumulator.from_dict(data) for nome, data in saved["produtos"].items()})
+    _boundary.clear()
+    _boundary.update({nome: ProductAccumulator.from_dict(data) for nome, data in saved.get("fronteira", {}).items()})
+    _publish(saved["watermark"], saved["refreshed_at"], saved["full_refreshed_at"])
+    return True
+
+
+def _save_to_disk(engine):
+    os.makedirs(SCHEMA_CACHE_DIR, exist_ok=True)
+    path = _state_path(engine)
+    with _state_lock:
+        saved = {
+            "marker": marker_column(),
+            "watermark": _state["watermark"],
+            "refreshed_at": _state["refreshed_at"],
+            "full_refreshed_at": _state["full_refreshed_at"],
+        }
+    saved["produtos"] = {nome: accumulator.to_dict() for nome, accumulator in _accumulators.items()}
+    saved["fronteira"] = {nome: accumulator.to_dict() for nome, accumulator in _boundary.items()}
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(saved, f)
+    os.replace(tmp_path, path)
+
+
+def refresh_benchmarks(engine=None, full=False):
+    """Soma aos sketches as linhas a partir da última marca d'água (ou varre tudo com full=True)"""
+    engine = engine or get_engine()
+    started = time.perf_counter()
+    marker = marker_column()
+
+    with _refresh_lock:
+        if not full and not _state["loaded"]:
+            _load_from_disk(engine)
+        watermark = None if full else _state["watermark"]
+        delta, boundary = {}, {}
+        scanned = 0
+        with engine.connect() as conn:
+            # Limite superior lido antes da varredura: linhas que chegarem durante ela entram na próxima
+            upper = conn.execute(text(f"SELECT MAX({marker}) FROM COM_MATRIZ_PRECO_V2")).scalar()
+            if upper is not None:
+                params = {"upper": upper}
+                incremental = ""
+                if watermark is not None:
+                    # >= relê a fronteira: linhas com a mesma marca gravadas depois não se perdem
+                    incremental = f"AND {marker} >= :watermark"
+                    params["watermark"] = watermark
+                result = conn.execution_options(stream_results=True, yield_per=BENCHMARK_FETCH_BATCH).execute(
+                    text(_SCAN_QUERY.format(marker=marker, incremental=incremental)), params
+                )
+                for produto, contratados, distribuidos, valor_unit, value in result:
+                    # A nova fronteira fica à parte; o resto já passou da marca e entra de vez
+                    target = boundary if value == upper else delta
+                    accumulator = target.get(produto)
+                    if accumulator is None:
+                        accumulator = target[produto] = ProductAccumulator()
+                    accumulator.add(contratados, distribuidos, valor_unit)
+                    scanned += 1
+
+        if watermark is None:
+            _accumulators.clear()
+        if watermark is None or upper is not None:
+            # A fronteira anterior foi relida inteira (em delta ou na nova fronteira): é substituída
+            _boundary.clear()
+            _boundary.update(boundary)
+        for produto, accumulator in delta.items():
+            if produto in _accumulators:
+                _accumulators[produto].merge(accumulator)
+            else:
+                _accumulators[produto] = accumulator
+
+        refreshed_at = time.time()
+        full_refreshed_at = refreshed_at if watermark is None else _state["full_refreshed_at"]
+        _publish(str(upper) if upper is not None else watermark, refreshed_at, full_refreshed_at)
+        try:
+            _save_to_disk(engine)
+        except OSError:
+            pass
+
+    return {
+        "modo": "completo" if watermark is None else "incremental",
+        "linhas": scanned,
+        "produtos": len(_state["benchmarks"]),
+        "versao": _state["version"],
+        "marca_dagua": _state["watermark"],
+        "duracao_s": round(time.perf_counter() - started, 3),
+    }
+
+
+def _refresh_in_background():
+    def run():
+        try:
+            # Engine resolvida só aqui: sem DATABASE_URL as métricas seguem puras, com a referência
+            engine = get_engine()
+            with _refresh_lock:
+                if not _state["loaded"]:
+                    _load_from_disk(engine)
+            now = time.time()
+            with _state_lock:
+                refreshed_at, full_refreshed_at = _state["refreshed_at"], _state["full_refreshed_at"]
+            if refreshed_at and now - refreshed_at < BENCHMARK_REFRESH_SECONDS:
+                return  # o estado salvo em disco ainda vale
+            full = not full_refreshed_at or now - full_refreshed_at > BENCHMARK_FULL_REFRESH_SECONDS
+            refresh_benchmarks(engine, full=full)
+        except Exception:
+            pass  # sem acesso ao banco: segue com os últimos benchmarks (ou a referência)
+        finally:
+            with _state_lock:
+                _state["refreshing"] = False
+    threading.Thread(target=run, name="market-benchmarks-refresh", daemon=True).start()
+
+
+def _ensure_fresh(retry_seconds=60):
+    """Dispara em segundo plano a carga do estado salvo e a atualização quando expira"""
+    if not BENCHMARKS_ENABLED:
+        return
+    now = time.time()
+    with _state_lock:
+        refreshed_at = _state["refreshed_at"]
+        if refreshed_at and now - refreshed_at < BENCHMARK_REFRESH_SECONDS:
+            return
+        if _state["refreshing"] or now - _state["attempted_at"] < retry_seconds:
+            return
+        _state.update(refreshing=True, attempted_at=now)
+    _refresh_in_background()
+
+
+def get_market_benchmark(produto_nome):
+    """Benchmark do produto: mediana e p75 da utilização e ticket médio de mercado"""
+    _ensure_fresh()
+    with _state_lock:
+        computed = _state["benchmarks"].get(produto_nome)
+    reference = REFERENCE_BENCHMARKS.get(produto_nome, DEFAULT_BENCHMARK)
+    if computed is None:
+        return {**reference, "p75_utilizacao": reference["media_utilizacao"], "amostras": 0, "fonte": "referencia"}
+    return {
+        **computed,
+        "penetracao_mercado": reference["penetracao_mercado"],
+        "churn_aceitavel": reference["churn_aceitavel"],
+        "fonte": "mercado",
+    }
+
+
+def benchmark_version():
+    """Muda sempre que os benchmarks publicados mudam (entra nas chaves dos caches de métricas)"""
+    with _state_lock:
+        return _state["version"]
+
+
+def market_benchmark_stats():
+    with _state_lock:
+        return {
+            "produtos": len(_state["benchmarks"]),
+            "versao": _state["version"],
+            "marca_dagua": _state["watermark"],
+            "atualizado_em": _state["refreshed_at"],
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Atualiza os benchmarks de mercado por produto")
+    parser.add_argument("--full", action="store_true", help="reconstrói os sketches do zero")
+    args = parser.parse_args(argv)
+    report = refresh_benchmarks(full=args.full)
+    report["benchmarks"] = _state["benchmarks"]
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
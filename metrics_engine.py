@@ -0,0 +1,148 @@
+"""Cálculo vetorizado das métricas de negócio para carteiras inteiras.
+
+Produz os mesmos valores de utils.calculate_business_metrics, mas em uma
+única passada colunar sobre todos os pares ISP x produto.
+"""
+import numpy as np
+import pandas as pd
+from utils import get_benchmark_data
+
+# Custo de ativação estimado (mesma premissa de calculate_business_metrics)
+CUSTO_ATIVACAO = 0.3
+
+
+class PortfolioFrameBuilder:
+    """Acumula ISPs em listas colunares (sem manter os registros inteiros)"""
+
+    def __init__(self):
+        self.isp_ids = []
+        self._columns = {
+            "sf_id": [], "isp_nome": [], "produto": [], "valor_unitario": [],
+            "valor_calculado": [], "tickets_contratados": [], "tickets_distribuidos": [],
+        }
+
+    def add(self, isp_data):
+        self.isp_ids.append(isp_data.sf_id)
+        for produto in isp_data.produtos:
+            self._columns["sf_id"].append(isp_data.sf_id)
+            self._columns["isp_nome"].append(isp_data.nome)
+            self._columns["produto"].append(produto.nome)
+            self._columns["valor_unitario"].append(produto.valor_unitario or 0.0)
+            self._columns["valor_calculado"].append(produto.valor_calculado)
+            self._columns["tickets_contratados"].append(produto.tickets_contratados)
+            self._columns["tickets_distribuidos"].append(produto.tickets_distribuidos)
+
+    def to_frame(self):
+        columns = self._columns
+        return pd.DataFrame({
+            "sf_id": pd.Series(columns["sf_id"], dtype="object"),
+            "isp_nome": pd.Series(columns["isp_nome"], dtype="object"),
+            "produto": pd.Series(columns["produto"], dtype="object"),
+            "valor_unitario": np.asarray(columns["valor_unitario"], dtype=np.float64),
+            "valor_calculado": np.asarray(columns["valor_calculado"], dtype=np.float64),
+            "tickets_contratados": np.asarray(columns["tickets_contratados"], dtype=np.int64),
+            "tickets_distribuidos": np.asarray(columns["tickets_distribuidos"], dtype=np.int64),
+        })
+
+
+def build_portfolio_frame(isps, builder=None):
+    builder = builder or PortfolioFrameBuilder()
+    for isp_data in isps:
+        builder.add(isp_data)
+    return builder.to_frame()
+
+
+def compute_portfolio_metrics(frame):
+    """Adiciona as colunas de métricas ao frame ISP x produto.
+
+    Produtos com zero tickets contratados ficam com utilização 0 (a versão
+    por ISP levanta ZeroDivisionError nesse caso).
+    """
+    frame = frame.copy()
+    produtos = frame["produto"].unique()
+    benchmarks = {nome: get_benchmark_data(nome) for nome in produtos}
+    frame["benchmark_utilizacao"] = frame["produto"].map(
+        {nome: b["media_utilizacao"] for nome, b in benchmarks.items()}
+    ).astype(np.float64)
+    frame["benchmark_p75_utilizacao"] = frame["produto"].map(
+        {nome: b["p75_utilizacao"] for nome, b in benchmarks.items()}
+    ).astype(np.float64)
+    frame["benchmark_ticket"] = frame["produto"].map(
+        {nome: b["ticket_medio"] for nome, b in benchmarks.items()}
+    ).astype(np.float64)
+
+    contratados = frame["tickets_contratados"].to_numpy()
+    distribuidos = frame["tickets_distribuidos"].to_numpy()
+    valor_unitario = frame["valor_unitario"].to_numpy()
+    valor_calculado = frame["valor_calculado"].to_numpy()
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        utilizacao = np.where(contratados != 0, distribuidos / np.where(contratados != 0, contratados, 1), 0.0)
+    potencial = np.maximum(0.0, frame["benchmark_utilizacao"].to_numpy() - utilizacao)
+    tickets_potenciais = np.trunc(contratados * potencial).astype(np.int64)
+    receita_potencial = tickets_potenciais * valor_unitario
+    custo_estimado = receita_potencial * CUSTO_ATIVACAO
+    with np.errstate(divide="ignore", invalid="ignore"):
+        roi = np.where(custo_estimado > 0, (receita_potencial - custo_estimado) / custo_estimado, 0.0)
+
+    # bincount soma na ordem de entrada, igual ao sum() sequencial por ISP
+    codes, _ = pd.factorize(frame["sf_id"])
+    total_por_isp = np.bincount(codes, weights=valor_calculado) if len(codes) else np.zeros(0)
+    total = total_por_isp[codes] if len(codes) else np.zeros(0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        percentual = np.where(total > 0, valor_calculado / total * 100, 0.0)
+
+    frame["utilizacao_atual"] = utilizacao
+    frame["potencial_crescimento"] = potencial
+    frame["ticket_medio_atual"] = valor_unitario
+    frame["potencial_upsell"] = frame["benchmark_ticket"].to_numpy() - valor_unitario
+    frame["percentual_receita"] = percentual
+    frame["receita_potencial"] = receita_potencial
+    frame["roi_estimado"] = roi
+    frame["tickets_potenciais"] = tickets_potenciais
+    frame["total_faturamento"] = total
+    return frame
+
+
+METRIC_COLUMNS = [
+    "utilizacao_atual", "benchmark_utilizacao", "benchmark_p75_utilizacao", "potencial_crescimento", "ticket_medio_atual",
+    "benchmark_ticket", "potencial_upsell", "percentual_receita", "receita_potencial",
+    "roi_estimado", "tickets_potenciais",
+]
+
+
+def metrics_by_isp(frame):
+    """Converte o frame calculado no formato de calculate_business_metrics, por sf_id"""
+    result = {}
+    # tolist() devolve tipos nativos (float/int) sem passar por objetos numpy
+    values = zip(*(frame[column].tolist() for column in METRIC_COLUMNS))
+    rows = zip(frame["sf_id"].tolist(), frame["produto"].tolist(), frame["total_faturamento"].tolist(), values)
+    for sf_id, produto, total_faturamento, metric_values in rows:
+        metrics = result.get(sf_id)
+        if metrics is None:
+            metrics = result[sf_id] = {
+                "produtos": {},
+                "total_faturamento": total_faturamento,
+                "distribuicao_receita": {},
+            }
+        produto_metrics = dict(zip(METRIC_COLUMNS, metric_values))
+        metrics["produtos"][produto] = produto_metrics
+        metrics["distribuicao_receita"][produto] = produto_metrics["percentual_receita"]
+    return result
+
+
+def calculate_portfolio_metrics(isps):
+    """Métricas de negócio de todos os ISPs: {sf_id: metrics}"""
+    builder = PortfolioFrameBuilder()
+    metrics = metrics_by_isp(compute_portfolio_metrics(build_portfolio_frame(isps, builder)))
+    # ISPs sem produtos: mesmo resultado vazio da versão por ISP
+    for sf_id in builder.isp_ids:
+        metrics.setdefault(sf_id, {"produtos": {}, "total_faturamento": 0, "distribuicao_receita": {}})
+    return metrics
+
+
+def portfolio_leaderboard(frame, top=20, by="receita_potencial"):
+    """Maiores oportunidades da carteira (pares ISP x produto)"""
+    columns = ["sf_id", "isp_nome", "produto", "utilizacao_atual", "benchmark_utilizacao",
+               "potencial_crescimento", "tickets_potenciais", "receita_potencial", "roi_estimado"]
+    return frame.nlargest(top, by)[columns].reset_index(drop=True)
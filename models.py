@@ -0,0 +1,74 @@
+import hashlib
+import json
+from dataclasses import dataclass, fields
+from typing import List, Optional
+
+
+def format_currency(value, default="Não especificado"):
+    """Formata valores monetários apenas na exibição: 1234.5 -> 'R$ 1,234.50'"""
+    if value is None:
+        return default
+    return f"R$ {value:,.2f}"
+
+
+@dataclass
+class ProdutoRecord:
+    """Produto contratado por um ISP, com valores numéricos brutos"""
+
+    __slots__ = (
+        "nome", "pacote", "valor_unitario", "valor_total", "tickets_contratados",
+        "tickets_distribuidos", "pacote_metodo", "tickets_metodo", "valor_calculado",
+    )
+
+    nome: str
+    pacote: Optional[str]
+    valor_unitario: Optional[float]
+    valor_total: float
+    tickets_contratados: int
+    tickets_distribuidos: int
+    pacote_metodo: str
+    tickets_metodo: int
+    valor_calculado: float
+
+    def to_dict(self):
+        return {field.name: getattr(self, field.name) for field in fields(self)}
+
+
+@dataclass
+class ISPRecord:
+    """Prontuário de um ISP; a formatação de moeda fica para a camada de exibição"""
+
+    __slots__ = (
+        "sf_id", "cnpj", "nome", "situacao_financeira", "erp", "ultimo_faturamento",
+        "vencimento", "status", "produtos", "total_faturamento",
+    )
+
+    sf_id: str
+    cnpj: Optional[str]
+    nome: str
+    situacao_financeira: str
+    erp: str
+    ultimo_faturamento: str
+    vencimento: str
+    status: str
+    produtos: List[ProdutoRecord]
+    total_faturamento: float
+
+    def produto(self, nome):
+        return next((p for p in self.produtos if p.nome == nome), None)
+
+    def to_dict(self):
+        data = {field.name: getattr(self, field.name) for field in fields(self)}
+        data["produtos"] = [produto.to_dict() for produto in self.produtos]
+        return data
+
+    def content_hash(self):
+        """Hash estável do conteúdo, usado como chave de caches derivados"""
+        payload = json.dumps(self.to_dict(), sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def from_dict(cls, data):
+        data = dict(data)
+        data["produtos"] = [ProdutoRecord(**produto) for produto in data.get("produtos", [])]
+        return cls(**data)
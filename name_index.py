@@ -0,0 +1,199 @@
+import os
+import threading
+import time
+import unicodedata
+from collections import Counter, defaultdict
+from sqlalchemy import text
+from db import get_engine
+
+# Coluna opcional de última alteração em DIM_SF_CONTAS para refresh incremental
+NAME_INDEX_UPDATED_COLUMN = os.getenv("NAME_INDEX_UPDATED_COLUMN")
+NAME_INDEX_REFRESH_SECONDS = int(os.getenv("NAME_INDEX_REFRESH_SECONDS", "600"))
+# Similaridade mínima para aceitar um candidato aproximado (sem substring exata)
+NAME_INDEX_MIN_SIMILARITY = float(os.getenv("NAME_INDEX_MIN_SIMILARITY", "0.5"))
+
+
+def fold(value):
+    """Remove acentos, caixa e pontuação: 'Conexão-Fibra LTDA.' -> 'conexao fibra ltda'"""
+    normalized = unicodedata.normalize("NFKD", str(value or ""))
+    chars = [c if c.isalnum() else " " for c in normalized if not unicodedata.combining(c)]
+    return " ".join("".join(chars).casefold().split())
+
+
+def trigrams(folded, padded=True):
+    if padded:
+        folded = f"  {folded} "
+    return {folded[i:i + 3] for i in range(len(folded) - 2)}
+
+
+class NameIndex:
+    """Índice de trigramas sobre DIM_SF_CONTAS.Name para busca por Razão Social"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._accounts = {}  # sf_id -> (nome, nome normalizado, cnpj, trigramas)
+        self._postings = defaultdict(set)  # trigrama -> {sf_id}
+        self.ready = False
+        self.refreshed_at = None
+        self.watermark = None
+        self.last_error = None
+
+    def __len__(self):
+        return len(self._accounts)
+
+    def add(self, sf_id, nome, cnpj=None):
+        folded = fold(nome)
+        grams = trigrams(folded)
+        with self._lock:
+            self._discard(sf_id)
+            self._accounts[sf_id] = (nome, folded, cnpj, grams)
+            for gram in grams:
+                self._postings[gram].add(sf_id)
+
+    def remove(self, sf_id):
+        with self._lock:
+            self._discard(sf_id)
+
+    def _discard(self, sf_id):
+        previous = self._accounts.pop(sf_id, None)
+        if previous is None:
+            return
+        for gram in previous[3]:
+            ids = self._postings.get(gram)
+            if ids is not None:
+                ids.discard(sf_id)
+                if not ids:
+                    del self._postings[gram]
+
+    def search(self, query, limit=10, fuzzy=True):
+        """Busca contas pelo nome; correspondências por substring vêm primeiro.
+
+        Com fuzzy=False só há correspondência por substring (o mesmo que o LIKE).
+        """
+        folded = fold(query)
+        if not folded:
+            return []
+        with self._lock:
+            matches = self._substring_matches(folded)
+            if not matches and fuzzy:
+                matches = self._similar_matches(folded)
+            ranked = sorted(matches.items(), key=lambda item: (-item[1], self._accounts[item[0]][1]))
+            return [
+                {"sf_id": sf_id, "nome": self._accounts[sf_id][0], "cnpj": self._accounts[sf_id][2], "score": score}
+                for sf_id, score in ranked[:limit]
+            ]
+
+    def _substring_matches(self, folded):
+        # Equivalente ao LIKE '%x%': o candidato precisa conter todos os trigramas da busca
+        grams = trigrams(folded, padded=False)
+        if grams:
+            postings = sorted((self._postings.get(gram, set()) for gram in grams), key=len)
+            candidates = set(postings[0])
+            for ids in postings[1:]:
+                candidates &= ids
+                if not candidates:
+                    break
+        else:
+            candidates = self._accounts.keys()
+        return {
+            sf_id: 1.0 + len(folded) / len(self._accounts[sf_id][1])
+            for sf_id in candidates
+            if folded in self._accounts[sf_id][1]
+        }
+
+    def _similar_matches(self, folded):
+        grams = trigrams(folded)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._postings.get(gram, ()))
+        scores = {}
+        for sf_id, count in shared.items():
+            # Fração dos trigramas da busca presentes no nome (tolera nomes longos)
+            similarity = count / len(grams)
+            if similarity >= NAME_INDEX_MIN_SIMILARITY:
+                scores[sf_id] = similarity
+        return scores
+
+    def resolve(self, query, limit=5):
+        """Candidatos (sf_id) para um nome, ou None se o índice ainda não está pronto.
+
+        Só substring: um nome inexistente não pode carregar o prontuário de outra conta.
+        """
+        if not self.ready:
+            return None
+        return [match["sf_id"] for match in self.search(query, limit=limit, fuzzy=False)]
+
+    def suggest(self, prefix, limit=8):
+        """Sugestões para o campo de busca (type-ahead), com aproximados quando não há substring"""
+        if not self.ready:
+            return []
+        return self.search(prefix, limit=limit)
+
+    def refresh(self, engine=None):
+        """Carrega (ou atualiza incrementalmente) os nomes a partir do banco"""
+        engine = engine or get_engine()
+        columns = "Id, Name, CA_CNPJ__c"
+        if NAME_INDEX_UPDATED_COLUMN:
+            columns += f", {NAME_INDEX_UPDATED_COLUMN}"
+        incremental = bool(NAME_INDEX_UPDATED_COLUMN and self.watermark is not None)
+        query = f"SELECT {columns} FROM DIM_SF_CONTAS"
+        params = {}
+        if incremental:
+            query += f" WHERE {NAME_INDEX_UPDATED_COLUMN} > :watermark"
+            params["watermark"] = self.watermark
+
+        seen = set()
+        watermark = self.watermark
+        with engine.connect() as conn:
+            result = conn.execution_options(stream_results=True).execute(text(query), params)
+            for row in result:
+                seen.add(row[0])
+                current = self._accounts.get(row[0])
+                if current is None or current[0] != row[1] or current[2] != row[2]:
+                    self.add(row[0], row[1], row[2])
+                if NAME_INDEX_UPDATED_COLUMN and row[3] is not None:
+                    watermark = row[3] if watermark is None else max(watermark, row[3])
+
+        if not incremental:
+            # Sem coluna de alteração: remove contas que sumiram da tabela
+            for sf_id in set(self._accounts) - seen:
+                self.remove(sf_id)
+        self.watermark = watermark
+        self.refreshed_at = time.time()
+        self.ready = True
+        return len(seen)
+
+
+_index = NameIndex()
+_refresh_lock = threading.Lock()
+
+
+def _refresh_in_background():
+    if not _refresh_lock.acquire(blocking=False):
+        return
+    def run():
+        try:
+            _index.refresh()
+            _index.last_error = None
+        except Exception as e:
+            _index.last_error = str(e)
+        finally:
+            _refresh_lock.release()
+    threading.Thread(target=run, name="name-index-refresh", daemon=True).start()
+
+
+def ensure_name_index():
+    """Garante o índice construído, bloqueando até a carga (para scripts e jobs)"""
+    if not _index.ready:
+        with _refresh_lock:
+            if not _index.ready:
+                _index.refresh()
+    return _index
+
+
+def get_name_index():
+    """Índice compartilhado do processo; (re)construído em segundo plano quando expira"""
+    stale = _index.refreshed_at is None or time.time() - _index.refreshed_at > NAME_INDEX_REFRESH_SECONDS
+    if stale:
+        _refresh_in_background()
+    return _index
@@ -0,0 +1,91 @@
+"""Exporta prontuários e métricas de uma carteira de ISPs.
+
+Uso:
+    python portfolio.py carteira.txt --output saida/
+
+O arquivo de entrada tem um CNPJ, Id Salesforce ou Razão Social por linha.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from utils import iter_isp_info_batch, BATCH_CHUNK_SIZE
+from name_index import ensure_name_index
+from metrics_engine import PortfolioFrameBuilder, compute_portfolio_metrics, metrics_by_isp, portfolio_leaderboard
+
+
+def read_identifiers(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            # Aceita CSV simples: usa apenas a primeira coluna
+            identifier = line.split(";")[0].split(",")[0].strip()
+            if identifier and not identifier.startswith("#"):
+                yield identifier
+
+
+def _safe_filename(value):
+    return re.sub(r"[^0-9A-Za-z_-]+", "_", str(value)).strip("_") or "isp"
+
+
+def export_portfolio(identifiers, output_dir, chunk_size=BATCH_CHUNK_SIZE, top=50):
+    prontuarios_dir = os.path.join(output_dir, "prontuarios")
+    os.makedirs(prontuarios_dir, exist_ok=True)
+    summary = {"encontrados": 0, "nao_encontrados": 0}
+    started = time.perf_counter()
+    # Guarda só as colunas numéricas de cada ISP; métricas saem em uma passada no fim
+    builder = PortfolioFrameBuilder()
+    accounts = {}
+
+    with open(os.path.join(output_dir, "nao_encontrados.txt"), "w", encoding="utf-8") as missing_file:
+        for identifier, data, response in iter_isp_info_batch(identifiers, chunk_size=chunk_size):
+            if not data:
+                summary["nao_encontrados"] += 1
+                missing_file.write(f"{identifier}\n")
+                continue
+            summary["encontrados"] += 1
+            if data.sf_id in accounts:
+                continue
+            accounts[data.sf_id] = (identifier, data.cnpj, data.nome)
+            builder.add(data)
+            filename = _safe_filename(data.cnpj or data.sf_id)
+            with open(os.path.join(prontuarios_dir, f"{filename}.md"), "w", encoding="utf-8") as f:
+                f.write(f"# {data.nome}\n{response}")
+
+    frame = compute_portfolio_metrics(builder.to_frame())
+    metrics = metrics_by_isp(frame)
+    with open(os.path.join(output_dir, "metricas.jsonl"), "w", encoding="utf-8") as metrics_file:
+        for sf_id, (identifier, cnpj, nome) in accounts.items():
+            metrics_file.write(json.dumps({
+                "identificador": identifier,
+                "sf_id": sf_id,
+                "cnpj": cnpj,
+                "nome": nome,
+                "business_metrics": metrics.get(sf_id, {"produtos": {}, "total_faturamento": 0, "distribuicao_receita": {}}),
+            }, ensure_ascii=False) + "\n")
+    portfolio_leaderboard(frame, top=top).to_csv(os.path.join(output_dir, "oportunidades.csv"), index=False)
+
+    summary["duracao_s"] = round(time.perf_counter() - started, 3)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exporta prontuários e métricas de uma carteira de ISPs")
+    parser.add_argument("entrada", help="arquivo com um CNPJ, Id ou Razão Social por linha")
+    parser.add_argument("--output", "-o", default="carteira", help="diretório de saída")
+    parser.add_argument("--chunk-size", type=int, default=BATCH_CHUNK_SIZE, help="contas por consulta")
+    parser.add_argument("--top", type=int, default=50, help="tamanho do ranking de oportunidades")
+    args = parser.parse_args(argv)
+
+    identifiers = list(read_identifiers(args.entrada))
+    if not all(identifier.isdigit() for identifier in identifiers):
+        # Nomes na carteira: resolve pelo índice local em vez de LIKE individual
+        ensure_name_index()
+    summary = export_portfolio(identifiers, args.output, args.chunk_size, args.top)
+    print(json.dumps(summary, ensure_ascii=False))
+    return 0 if summary["encontrados"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+"""Pré-aquecimento dos ISPs mais procurados antes das buscas do dia.
+
+Ordena os ISPs pelas buscas recentes (processo atual + conversas salvas) e
+completa a lista com os faturados mais recentemente (CA_DataUltFaturamento__c).
+Os N primeiros entram nos caches de prontuário e de métricas. As consultas
+usam um pool próprio e pequeno (PREFETCH_POOL_SIZE), separado do pool das
+buscas interativas.
+
+O worker roda dentro do processo que atende as buscas (api.py ou o app
+Streamlit), já que os caches são em memória.
+
+Uso:
+    python prefetch.py --top 200    # mede uma rodada avulsa (ranking, duração e cobertura)
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from sqlalchemy import text
+from chat_store import get_chat_store
+from db import env_bool, get_engine
+from telemetry import span
+from utils import get_business_metrics, iter_isp_info_batch, recent_lookup_counts
+
+PREFETCH_ENABLED = env_bool("PREFETCH_ENABLED", True)
+PREFETCH_TOP_N = int(os.getenv("PREFETCH_TOP_N", "200"))
+# Abaixo do ISP_CACHE_TTL (900 s) para os prontuários não expirarem entre as rodadas
+PREFETCH_INTERVAL_SECONDS = int(os.getenv("PREFETCH_INTERVAL_SECONDS", "600"))
+PREFETCH_POOL_SIZE = int(os.getenv("PREFETCH_POOL_SIZE", "1"))
+PREFETCH_CHUNK_SIZE = int(os.getenv("PREFETCH_CHUNK_SIZE", "50"))
+PREFETCH_SEARCH_DAYS = int(os.getenv("PREFETCH_SEARCH_DAYS", "7"))
+
+_state = {"running": False, "rounds": 0, "last": None, "error": None}
+_state_lock = threading.Lock()
+_worker = None
+_stop = threading.Event()
+
+
+def get_prefetch_engine():
+    return get_engine(os.getenv("DATABASE_URL"), name="prefetch", pool_size=PREFETCH_POOL_SIZE, max_overflow=0)
+
+
+def rank_isps(top_n=PREFETCH_TOP_N, engine=None):
+    """sf_ids em ordem de prioridade: mais buscados primeiro, depois os faturados mais recentemente"""
+    scores = dict(recent_lookup_counts())
+    try:
+        since = time.time() - PREFETCH_SEARCH_DAYS * 24 * 3600
+        for sf_id, conversas in get_chat_store().top_isps(since, top_n):
+            scores[sf_id] = scores.get(sf_id, 0) + conversas
+    except Exception:
+        pass  # sem histórico de conversas: segue só com as buscas do processo
+    ranked = [sf_id for sf_id, _ in sorted(scores.items(), key=lambda item: item[1], reverse=True)][:top_n]
+
+    if len(ranked) < top_n:
+        engine = engine or get_prefetch_engine()
+        with engine.connect() as conn:
+            recent = conn.execute(text("""
+                SELECT Id FROM DIM_SF_CONTAS
+                WHERE CA_DataUltFaturamento__c IS NOT NULL
+                ORDER BY CA_DataUltFaturamento__c DESC
+                LIMIT :limit
+            """), {"limit": top_n}).fetchall()
+        seen = set(ranked)
+        for (sf_id,) in recent:
+            if len(ranked) >= top_n:
+                break
+            if sf_id not in seen:
+                ranked.append(sf_id)
+                seen.add(sf_id)
+    return ranked
+
+
+def warm_up(top_n=PREFETCH_TOP_N, chunk_size=PREFETCH_CHUNK_SIZE):
+    """Uma rodada: recarrega prontuários e métricas dos top N e devolve o relatório"""
+    engine = get_prefetch_engine()
+    started = time.perf_counter()
+    with span("prefetch.rank"):
+        ranked = rank_isps(top_n, engine)
+    warmed = 0
+    with span("prefetch.load"):
+        # use_cache=False: renova os prontuários em vez de confiar em entradas perto de expirar
+        for _identifier, data, _response in iter_isp_info_batch(ranked, chunk_size, use_cache=False, engine=engine):
+            if data is None:
+                continue
+            get_business_metrics(data)
+            warmed += 1
+    return {
+        "candidatos": len(ranked),
+        "aquecidos": warmed,
+        "cobertura": warmed / top_n if top_n else 0.0,
+        "duracao_s": round(time.perf_counter() - started, 3),
+        "concluido_em": time.time(),
+    }
+
+
+def _run(interval, top_n):
+    while not _stop.is_set():
+        with _state_lock:
+            _state["running"] = True
+        try:
+            report = warm_up(top_n)
+            with _state_lock:
+                _state.update(last=report, error=None)
+                _state["rounds"] += 1
+        except Exception as e:
+            with _state_lock:
+                _state["error"] = str(e)
+        finally:
+            with _state_lock:
+                _state["running"] = False
+        _stop.wait(interval)
+
+
+def start_prefetch_worker(interval=PREFETCH_INTERVAL_SECONDS, top_n=PREFETCH_TOP_N):
+    """Inicia (uma vez por processo) a thread que aquece os caches agora e a cada `interval` segundos"""
+    global _worker
+    if not PREFETCH_ENABLED or top_n <= 0:
+        return None
+    with _state_lock:
+        if _worker is None or not _worker.is_alive():
+            _stop.clear()
+            _worker = threading.Thread(target=_run, args=(interval, top_n), name="isp-prefetch", daemon=True)
+            _worker.start()
+    return _worker
+
+
+def stop_prefetch_worker():
+    _stop.set()
+
+
+def prefetch_stats():
+    with _state_lock:
+        return {
+            "habilitado": PREFETCH_ENABLED,
+            "em_execucao": _state["running"],
+            "rodadas": _state["rounds"],
+            "ultima": _state["last"],
+            "erro": _state["error"],
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pré-aquece os caches de prontuário e métricas")
+    parser.add_argument("--top", type=int, default=PREFETCH_TOP_N, help="quantidade de ISPs a aquecer")
+    parser.add_argument("--chunk-size", type=int, default=PREFETCH_CHUNK_SIZE, help="ISPs por consulta")
+    args = parser.parse_args(argv)
+    print(json.dumps(warm_up(args.top, args.chunk_size), ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
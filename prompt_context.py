@@ -0,0 +1,194 @@
+"""Contexto compacto do ISP para o FOLLOW_UP_PROMPT.
+
+Serializa apenas os campos relevantes para o tipo de pergunta, com chaves
+curtas e sem indentação, respeitando um orçamento de tokens.
+"""
+import json
+import os
+import re
+import threading
+from dataclasses import dataclass
+from cache import TTLCache
+from market_benchmarks import benchmark_version
+from name_index import fold
+
+PROMPT_CONTEXT_VERSION = "1"
+PROMPT_CONTEXT_TOKEN_BUDGET = int(os.getenv("PROMPT_CONTEXT_TOKEN_BUDGET", "600"))
+
+# Palavras-chave (já normalizadas) por tipo de pergunta, na ordem de prioridade
+QUESTION_TYPES = [
+    ("historico", ["historico", "evolucao", "periodo", "tendencia", "mes a mes", "ultimos meses"]),
+    ("financeiro", ["faturamento", "financeir", "receita", "vencimento", "pagamento", "inadimpl", "valor"]),
+    ("estrategia", ["estrategia", "oportunidade", "potencial", "vender", "venda", "upsell", "roi", "crescer", "acao"]),
+    ("tecnico", ["o que e", "como funciona", "explique", "explica", "conceito", "significa", "erp", "metodo"]),
+    ("produto", ["produto", "utilizacao", "ticket", "performance", "desempenho", "benchmark"]),
+]
+
+# Campos do ISP e dos produtos enviados para cada tipo de pergunta
+ISP_FIELDS = {
+    "historico": ["nome", "status", "venc", "ult_fat"],
+    "financeiro": ["nome", "sit", "status", "fat", "venc", "ult_fat"],
+    "estrategia": ["nome", "status", "fat"],
+    "tecnico": ["nome", "erp", "status"],
+    "produto": ["nome", "status", "fat"],
+    "geral": ["nome", "sit", "erp", "status", "fat", "venc"],
+}
+PRODUTO_FIELDS = {
+    "historico": ["produto", "tc", "td", "util"],
+    "financeiro": ["produto", "vu", "vc", "pct_receita"],
+    "estrategia": ["produto", "util", "bench_util", "pot_cresc", "tickets_pot", "receita_pot", "roi", "upsell"],
+    "tecnico": ["produto", "metodo", "tc", "td", "tm"],
+    "produto": ["produto", "vu", "tc", "td", "util", "bench_util", "pot_cresc", "pct_receita"],
+    "geral": ["produto", "vu", "tc", "td", "util", "bench_util", "pot_cresc", "receita_pot", "pct_receita"],
+}
+
+
+def estimate_tokens(text):
+    """Estimativa barata de tokens (~4 caracteres por token)"""
+    return (len(text) + 3) // 4
+
+
+def classify_question(question):
+    folded = fold(question)
+    for tipo, keywords in QUESTION_TYPES:
+        # Casa só no início de palavra ('acao' não casa com 'utilizacao')
+        if any(re.search(r"\b" + re.escape(keyword), folded) for keyword in keywords):
+            return tipo
+    return "geral"
+
+
+def _isp_values(isp_data):
+    return {
+        "nome": isp_data.nome,
+        "sit": isp_data.situacao_financeira,
+        "erp": isp_data.erp,
+        "status": isp_data.status,
+        "fat": round(isp_data.total_faturamento, 2),
+        "venc": isp_data.vencimento,
+        "ult_fat": isp_data.ultimo_faturamento,
+    }
+
+
+def _produto_values(produto, produto_metrics):
+    return {
+        "produto": produto.nome,
+        "vu": round(produto.valor_unitario, 2) if produto.valor_unitario is not None else None,
+        "vc": round(produto.valor_calculado, 2),
+        "tc": produto.tickets_contratados,
+        "td": produto.tickets_distribuidos,
+        "tm": produto.tickets_metodo,
+        "metodo": produto.pacote_metodo,
+        "util": round(produto_metrics.get("utilizacao_atual", 0.0), 3),
+        "bench_util": round(produto_metrics.get("benchmark_utilizacao", 0.0), 3),
+        "pot_cresc": round(produto_metrics.get("potencial_crescimento", 0.0), 3),
+        "tickets_pot": produto_metrics.get("tickets_potenciais", 0),
+        "receita_pot": round(produto_metrics.get("receita_potencial", 0.0), 2),
+        "roi": round(produto_metrics.get("roi_estimado", 0.0), 2),
+        "upsell": round(produto_metrics.get("potencial_upsell", 0.0), 2),
+        "pct_receita": round(produto_metrics.get("percentual_receita", 0.0), 1),
+    }
+
+
+def _dumps(payload):
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+
+
+@dataclass
+class PromptContext:
+    text: str
+    tipo: str
+    tokens: int
+    tokens_legacy: int
+    produtos_omitidos: int
+
+    @property
+    def tokens_saved(self):
+        return max(0, self.tokens_legacy - self.tokens)
+
+
+class _ContextStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.tokens = 0
+        self.tokens_legacy = 0
+
+    def record(self, context):
+        with self._lock:
+            self.calls += 1
+            self.tokens += context.tokens
+            self.tokens_legacy += context.tokens_legacy
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "tokens": self.tokens,
+                "tokens_legacy": self.tokens_legacy,
+                "tokens_saved": max(0, self.tokens_legacy - self.tokens),
+                "tokens_saved_avg": (self.tokens_legacy - self.tokens) / self.calls if self.calls else 0.0,
+            }
+
+
+_stats = _ContextStats()
+
+
+def prompt_context_stats():
+    return _stats.snapshot()
+
+
+# Tokens do formato antigo, só para estatística: mesma chave do cache de métricas
+_legacy_tokens = TTLCache(
+    maxsize=int(os.getenv("METRICS_CACHE_SIZE", "1024")),
+    ttl=int(os.getenv("METRICS_CACHE_TTL", "3600")),
+)
+
+
+def legacy_context_tokens(isp_data, business_metrics):
+    """Tokens do formato antigo (json.dumps indentado do ISP + métricas completas)"""
+    key = (isp_data.content_hash(), benchmark_version())
+    tokens = _legacy_tokens.get(key)
+    if tokens is None:
+        legacy = {**isp_data.to_dict(), "business_metrics": business_metrics}
+        tokens = estimate_tokens(json.dumps(legacy, ensure_ascii=False, indent=2))
+        _legacy_tokens.set(key, tokens)
+    return tokens
+
+
+def build_prompt_context(question, isp_data, business_metrics, token_budget=PROMPT_CONTEXT_TOKEN_BUDGET):
+    """Monta o contexto do {data} para a pergunta, dentro do orçamento de tokens"""
+    tipo = classify_question(question)
+    folded_question = fold(question)
+    produtos_metrics = business_metrics.get("produtos", {})
+
+    isp_values = _isp_values(isp_data)
+    payload = {"isp": {field: isp_values[field] for field in ISP_FIELDS[tipo]}}
+
+    # Produtos citados na pergunta primeiro; depois os de maior peso na receita
+    def priority(produto):
+        mentioned = fold(produto.nome) in folded_question
+        return (not mentioned, -produto.valor_calculado, produto.nome)
+
+    produtos = []
+    for produto in sorted(isp_data.produtos, key=priority):
+        values = _produto_values(produto, produtos_metrics.get(produto.nome, {}))
+        produtos.append({field: values[field] for field in PRODUTO_FIELDS[tipo]})
+    payload["produtos"] = produtos
+
+    text = _dumps(payload)
+    omitted = 0
+    while estimate_tokens(text) > token_budget and payload["produtos"]:
+        payload["produtos"].pop()
+        omitted += 1
+        payload["omitidos"] = omitted
+        text = _dumps(payload)
+
+    context = PromptContext(
+        text=text,
+        tipo=tipo,
+        tokens=estimate_tokens(text),
+        tokens_legacy=legacy_context_tokens(isp_data, business_metrics),
+        produtos_omitidos=omitted,
+    )
+    _stats.record(context)
+    return context
@@ -0,0 +1,59 @@
+"""Resultados completos das consultas SQL, guardados fora do histórico do chat.
+
+O histórico (session_state.messages) guarda só o resumo e o id do
+resultado; as páginas são lidas daqui sob demanda.
+"""
+import os
+import uuid
+from dataclasses import dataclass
+from typing import List, Optional
+from cache import TTLCache
+
+RESULT_STORE_SIZE = int(os.getenv("RESULT_STORE_SIZE", "200"))
+RESULT_STORE_TTL = int(os.getenv("RESULT_STORE_TTL", str(2 * 3600)))
+RESULT_PAGE_SIZE = int(os.getenv("RESULT_PAGE_SIZE", "25"))
+
+_results = TTLCache(maxsize=RESULT_STORE_SIZE, ttl=RESULT_STORE_TTL)
+
+
+@dataclass
+class StoredResult:
+    question: str
+    query_type: str
+    columns: List[str]
+    rows: List[tuple]
+    total_rows: Optional[int] = None
+    truncated: bool = False
+
+    @property
+    def page_count(self):
+        return max(1, -(-len(self.rows) // RESULT_PAGE_SIZE))
+
+    def page(self, number, page_size=RESULT_PAGE_SIZE):
+        """Linhas da página (começando em 1)"""
+        start = (max(1, number) - 1) * page_size
+        return self.rows[start:start + page_size]
+
+
+def store_result(question, query_type, result):
+    """Guarda o resultado completo (GuardedResult) e devolve o id para o histórico"""
+    result_id = uuid.uuid4().hex
+    _results.set(result_id, StoredResult(
+        question=question,
+        query_type=query_type,
+        columns=list(result.columns),
+        # Tuplas simples: mais leves que Row e sem referência à conexão
+        rows=[tuple(row) for row in result.rows],
+        total_rows=result.total_rows,
+        truncated=result.truncated,
+    ))
+    return result_id
+
+
+def get_result(result_id):
+    """Resultado guardado, ou None se expirou ou foi descartado"""
+    return _results.get(result_id)
+
+
+def result_store_stats():
+    return _results.stats()
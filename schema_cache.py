@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from sqlalchemy import inspect, text
+from db import get_engine
+
+SCHEMA_CACHE_DIR = os.getenv("SCHEMA_CACHE_DIR", ".cache")
+
+
+@dataclass
+class SchemaInfo:
+    table_info: str
+    fingerprint: str
+    dialect: str
+    source: str  # "disco" ou "reflexao"
+
+
+# Um SchemaInfo e um SQLDatabase por URL, compartilhados por todas as sessões
+_schemas = {}
+_databases = {}
+_lock = threading.RLock()
+
+
+def _url_key(db_uri):
+    return hashlib.sha256(str(db_uri).encode("utf-8")).hexdigest()[:16]
+
+
+def schema_fingerprint(engine):
+    """Hash barato da estrutura do banco (tabelas, colunas e tipos), sem reflexão completa"""
+    with engine.connect() as conn:
+        if engine.dialect.name == "mysql":
+            rows = conn.execute(text("""
+                SELECT TABLE_NAME, COLUMN_NAME, COLUMN_TYPE
+                FROM information_schema.COLUMNS
+                WHERE TABLE_SCHEMA = DATABASE()
+                ORDER BY TABLE_NAME, ORDINAL_POSITION
+            """)).fetchall()
+        elif engine.dialect.name == "sqlite":
+            rows = conn.execute(text(
+                "SELECT name, sql FROM sqlite_master WHERE type IN ('table', 'view') ORDER BY name"
+            )).fetchall()
+        else:
+            inspector = inspect(conn)
+            rows = [
+                (table, column["name"], str(column["type"]))
+                for table in sorted(inspector.get_table_names())
+                for column in inspector.get_columns(table)
+            ]
+    payload = "\n".join("|".join(str(value) for value in row) for row in rows)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _cache_path(db_uri):
+    return os.path.join(SCHEMA_CACHE_DIR, f"schema_{_url_key(db_uri)}.json")
+
+
+def _load_from_disk(db_uri, fingerprint):
+    try:
+        with open(_cache_path(db_uri), encoding="utf-8") as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cached.get("fingerprint") != fingerprint:
+        return None
+    return cached
+
+
+def _save_to_disk(db_uri, schema):
+    os.makedirs(SCHEMA_CACHE_DIR, exist_ok=True)
+    path = _cache_path(db_uri)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "fingerprint": schema.fingerprint,
+            "dialect": schema.dialect,
+            "table_info": schema.table_info,
+            "created_at": time.time(),
+        }, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def get_sql_database(db_uri):
+    """SQLDatabase compartilhado do processo (a reflexão acontece uma única vez)"""
+    database = _databases.get(db_uri)
+    if database is None:
+        with _lock:
+            database = _databases.get(db_uri)
+            if database is None:
+                from langchain.sql_database import SQLDatabase
+                database = SQLDatabase(get_engine(db_uri))
+                _databases[db_uri] = database
+    return database
+
+
+def get_schema(db_uri, refresh=False):
+    """Schema (table_info) do banco: memória do processo, depois disco, por último reflexão"""
+    schema = _schemas.get(db_uri)
+    if schema is not None and not refresh:
+        return schema
+    with _lock:
+        schema = _schemas.get(db_uri)
+        if schema is not None and not refresh:
+            return schema
+        engine = get_engine(db_uri)
+        fingerprint = schema_fingerprint(engine)
+        cached = None if refresh else _load_from_disk(db_uri, fingerprint)
+        if cached is not None:
+            schema = SchemaInfo(cached["table_info"], fingerprint, cached["dialect"], "disco")
+        else:
+            if refresh:
+                _databases.pop(db_uri, None)
+            table_info = get_sql_database(db_uri).get_table_info()
+            schema = SchemaInfo(table_info, fingerprint, engine.dialect.name, "reflexao")
+            _save_to_disk(db_uri, schema)
+        _schemas[db_uri] = schema
+        return schema
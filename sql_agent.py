@@ -1,65 +1,217 @@
 import os
-from langchain.agents import create_sql_agent
-from langchain.agents.agent_toolkits import SQLDatabaseToolkit
-from langchain.sql_database import SQLDatabase
-from langchain.agents.agent_types import AgentType
-from langchain_groq import ChatGroq
-from langchain.chains import create_sql_query_chain
+import re
 from langchain.prompts import ChatPromptTemplate
-import pandas as pd
-from datetime import datetime
+from dataclasses import dataclass
+from typing import Optional
+from db import get_engine
+from utils import get_llm, get_llm_gateway
+from schema_cache import get_schema, get_sql_database
+from cache import TTLCache
+from llm_cache import normalize_question
+from sql_guard import QueryRejected, execute_guarded
+from result_store import RESULT_PAGE_SIZE, store_result
+from history_store import answer_history
+from prompt_context import estimate_tokens
+from telemetry import span, timed, record_tokens
+
+# Template de geração de SQL (montado uma vez por processo)
+SQL_PROMPT = ChatPromptTemplate.from_template("""
+            Gere uma query SQL para responder à seguinte pergunta:
+            {question}
+            
+            Considere as seguintes tabelas e relacionamentos:
+            {table_info}
+            
+            Tipo de consulta: {query_type}
+            
+            Regras:
+            1. Use JOINs apropriados
+            2. Limite resultados quando apropriado
+            3. Ordene de forma relevante
+            4. Use funções de agregação quando necessário
+            
+            Retorne apenas a query SQL, sem explicações.
+            """)
+
+_SQL_PROMPT_TOKENS = estimate_tokens(SQL_PROMPT.messages[0].prompt.template)
+
+# SQL validado (executado com sucesso) por (pergunta normalizada, fingerprint do schema)
+_sql_cache = TTLCache(
+    maxsize=int(os.getenv("SQL_CACHE_SIZE", "1000")),
+    ttl=int(os.getenv("SQL_CACHE_TTL", str(24 * 3600))),
+)
+
+def sql_cache_stats():
+    stats = _sql_cache.stats()
+    return {**stats, "llm_skipped": stats["hits"]}
+
+def sql_cache_entries():
+    """Lista (pergunta normalizada, fingerprint, SQL) das entradas em cache"""
+    return [(question, fingerprint, sql) for (question, fingerprint), sql in _sql_cache.items()]
+
+def evict_sql_cache(question=None):
+    """Remove o SQL em cache de uma pergunta (todas as versões de schema) ou limpa tudo"""
+    if question is None:
+        _sql_cache.clear()
+        return
+    normalized = normalize_question(question)
+    for key in _sql_cache.keys():
+        if key[0] == normalized:
+            _sql_cache.pop(key)
+
+def _clean_sql(response):
+    """Remove cercas de markdown e prefixos que o modelo às vezes devolve"""
+    sql = response.strip()
+    fence = re.match(r"^```(?:sql)?\s*(.*?)\s*```", sql, re.DOTALL | re.IGNORECASE)
+    if fence:
+        sql = fence.group(1)
+    if sql.upper().startswith("SQLQUERY:"):
+        sql = sql[len("SQLQuery:"):]
+    return sql.split("\nSQLResult:")[0].strip()
+
+# Acima disso o histórico é agregado por mês (ou ano) antes de virar markdown
+HISTORICO_MAX_PERIODS = int(os.getenv("HISTORICO_MAX_PERIODS", "24"))
+
+
+@dataclass
+class SQLAnswer:
+    text: str
+    result_id: Optional[str] = None  # resultado completo em result_store, se houver
+
+
+def _inline_rows(query_type):
+    """Quantas linhas do resultado cabem no resumo do chat"""
+    return HISTORICO_MAX_PERIODS if query_type == "historico" else RESULT_PAGE_SIZE
+
+def _summarize_historico(df):
+    """Reduz o histórico a no máximo HISTORICO_MAX_PERIODS linhas: devolve (frame, descrição)"""
+    if len(df) <= HISTORICO_MAX_PERIODS:
+        return df, None
+    if "data" in df.columns:
+        import pandas as pd
+        dates = pd.to_datetime(df["data"], errors="coerce")
+        if dates.notna().any():
+            numeric = df.select_dtypes("number")
+            for freq, label in (("M", "mês"), ("Y", "ano")):
+                periods = dates.dt.to_period(freq)
+                if numeric.empty:
+                    grouped = periods.value_counts().sort_index().to_frame("registros")
+                else:
+                    grouped = numeric.groupby(periods).sum()
+                if len(grouped) <= HISTORICO_MAX_PERIODS:
+                    break
+            grouped.index = grouped.index.astype(str)
+            grouped.index.name = "data"
+            return grouped.tail(HISTORICO_MAX_PERIODS), f"totais por {label}"
+    # Sem coluna de data: amostra uniforme
+    step = -(-len(df) // HISTORICO_MAX_PERIODS)
+    return df.iloc[::step], f"1 a cada {step} registros"
 
 class SQLQueryAgent:
     def __init__(self, db_uri):
-        self.db = SQLDatabase.from_uri(db_uri)
-        self.llm = ChatGroq(
-            groq_api_key=os.getenv("GROQ_API_KEY"),
-            model_name="mixtral-8x7b-32768",
-            temperature=0.1
-        )
-        self.toolkit = SQLDatabaseToolkit(db=self.db, llm=self.llm)
-        self.table_info = self._cache_table_info()
+        self.db_uri = db_uri
+        self.engine = get_engine(db_uri)
+        self.llm = get_llm()
+        self.schema = self._cache_table_info()
+        self.table_info = self.schema.table_info
         
     def _cache_table_info(self):
-        """Cache das informações das tabelas para uso frequente"""
-        return self.db.get_table_info()
+        """Schema compartilhado pelo processo e persistido em disco (sem reflexão por sessão)"""
+        return get_schema(self.db_uri)
     
-    def _format_response(self, result_type, data):
-        """Formata a resposta baseada no tipo de consulta"""
+    @property
+    def db(self):
+        """SQLDatabase do processo, refletido apenas no primeiro uso"""
+        return get_sql_database(self.db_uri)
+    
+    @property
+    def toolkit(self):
+        from langchain.agents.agent_toolkits import SQLDatabaseToolkit
+        return SQLDatabaseToolkit(db=self.db, llm=self.llm)
+    
+    def _truncation_note(self, result):
+        if not result.truncated:
+            return ""
+        if result.omitted_rows is None:
+            return f"\n⚠️ Exibindo apenas as primeiras {len(result.rows)} linhas; o resultado tem mais registros.\n"
+        return (
+            f"\n⚠️ Exibindo {len(result.rows)} de {result.total_rows} linhas "
+            f"({result.omitted_rows} omitidas). Refine a pergunta para ver o restante.\n"
+        )
+    
+    def _format_response(self, result_type, result):
+        """Formata a resposta baseada no tipo de consulta (limitada; o restante fica paginado)"""
+        data = result.rows
         if not data:
             return "❌ Nenhum dado encontrado para esta consulta."
             
+        note = self._truncation_note(result)
         if result_type == "historico":
-            df = pd.DataFrame(data)
+            import pandas as pd
+            df = pd.DataFrame(data, columns=result.columns)
+            summary, how = _summarize_historico(df)
+            periodo = ""
+            if "data" in df.columns:
+                periodo = f"* Período analisado: {df['data'].min()} a {df['data'].max()}\n"
+            resumo = f"Resumo por período ({how}):" if how else "Resumo por período:"
             return f"""
 📈 **Histórico de Performance**
-* Período analisado: {df['data'].min()} a {df['data'].max()}
-* Total de registros: {len(df)}
-
-Resumo por período:
-{df.to_markdown()}
+{periodo}* Total de registros: {result.total_rows or len(df)}
 
+{resumo}
+{summary.to_markdown()}
+{note}
 💡 Dica: Você pode perguntar sobre um período específico ou produto.
 """
         elif result_type == "lista":
-            items = [f"- {item[0]}" for item in data]
+            items = [f"- {item[0]}" for item in data[:RESULT_PAGE_SIZE]]
+            remaining = len(data) - len(items)
+            more = f"\n… e mais {remaining} itens na tabela paginada.\n" if remaining else ""
             return f"""
 📋 **Resultado da Consulta**
-Total de itens: {len(items)}
+Total de itens: {result.total_rows or len(data)}
 
 {chr(10).join(items)}
-
+{more}{note}
 💡 Dica: Você pode pedir mais detalhes sobre qualquer item específico.
 """
         else:
+            remaining = len(data) - RESULT_PAGE_SIZE
+            more = f"\n… e mais {remaining} linhas na tabela paginada.\n" if remaining > 0 else ""
             return f"""
 📊 **Resultado da Consulta**
-{data}
-
+{[tuple(row) for row in data[:RESULT_PAGE_SIZE]]}
+{more}{note}
 💡 Dica: Você pode fazer perguntas mais específicas sobre estes dados.
 """
 
-    def query(self, question):
+    def _generate_sql(self, question, query_type):
+        """Gera o SQL pelo LLM (via gateway: perguntas iguais em andamento viram uma chamada)"""
+        with span("sql.generate"):
+            messages = SQL_PROMPT.format_messages(
+                question=question,
+                table_info=self.table_info,
+                query_type=query_type
+            )
+            response = get_llm_gateway().invoke(messages, stop=["\nSQLResult:"])
+        # Estimativa de tokens (prompt com o schema completo + SQL gerado)
+        record_tokens(
+            "sql",
+            _SQL_PROMPT_TOKENS + estimate_tokens(self.table_info) + estimate_tokens(question),
+            estimate_tokens(response)
+        )
+        return _clean_sql(response)
+
+    def query(self, question, isp_data=None):
+        return self.query_result(question, isp_data).text
+
+    @timed("sql.total")
+    def query_result(self, question, isp_data=None):
+        """Resposta resumida para o chat e, se não couber tudo, o id do resultado completo.
+
+        Perguntas de histórico saem dos agregados mensais (do ISP em `isp_data`,
+        se informado) sem passar pelo LLM; sem agregados, seguem pelo SQL gerado.
+        """
         try:
             # Identifica o tipo de consulta
             query_type = "geral"
@@ -68,42 +220,48 @@ Total de itens: {len(items)}
             elif any(word in question.lower() for word in ["lista", "listar", "mostrar todos"]):
                 query_type = "lista"
             
-            # Template específico para o tipo de consulta
-            prompt = ChatPromptTemplate.from_template("""
-            Gere uma query SQL para responder à seguinte pergunta:
-            {question}
-            
-            Considere as seguintes tabelas e relacionamentos:
-            {table_info}
-            
-            Tipo de consulta: {query_type}
+            if query_type == "historico":
+                with span("sql.history"):
+                    history = answer_history(question, isp_data, self.engine)
+                if history is not None:
+                    return SQLAnswer(history)
             
-            Regras:
-            1. Use JOINs apropriados
-            2. Limite resultados quando apropriado
-            3. Ordene de forma relevante
-            4. Use funções de agregação quando necessário
+            # Pergunta já respondida com o mesmo schema: reaproveita o SQL validado
+            cache_key = (normalize_question(question), self.schema.fingerprint)
+            query = _sql_cache.get(cache_key)
+            from_cache = query is not None
+            if not from_cache:
+                query = self._generate_sql(question, query_type)
             
-            Retorne apenas a query SQL, sem explicações.
-            """)
+            # Executa a query com limite de linhas, timeout e verificação de custo
+            try:
+                with span("sql.execute"):
+                    result = execute_guarded(self.engine, query)
+            except Exception:
+                if from_cache:
+                    _sql_cache.pop(cache_key)
+                raise
             
-            # Gera e executa a query
-            sql_chain = create_sql_query_chain(self.llm, self.db)
-            query = sql_chain.invoke({
-                "question": question,
-                "table_info": self.table_info,
-                "query_type": query_type
-            })
-            
-            # Executa a query
-            with self.db.connect() as conn:
-                result = conn.execute(query)
-                rows = result.fetchall()
-                
-                return self._format_response(query_type, rows)
+            if not from_cache:
+                _sql_cache.set(cache_key, query)
+            with span("sql.format"):
+                text = self._format_response(query_type, result)
+            result_id = None
+            if len(result.rows) > _inline_rows(query_type):
+                result_id = store_result(question, query_type, result)
+            return SQLAnswer(text, result_id)
                 
+        except QueryRejected as e:
+            return SQLAnswer(f"""
+🛑 **Consulta Bloqueada**
+A consulta gerada foi recusada: {str(e)}
+
+💡 Sugestões:
+1. Restrinja a pergunta a um ISP, produto ou período
+2. Peça um resumo ou total em vez da lista completa
+""")
         except Exception as e:
-            return f"""
+            return SQLAnswer(f"""
 ❌ **Erro na Consulta**
 Não foi possível processar sua pergunta devido a: {str(e)}
 
@@ -111,4 +269,4 @@ Não foi possível processar sua pergunta devido a: {str(e)}
 1. Seja mais específico na sua pergunta
 2. Verifique se os dados solicitados existem
 3. Tente reformular a pergunta
-"""
\ No newline at end of file
+""")
\ No newline at end of file
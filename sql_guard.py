@@ -0,0 +1,210 @@
+"""Execução protegida do SQL gerado pelo LLM.
+
+Aplica limite de linhas (lidas em lotes via fetchmany), timeout por
+instrução e rejeita consultas cujo custo estimado pelo EXPLAIN passe do
+limite configurado. A instrução roda numa transação somente leitura
+(START TRANSACTION READ ONLY no MySQL, PRAGMA query_only no SQLite), então
+um WITH ... DELETE que escape da verificação de texto falha no banco.
+"""
+import json
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional
+from sqlalchemy import text
+
+SQL_MAX_ROWS = int(os.getenv("SQL_MAX_ROWS", "500"))
+SQL_FETCH_BATCH = int(os.getenv("SQL_FETCH_BATCH", "100"))
+SQL_STATEMENT_TIMEOUT_MS = int(os.getenv("SQL_STATEMENT_TIMEOUT_MS", "15000"))
+# Custo do otimizador (query_cost no MySQL, Total Cost no PostgreSQL); 0 desativa
+SQL_MAX_EXPLAIN_COST = float(os.getenv("SQL_MAX_EXPLAIN_COST", "1000000"))
+# Resultado cortado: conta no máximo até aqui (acima disso informa só "mais de N linhas")
+SQL_COUNT_LIMIT = int(os.getenv("SQL_COUNT_LIMIT", "10000"))
+
+_READ_ONLY_PATTERN = re.compile(r"^\s*(select|with)\b", re.IGNORECASE)
+# Escrita/DDL em qualquer ponto da instrução (ex.: WITH a AS (SELECT 1) DELETE FROM t)
+_WRITE_PATTERN = re.compile(
+    r"\b(insert|update|delete|merge|upsert|create|drop|alter|truncate|rename|grant|revoke|"
+    r"attach|detach|pragma|vacuum|reindex|call|lock|into)\b",
+    re.IGNORECASE,
+)
+# Literais/identificadores entre aspas (grupo 1) ou comentários (grupo 2), na ordem em que aparecem
+_TOKEN_PATTERN = re.compile(
+    r"('(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"|`[^`]*`)|(--[^\n]*|#[^\n]*|/\*.*?\*/)",
+    re.DOTALL,
+)
+
+
+class QueryRejected(Exception):
+    """Consulta recusada antes da execução (não é somente leitura ou é cara demais)"""
+
+
+@dataclass
+class GuardedResult:
+    rows: List = field(default_factory=list)
+    columns: List[str] = field(default_factory=list)
+    truncated: bool = False
+    total_rows: Optional[int] = None  # None quando a contagem não pôde ser feita ou passou do limite
+    explain_cost: Optional[float] = None
+    elapsed: float = 0.0
+
+    @property
+    def omitted_rows(self):
+        if not self.truncated or self.total_rows is None:
+            return None
+        return max(0, self.total_rows - len(self.rows))
+
+
+def _remove_comments(sql):
+    return _TOKEN_PATTERN.sub(lambda m: m.group(1) or " ", sql)
+
+
+def _strip_sql(sql):
+    """Sem comentários e sem ';' final (o SQL ainda é embutido em EXPLAIN e COUNT)"""
+    return _remove_comments(sql).strip().rstrip(";").strip()
+
+
+def check_read_only(sql):
+    """Aceita apenas uma única instrução SELECT/WITH, sem comandos de escrita"""
+    # Comentários somem e literais viram '' antes das verificações: '%;%' ou '-- delete' não contam
+    code = _TOKEN_PATTERN.sub(lambda m: "''" if m.group(1) else " ", sql).strip()
+    if not _READ_ONLY_PATTERN.match(code):
+        raise QueryRejected("apenas consultas SELECT são permitidas")
+    if ";" in code.rstrip(";").rstrip():
+        raise QueryRejected("apenas uma instrução por consulta é permitida")
+    write = _WRITE_PATTERN.search(code)
+    if write:
+        raise QueryRejected(f"comando de escrita não permitido na consulta: {write.group(1).upper()}")
+
+
+def explain_cost(conn, sql):
+    """Custo estimado pelo otimizador; None quando o banco não informa custo"""
+    dialect = conn.dialect.name
+    if dialect == "mysql":
+        plan = json.loads(conn.execute(text(f"EXPLAIN FORMAT=JSON {sql}")).scalar())
+        cost = plan.get("query_block", {}).get("cost_info", {}).get("query_cost")
+        return float(cost) if cost is not None else None
+    if dialect == "postgresql":
+        plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return float(plan[0]["Plan"]["Total Cost"])
+    return None
+
+
+class _StatementTimeout:
+    """Timeout por instrução na conexão, desfeito ao sair (a conexão volta ao pool)"""
+
+    def __init__(self, conn, timeout_ms):
+        self.conn = conn
+        self.timeout_ms = timeout_ms
+        self._dbapi_connection = None
+
+    def __enter__(self):
+        if not self.timeout_ms:
+            return self
+        dialect = self.conn.dialect.name
+        if dialect == "mysql":
+            self.conn.execute(text(f"SET SESSION MAX_EXECUTION_TIME = {int(self.timeout_ms)}"))
+        elif dialect == "postgresql":
+            self.conn.execute(text(f"SET statement_timeout = {int(self.timeout_ms)}"))
+        elif dialect == "sqlite":
+            deadline = time.monotonic() + self.timeout_ms / 1000
+            self._dbapi_connection = self.conn.connection.dbapi_connection
+            # Retorno diferente de zero interrompe a instrução em andamento
+            self._dbapi_connection.set_progress_handler(lambda: time.monotonic() > deadline, 10000)
+        return self
+
+    def __exit__(self, *exc_info):
+        if not self.timeout_ms:
+            return False
+        dialect = self.conn.dialect.name
+        try:
+            if dialect == "mysql":
+                self.conn.execute(text("SET SESSION MAX_EXECUTION_TIME = 0"))
+            elif dialect == "postgresql":
+                self.conn.execute(text("SET statement_timeout = 0"))
+            elif self._dbapi_connection is not None:
+                self._dbapi_connection.set_progress_handler(None, 0)
+        except Exception:
+            # Conexão em estado inválido: o pool descarta no próximo checkout
+            pass
+        return False
+
+
+class _ReadOnlyTransaction:
+    """Transação somente leitura na conexão, desfeita ao sair (a conexão volta ao pool)"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        dialect = self.conn.dialect.name
+        if dialect == "mysql":
+            self.conn.execute(text("START TRANSACTION READ ONLY"))
+        elif dialect == "postgresql":
+            self.conn.execute(text("SET TRANSACTION READ ONLY"))
+        elif dialect == "sqlite":
+            self.conn.execute(text("PRAGMA query_only = ON"))
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            # Nada a gravar: rollback encerra a transação somente leitura
+            self.conn.rollback()
+            if self.conn.dialect.name == "sqlite":
+                self.conn.execute(text("PRAGMA query_only = OFF"))
+                self.conn.commit()
+        except Exception:
+            # Conexão em estado inválido: o pool descarta no próximo checkout
+            pass
+        return False
+
+
+def _count_rows(conn, sql, limit=SQL_COUNT_LIMIT):
+    """Total de linhas até `limit`; None acima disso (a contagem não refaz a consulta inteira)"""
+    try:
+        total = conn.execute(
+            text(f"SELECT COUNT(*) FROM (SELECT 1 FROM ({sql}) AS resultado LIMIT :limite) AS resultado_limitado"),
+            {"limite": limit + 1},
+        ).scalar()
+    except Exception:
+        return None
+    return total if total <= limit else None
+
+
+def execute_guarded(engine, sql, max_rows=SQL_MAX_ROWS, timeout_ms=SQL_STATEMENT_TIMEOUT_MS,
+                    max_cost=SQL_MAX_EXPLAIN_COST, batch_size=SQL_FETCH_BATCH):
+    """Executa o SQL com limite de linhas, timeout e verificação de custo"""
+    sql = _strip_sql(sql)
+    check_read_only(sql)
+    start = time.perf_counter()
+    with engine.connect() as conn, _ReadOnlyTransaction(conn):
+        with _StatementTimeout(conn, timeout_ms):
+            cost = explain_cost(conn, sql) if max_cost else None
+            if cost is not None and cost > max_cost:
+                raise QueryRejected(
+                    f"custo estimado da consulta ({cost:,.0f}) acima do limite ({max_cost:,.0f})"
+                )
+
+            result = conn.execution_options(stream_results=True).execute(text(sql))
+            guarded = GuardedResult(columns=list(result.keys()), explain_cost=cost)
+            try:
+                # Lê uma linha além do limite só para saber se houve corte
+                while len(guarded.rows) <= max_rows:
+                    batch = result.fetchmany(min(batch_size, max_rows + 1 - len(guarded.rows)))
+                    if not batch:
+                        break
+                    guarded.rows.extend(batch)
+            finally:
+                result.close()
+
+            if len(guarded.rows) > max_rows:
+                guarded.rows = guarded.rows[:max_rows]
+                guarded.truncated = True
+                guarded.total_rows = _count_rows(conn, sql)
+            else:
+                guarded.total_rows = len(guarded.rows)
+    guarded.elapsed = time.perf_counter() - start
+    return guarded
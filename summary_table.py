@@ -0,0 +1,162 @@
+"""Tabela de resumo ISP_PRODUTO_ATUAL: a linha mais recente (rn = 1) por ISP e produto.
+
+Substitui o SUM/MAX/ROW_NUMBER sobre COM_MATRIZ_PRECO_V2 a cada consulta por
+uma leitura indexada. A atualização é incremental (incremental_table): só os
+ISPs com linhas cujo marcador (ISP_SUMMARY_UPDATED_COLUMN ou isp_vencimento)
+chegou à última marca d'água são recalculados (delete + insert por lote).
+
+Uso:
+    python summary_table.py           # cria a tabela (se preciso) e atualiza
+    python summary_table.py --full    # reconstrói do zero
+"""
+import os
+import sys
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, bindparam, text
+from db import env_bool
+from incremental_table import IncrementalTable, run_cli
+
+ISP_SUMMARY_ENABLED = env_bool("ISP_SUMMARY_ENABLED", True)
+ISP_SUMMARY_REFRESH_SECONDS = int(os.getenv("ISP_SUMMARY_REFRESH_SECONDS", "900"))
+# Reconstrução completa periódica: pega edições em linhas abaixo da marca d'água
+ISP_SUMMARY_FULL_REFRESH_SECONDS = int(os.getenv("ISP_SUMMARY_FULL_REFRESH_SECONDS", str(24 * 3600)))
+ISP_SUMMARY_CHUNK_SIZE = int(os.getenv("ISP_SUMMARY_CHUNK_SIZE", "500"))
+SUMMARY_TABLE = "ISP_PRODUTO_ATUAL"
+
+metadata = MetaData()
+summary = Table(
+    SUMMARY_TABLE, metadata,
+    Column("isp_sf_id", String(18), primary_key=True),
+    Column("produto_sf_code", String(255), primary_key=True),
+    Column("pacote_id", String(255)),
+    Column("pacote_valor_unit", Float),
+    Column("valor_total", Float),
+    Column("isp_vencimento", String(32)),
+    Column("isp_sf_status", String(64)),
+    Column("tickets_contratados", Integer),
+    Column("tickets_distribuidos", Integer),
+    Column("pacote_metodo", String(64)),
+    Column("tickets_metodo", Integer),
+    Column("valor_calculado", Float),
+)
+_table = IncrementalTable(
+    summary, ISP_SUMMARY_ENABLED, ISP_SUMMARY_REFRESH_SECONDS, ISP_SUMMARY_FULL_REFRESH_SECONDS,
+    lambda engine, full: refresh_summary(engine, full=full),
+)
+summary_meta = _table.meta
+
+# Mesmo cálculo de ISP_QUERY_TEMPLATE, particionado por ISP e produto
+REFRESH_QUERY = """
+    SELECT isp_sf_id, produto_sf_code, pacote_id, pacote_valor_unit, valor_total, isp_vencimento,
+           isp_sf_status, tickets_contratados, tickets_distribuidos, pacote_metodo, tickets_metodo,
+           valor_calculado
+    FROM (
+        SELECT
+            m.isp_sf_id,
+            m.produto_sf_code,
+            m.pacote_id,
+            m.pacote_valor_unit,
+            SUM(m.valor_total) as valor_total,
+            m.isp_vencimento,
+            m.isp_sf_status,
+            MAX(m.tickets_contratados) as tickets_contratados,
+            MAX(m.tickets_distribuidos) as tickets_distribuidos,
+            m.pacote_metodo,
+            m.tickets_metodo,
+            (m.tickets_metodo * m.pacote_valor_unit) as valor_calculado,
+            ROW_NUMBER() OVER (PARTITION BY m.isp_sf_id, m.produto_sf_code ORDER BY m.isp_vencimento DESC) as rn
+        FROM COM_MATRIZ_PRECO_V2 m
+        WHERE m.isp_sf_id IN :ids AND m.produto_sf_code IS NOT NULL
+        GROUP BY
+            m.isp_sf_id,
+            m.produto_sf_code,
+            m.pacote_id,
+            m.pacote_valor_unit,
+            m.isp_vencimento,
+            m.isp_sf_status,
+            m.pacote_metodo,
+            m.tickets_metodo
+    ) ranked
+    WHERE rn = 1
+"""
+
+# Consulta do prontuário sobre o resumo: mesmas colunas, na mesma ordem, de ISP_QUERY_TEMPLATE
+SUMMARY_QUERY_TEMPLATE = f"""
+        SELECT
+            c.Id as sf_id,
+            c.CA_CNPJ__c,
+            c.Name,
+            c.CA_SituacaoFinanceira__c,
+            c.ERP__c,
+            c.CA_DataUltFaturamento__c,
+            s.produto_sf_code,
+            s.pacote_id,
+            s.pacote_valor_unit,
+            s.valor_total,
+            s.isp_vencimento,
+            s.isp_sf_status,
+            s.tickets_contratados,
+            s.tickets_distribuidos,
+            s.pacote_metodo,
+            s.tickets_metodo,
+            s.valor_calculado
+        FROM DIM_SF_CONTAS c
+        JOIN {SUMMARY_TABLE} s ON s.isp_sf_id = c.Id
+        WHERE {{condition}}
+        ORDER BY {{order_by}};
+"""
+
+_listeners = []
+
+
+def add_refresh_listener(callback):
+    """Registra callback(sf_ids) chamado com os ISPs recalculados em cada atualização"""
+    _listeners.append(callback)
+
+
+def _row_values(row):
+    values = dict(zip([column.name for column in summary.columns], row))
+    if values["isp_vencimento"] is not None:
+        values["isp_vencimento"] = str(values["isp_vencimento"])
+    return values
+
+
+def _refresh_chunk(conn, changed):
+    sf_ids = [row[0] for row in changed]
+    query = text(REFRESH_QUERY).bindparams(bindparam("ids", expanding=True))
+    rows = [_row_values(row) for row in conn.execute(query, {"ids": sf_ids})]
+    conn.execute(summary.delete().where(summary.c.isp_sf_id.in_(sf_ids)))
+    if rows:
+        conn.execute(summary.insert(), rows)
+    return len(rows)
+
+
+def refresh_summary(engine=None, full=False, chunk_size=ISP_SUMMARY_CHUNK_SIZE):
+    """Cria a tabela se preciso e recalcula os ISPs alterados desde a última marca d'água"""
+    report, changed = _table.refresh(
+        engine, full, chunk_size,
+        "SELECT DISTINCT isp_sf_id FROM COM_MATRIZ_PRECO_V2 WHERE {condition}",
+        _refresh_chunk,
+    )
+    for callback in _listeners:
+        callback(changed)
+    return report
+
+
+def mark_summary_unavailable():
+    _table.mark_unavailable()
+
+
+def summary_available(engine=None, recheck_seconds=60):
+    """True se o resumo existe e já foi carregado; dispara a atualização em segundo plano quando expira.
+
+    A tabela só é criada por refresh_summary (CLI ou job); a aplicação apenas lê e mantém.
+    """
+    return _table.available(engine, recheck_seconds)
+
+
+def main(argv=None):
+    return run_cli(f"Atualiza a tabela de resumo {SUMMARY_TABLE}", refresh_summary, ISP_SUMMARY_CHUNK_SIZE, argv)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
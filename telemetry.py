@@ -0,0 +1,191 @@
+"""Telemetria leve por etapa: spans de tempo, histogramas em memória e contadores.
+
+Cada span alimenta um histograma por etapa (buckets fixos, formato
+Prometheus) e uma amostra recente usada para p50/p95/p99.
+"""
+import functools
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from db import env_bool
+
+TELEMETRY_DISABLED = env_bool("TELEMETRY_DISABLED", False)
+TELEMETRY_SAMPLE_SIZE = int(os.getenv("TELEMETRY_SAMPLE_SIZE", "2048"))
+
+# Limites dos buckets em segundos (de 1 ms a 60 s)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+QUANTILES = (0.5, 0.95, 0.99)
+METRIC_PREFIX = "assistente"
+
+
+def _quantile(ordered, q):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class StageHistogram:
+    """Durações de uma etapa: buckets cumulativos + amostra recente para quantis"""
+
+    def __init__(self, sample_size=TELEMETRY_SAMPLE_SIZE):
+        self.bucket_counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+        self.recent = deque(maxlen=sample_size)
+
+    def observe(self, seconds, error=False):
+        self.bucket_counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.errors += int(error)
+        self.recent.append(seconds)
+
+    def snapshot(self):
+        ordered = sorted(self.recent)
+        stats = {
+            "count": self.count,
+            "errors": self.errors,
+            "mean_ms": self.total / self.count * 1000 if self.count else 0.0,
+            "max_ms": ordered[-1] * 1000 if ordered else 0.0,
+        }
+        for q in QUANTILES:
+            stats[f"p{int(q * 100)}_ms"] = _quantile(ordered, q) * 1000
+        return stats
+
+
+class Telemetry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}
+        self.counters = {}
+
+    def observe(self, stage, seconds, error=False):
+        with self._lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = StageHistogram()
+            histogram.observe(seconds, error)
+
+    def increment(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "stages": {stage: histogram.snapshot() for stage, histogram in sorted(self.stages.items())},
+                "counters": [
+                    {"name": name, **dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+            }
+
+    def reset(self):
+        with self._lock:
+            self.stages.clear()
+            self.counters.clear()
+
+    def prometheus_text(self):
+        """Exportação no formato texto do Prometheus (histograma + quantis + contadores)"""
+        name = f"{METRIC_PREFIX}_stage_duration_seconds"
+        lines = [
+            f"# HELP {name} Duração de cada etapa do assistente.",
+            f"# TYPE {name} histogram",
+        ]
+        with self._lock:
+            stages = sorted(self.stages.items())
+            counters = sorted(self.counters.items())
+            quantiles = {stage: sorted(histogram.recent) for stage, histogram in stages}
+            for stage, histogram in stages:
+                cumulative = 0
+                for bound, bucket_count in zip(BUCKETS + (float("inf"),), histogram.bucket_counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {histogram.total:.6f}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {histogram.count}')
+            error_lines = [(stage, histogram.errors) for stage, histogram in stages]
+
+        quantile_name = f"{METRIC_PREFIX}_stage_duration_quantile_seconds"
+        lines += [
+            f"# HELP {quantile_name} Quantis recentes da duração de cada etapa.",
+            f"# TYPE {quantile_name} gauge",
+        ]
+        for stage, ordered in quantiles.items():
+            for q in QUANTILES:
+                lines.append(f'{quantile_name}{{stage="{stage}",quantile="{q}"}} {_quantile(ordered, q):.6f}')
+
+        errors_name = f"{METRIC_PREFIX}_stage_errors_total"
+        lines += [f"# HELP {errors_name} Etapas que terminaram com exceção.", f"# TYPE {errors_name} counter"]
+        lines += [f'{errors_name}{{stage="{stage}"}} {errors}' for stage, errors in error_lines]
+
+        for counter_name in sorted({name for (name, _), _ in counters}):
+            full_name = f"{METRIC_PREFIX}_{counter_name}_total"
+            lines.append(f"# TYPE {full_name} counter")
+            for (name, labels), value in counters:
+                if name == counter_name:
+                    label_text = ",".join(f'{key}="{label}"' for key, label in labels)
+                    lines.append(f"{full_name}{{{label_text}}} {value}")
+        return "\n".join(lines) + "\n"
+
+
+_telemetry = Telemetry()
+
+
+@contextmanager
+def span(stage):
+    """Mede a duração de um bloco e registra no histograma da etapa"""
+    if TELEMETRY_DISABLED:
+        yield
+        return
+    started = time.perf_counter()
+    error = False
+    try:
+        yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        _telemetry.observe(stage, time.perf_counter() - started, error)
+
+
+def timed(stage):
+    """Decorador equivalente a `with span(stage)` em volta da função"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observe(stage, seconds):
+    """Registra uma duração já medida (ex.: tempo até o primeiro token)"""
+    if not TELEMETRY_DISABLED:
+        _telemetry.observe(stage, seconds)
+
+
+def record_tokens(stage, prompt_tokens, completion_tokens):
+    if TELEMETRY_DISABLED:
+        return
+    _telemetry.increment("llm_tokens", prompt_tokens, stage=stage, kind="prompt")
+    _telemetry.increment("llm_tokens", completion_tokens, stage=stage, kind="completion")
+    _telemetry.increment("llm_calls", 1, stage=stage)
+
+
+def telemetry_snapshot():
+    return _telemetry.snapshot()
+
+
+def prometheus_text():
+    return _telemetry.prometheus_text()
+
+
+def reset_telemetry():
+    _telemetry.reset()
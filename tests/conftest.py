@@ -0,0 +1,38 @@
+import os
+import shutil
+import sys
+import tempfile
+import pytest
+
+# Módulos da aplicação ficam na raiz do repositório
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Ambiente apontado para o banco sintético antes de qualquer import da aplicação
+WORKDIR = tempfile.mkdtemp(prefix="assistente-tests-")
+DB_PATH = os.path.join(WORKDIR, "tests.sqlite3")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+os.environ["LLM_CACHE_DISABLED"] = "1"
+os.environ["LLM_CACHE_PATH"] = os.path.join(WORKDIR, "llm_cache.sqlite3")
+os.environ["SCHEMA_CACHE_DIR"] = WORKDIR
+os.environ["PREFETCH_ENABLED"] = "0"
+os.environ.setdefault("GROQ_API_KEY", "tests")
+
+ACCOUNTS = 60
+PRICE_ROWS = 1200
+
+
+@pytest.fixture(scope="session")
+def synthetic_db():
+    """Banco sintético do benchmark (60 contas, 20 linhas de preço por conta)"""
+    from benchmark import build_synthetic_db
+    build_synthetic_db(DB_PATH, ACCOUNTS, PRICE_ROWS)
+    yield DB_PATH
+    from db import dispose_engines
+    dispose_engines()
+    shutil.rmtree(WORKDIR, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def sf_ids(synthetic_db):
+    return [f"001BENCH{i:07d}" for i in range(ACCOUNTS)]
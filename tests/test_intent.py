@@ -0,0 +1,30 @@
+import pytest
+from intent import match_intent
+
+NOMES = ["HBO MAX", "Paramount Plus", "Deezer Premium"]
+
+
+@pytest.mark.parametrize("question, expected", [
+    ("qual o potencial de upsell do HBO MAX?", "ticket"),
+    ("qual o ticket médio do Deezer?", "ticket"),
+    ("qual a receita potencial do HBO MAX?", "potencial"),
+    ("qual o potencial do Paramount?", "potencial"),
+    ("qual o ROI do HBO MAX?", "roi"),
+])
+def test_routes_direct_questions(question, expected):
+    intent, _products = match_intent(question, NOMES)
+    assert intent.key == expected
+
+
+def test_matches_product_names():
+    _intent, products = match_intent("qual o potencial de upsell do HBO MAX?", NOMES)
+    assert products == ["HBO MAX"]
+
+
+@pytest.mark.parametrize("question", [
+    "por que o HBO MAX tem ticket baixo?",
+    "como aumentar o upsell do Deezer?",
+    "quanto falta para bater a meta do HBO MAX?",
+])
+def test_open_ended_questions_go_to_llm(question):
+    assert match_intent(question, NOMES) is None
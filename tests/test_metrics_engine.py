@@ -0,0 +1,25 @@
+import pytest
+import utils
+from market_benchmarks import refresh_benchmarks
+from metrics_engine import calculate_portfolio_metrics
+
+
+@pytest.fixture(scope="module")
+def isps(sf_ids):
+    # Benchmarks carregados antes: senão a primeira chamada usa a referência fixa
+    refresh_benchmarks(full=True)
+    return [data for _identifier, data, _response in utils.iter_isp_info_batch(sf_ids, use_cache=False)]
+
+
+def test_portfolio_matches_business_metrics(isps):
+    assert isps and all(data is not None for data in isps)
+    portfolio = calculate_portfolio_metrics(isps)
+    for data in isps:
+        expected = utils.calculate_business_metrics(data)
+        actual = portfolio[data.sf_id]
+        assert actual["total_faturamento"] == pytest.approx(expected["total_faturamento"])
+        assert actual["distribuicao_receita"] == pytest.approx(expected["distribuicao_receita"])
+        assert actual["produtos"].keys() == expected["produtos"].keys()
+        for produto, metrics in expected["produtos"].items():
+            # Diferenças de arredondamento perto de zero (ex.: upsell 1e-14) não contam
+            assert actual["produtos"][produto] == pytest.approx(metrics, abs=1e-9), (data.sf_id, produto)
@@ -0,0 +1,36 @@
+import pytest
+from db import get_engine
+from sql_guard import QueryRejected, check_read_only, execute_guarded
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT Name FROM DIM_SF_CONTAS",
+    "select Name from DIM_SF_CONTAS;",
+    "WITH t AS (SELECT 1 AS x) SELECT x FROM t",
+    "SELECT Name FROM DIM_SF_CONTAS WHERE Name LIKE '%;%'",
+    "SELECT Name FROM DIM_SF_CONTAS -- delete depois",
+    "SELECT 'drop table' AS aviso",
+    "SELECT updated_at, created_by FROM t",
+])
+def test_accepts_single_select(sql):
+    check_read_only(sql)
+
+
+@pytest.mark.parametrize("sql", [
+    "DELETE FROM DIM_SF_CONTAS",
+    "UPDATE DIM_SF_CONTAS SET Name = 'x'",
+    "SELECT 1; DROP TABLE DIM_SF_CONTAS",
+    "SELECT * INTO copia FROM DIM_SF_CONTAS",
+    "WITH t AS (DELETE FROM DIM_SF_CONTAS RETURNING *) SELECT * FROM t",
+    "/* SELECT */ PRAGMA writable_schema = 1",
+    "SELECT 1 /* ; */; ATTACH 'x.db' AS y",
+])
+def test_rejects_writes_and_multiple_statements(sql):
+    with pytest.raises(QueryRejected):
+        check_read_only(sql)
+
+
+def test_execute_guarded_truncates_rows(synthetic_db):
+    result = execute_guarded(get_engine(), "SELECT Id FROM DIM_SF_CONTAS ORDER BY Id", max_rows=10)
+    assert len(result.rows) == 10
+    assert result.truncated
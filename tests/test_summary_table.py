@@ -0,0 +1,39 @@
+import sqlite3
+import pytest
+import utils
+from summary_table import SUMMARY_QUERY_TEMPLATE, refresh_summary
+
+
+def _records(sf_ids, template):
+    return {
+        sf_id: utils._fetch_isp_info(sf_id, by_id=True, template=template)[0].to_dict()
+        for sf_id in sf_ids
+    }
+
+
+@pytest.fixture(scope="module")
+def summary(synthetic_db):
+    return refresh_summary(full=True)
+
+
+def test_summary_matches_cte(summary, sf_ids):
+    assert summary["isps_recalculados"] == len(sf_ids)
+    assert _records(sf_ids, SUMMARY_QUERY_TEMPLATE) == _records(sf_ids, utils.ISP_QUERY_TEMPLATE)
+
+
+def test_account_missing_from_summary_falls_back_to_cte(summary, synthetic_db):
+    conn = sqlite3.connect(synthetic_db)
+    with conn:
+        conn.execute(
+            "INSERT INTO DIM_SF_CONTAS VALUES ('001TESTFORA0001', '99999999000199', 'Conta Fora do Resumo', "
+            "'Adimplente', 'IXC', '2024-01-10')"
+        )
+        conn.execute(
+            "INSERT INTO COM_MATRIZ_PRECO_V2 VALUES ('001TESTFORA0001', 'HBO MAX', 'P1', 19.1, 3820.0, "
+            "'2024-01-10', 'Ativo', 200, 150, 'Mínimo', 200)"
+        )
+    conn.close()
+    # Vencimento abaixo da marca d'água: a atualização incremental não vê a conta
+    refresh_summary()
+    data, _response, _raw = utils._fetch_isp_info("99999999000199", template=SUMMARY_QUERY_TEMPLATE)
+    assert data is not None and data.sf_id == "001TESTFORA0001"
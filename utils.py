@@ -1,24 +1,94 @@
 import os
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, text
-from langchain_groq import ChatGroq
-from langchain.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
+from sqlalchemy import text, bindparam
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+import asyncio
 import json
+import re
+import hashlib
+import threading
+import time
+from collections import deque
 from datetime import datetime
+from itertools import groupby
+from db import env_bool, get_engine
+from cache import TTLCache
+from name_index import get_name_index
+from models import ISPRecord, ProdutoRecord, format_currency
+from llm_cache import get_llm_cache, LLM_CACHE_DISABLED
+from llm_gateway import LLMGateway
+from market_benchmarks import benchmark_version, get_market_benchmark
+from prompt_context import build_prompt_context, estimate_tokens, PROMPT_CONTEXT_VERSION
+from telemetry import span, timed, observe, record_tokens
+from intent import answer_locally
+from summary_table import SUMMARY_QUERY_TEMPLATE, add_refresh_listener, mark_summary_unavailable, summary_available
 
 load_dotenv()
 
+# Cache de prontuários: sf_id -> {"data", "response", "ultimo_faturamento_raw"}
+_isp_cache = TTLCache(
+    maxsize=int(os.getenv("ISP_CACHE_SIZE", "512")),
+    ttl=int(os.getenv("ISP_CACHE_TTL", "900")),
+)
+# Identificador normalizado (CNPJ ou nome) -> sf_id resolvido
+_isp_aliases = TTLCache(
+    maxsize=int(os.getenv("ISP_CACHE_SIZE", "512")) * 4,
+    ttl=int(os.getenv("ISP_CACHE_TTL", "900")),
+)
+# Métricas de negócio por hash do conteúdo do ISP (calculadas uma vez por versão dos dados)
+_metrics_cache = TTLCache(
+    maxsize=int(os.getenv("METRICS_CACHE_SIZE", "1024")),
+    ttl=int(os.getenv("METRICS_CACHE_TTL", "3600")),
+)
+# Latência das respostas do chat (últimas requisições)
+_llm_latencies = deque(maxlen=int(os.getenv("LLM_LATENCY_HISTORY", "500")))
+# sf_id das últimas buscas atendidas (ranking do pré-aquecimento)
+_recent_lookups = deque(maxlen=int(os.getenv("ISP_LOOKUP_HISTORY", "5000")))
+ISP_CACHE_VALIDATE = env_bool("ISP_CACHE_VALIDATE", True)
+# Tamanho dos lotes de contas por consulta no modo carteira
+BATCH_CHUNK_SIZE = int(os.getenv("ISP_BATCH_CHUNK_SIZE", "500"))
+INTENT_FAST_PATH = env_bool("INTENT_FAST_PATH", True)
+ISP_NOT_FOUND_MESSAGE = "⚠️ Nenhum ISP encontrado com os dados informados. Por favor, verifique o CNPJ ou Razão Social."
+SF_ACCOUNT_ID_PATTERN = re.compile(r"^001[0-9A-Za-z]{12}(?:[0-9A-Za-z]{3})?$")
+
 def get_db_engine():
-    DATABASE_URL = os.getenv("DATABASE_URL")
-    return create_engine(DATABASE_URL)
+    return get_engine(os.getenv("DATABASE_URL"))
+
+LLM_MODEL_NAME = "mixtral-8x7b-32768"
+
+# LLM substituto (benchmarks e execuções offline); None usa o ChatGroq
+_llm_override = None
+_llm_client = None
+_llm_client_lock = threading.Lock()
+
+def set_llm(llm):
+    global _llm_override
+    _llm_override = llm
 
 def get_llm():
-    return ChatGroq(
-        groq_api_key=os.getenv("GROQ_API_KEY"),
-        model_name="mixtral-8x7b-32768",
-        temperature=0.1,
-    )
+    """Cliente do LLM compartilhado pelo processo (criado uma vez)"""
+    global _llm_client
+    if _llm_override is not None:
+        return _llm_override
+    with _llm_client_lock:
+        if _llm_client is None:
+            # Importado no primeiro uso: buscas por CNPJ não pagam o carregamento do LangChain
+            from langchain_groq import ChatGroq
+            _llm_client = ChatGroq(
+                groq_api_key=os.getenv("GROQ_API_KEY"),
+                model_name=LLM_MODEL_NAME,
+                temperature=0.1,
+            )
+        return _llm_client
+
+# Todas as chamadas ao LLM passam pelo gateway: deduplicação, fila e retry de 429
+_llm_gateway = LLMGateway(get_llm)
+
+def get_llm_gateway():
+    return _llm_gateway
+
+def llm_gateway_stats():
+    return _llm_gateway.stats()
 
 FOLLOW_UP_PROMPT = """
 Você é um consultor comercial especializado no mercado B2B2C de streaming.
@@ -26,6 +96,7 @@ Analise os dados da ISP {isp_name} e responda de forma objetiva.
 
 CONTEXTO:
 {data}
+(Chaves: fat=faturamento total, venc=vencimento, sit=situação financeira, vu=valor unitário, vc=valor calculado, tc/td/tm=tickets contratados/distribuídos/faturados, util=utilização, bench_util=benchmark de utilização, pot_cresc=potencial de crescimento, pct_receita=% da receita)
 
 PERGUNTA: {question}
 
@@ -66,6 +137,56 @@ NÃO REPITA dados que já aparecem no prontuário ou em perguntas anteriores.
 SEMPRE sugira uma próxima pergunta que agregue valor ao contexto atual.
 """
 
+ISP_QUERY_TEMPLATE = """
+        WITH RankedProducts AS (
+            SELECT 
+                c.Id as sf_id,
+                c.CA_CNPJ__c,
+                c.Name,
+                c.CA_SituacaoFinanceira__c,
+                c.ERP__c,
+                c.CA_DataUltFaturamento__c,
+                m.produto_sf_code,
+                m.pacote_id,
+                m.pacote_valor_unit,
+                SUM(m.valor_total) as valor_total,
+                m.isp_vencimento,
+                m.isp_sf_status,
+                MAX(m.tickets_contratados) as tickets_contratados,
+                MAX(m.tickets_distribuidos) as tickets_distribuidos,
+                m.pacote_metodo,
+                m.tickets_metodo,
+                (m.tickets_metodo * m.pacote_valor_unit) as valor_calculado,
+                ROW_NUMBER() OVER (PARTITION BY {partition} ORDER BY m.isp_vencimento DESC) as rn
+            FROM DIM_SF_CONTAS c
+            LEFT JOIN COM_MATRIZ_PRECO_V2 m ON c.Id = m.isp_sf_id
+            WHERE {condition}
+            GROUP BY 
+                c.Id,
+                c.CA_CNPJ__c,
+                c.Name,
+                c.CA_SituacaoFinanceira__c,
+                c.ERP__c,
+                c.CA_DataUltFaturamento__c,
+                m.produto_sf_code,
+                m.pacote_id,
+                m.pacote_valor_unit,
+                m.isp_vencimento,
+                m.isp_sf_status,
+                m.pacote_metodo,
+                m.tickets_metodo
+        )
+        SELECT *
+        FROM RankedProducts
+        WHERE rn = 1 AND produto_sf_code IS NOT NULL
+        ORDER BY {order_by};
+"""
+
+# Versão do prompt derivada do texto: qualquer alteração invalida as respostas em cache
+FOLLOW_UP_PROMPT_VERSION = hashlib.sha1(
+    (FOLLOW_UP_PROMPT + PROMPT_CONTEXT_VERSION).encode("utf-8")
+).hexdigest()[:12]
+
 def format_date(date_str):
     if date_str and date_str != "None":
         try:
@@ -76,34 +197,8 @@ def format_date(date_str):
     return "Não disponível"
 
 def get_benchmark_data(produto_nome):
-    benchmarks = {
-        "PARAMOUNT+ AVULSO": {
-            "media_utilizacao": 0.65,
-            "ticket_medio": 4.80,
-            "penetracao_mercado": 0.45,
-            "churn_aceitavel": 0.15
-        },
-        "HBO MAX": {
-            "media_utilizacao": 0.70,
-            "ticket_medio": 19.10,
-            "penetracao_mercado": 0.35,
-            "churn_aceitavel": 0.12
-        },
-        "WATCH LIGHT": {
-            "media_utilizacao": 0.75,
-            "ticket_medio": 0.30,
-            "penetracao_mercado": 0.60,
-            "churn_aceitavel": 0.20
-        }
-    }
-    # Valores padrão para produtos não mapeados
-    default = {
-        "media_utilizacao": 0.60,
-        "ticket_medio": 0.0,
-        "penetracao_mercado": 0.40,
-        "churn_aceitavel": 0.15
-    }
-    return benchmarks.get(produto_nome, default)
+    """Benchmark de mercado do produto (calculado de COM_MATRIZ_PRECO_V2; referência fixa sem dados)"""
+    return get_market_benchmark(produto_nome)
 
 def calculate_business_metrics(isp_data):
     metrics = {
@@ -113,24 +208,21 @@ def calculate_business_metrics(isp_data):
     }
     
     # Calcula faturamento total
-    total_faturamento = sum(
-        float(p['valor_calculado'].replace('R$ ', '').replace(',', '')) 
-        for p in isp_data['produtos']
-    )
+    total_faturamento = sum(p.valor_calculado for p in isp_data.produtos)
     metrics['total_faturamento'] = total_faturamento
     
-    for produto in isp_data["produtos"]:
-        nome = produto["nome"]
+    for produto in isp_data.produtos:
+        nome = produto.nome
         benchmark = get_benchmark_data(nome)
         
         # Cálculos básicos
-        valor_unitario = float(produto["valor_unitario"].replace("R$ ", ""))
-        valor_produto = float(produto['valor_calculado'].replace('R$ ', '').replace(',', ''))
-        utilizacao_atual = produto["tickets_distribuidos"] / produto["tickets_contratados"]
+        valor_unitario = produto.valor_unitario or 0.0
+        valor_produto = produto.valor_calculado
+        utilizacao_atual = produto.tickets_distribuidos / produto.tickets_contratados
         
         # Métricas avançadas
         potencial_crescimento = max(0, benchmark["media_utilizacao"] - utilizacao_atual)
-        tickets_potenciais = int(produto["tickets_contratados"] * potencial_crescimento)
+        tickets_potenciais = int(produto.tickets_contratados * potencial_crescimento)
         receita_potencial = tickets_potenciais * valor_unitario
         
         # Cálculo de ROI
@@ -140,6 +232,7 @@ def calculate_business_metrics(isp_data):
         metrics["produtos"][nome] = {
             "utilizacao_atual": utilizacao_atual,
             "benchmark_utilizacao": benchmark["media_utilizacao"],
+            "benchmark_p75_utilizacao": benchmark["p75_utilizacao"],
             "potencial_crescimento": potencial_crescimento,
             "ticket_medio_atual": valor_unitario,
             "benchmark_ticket": benchmark["ticket_medio"],
@@ -154,140 +247,481 @@ def calculate_business_metrics(isp_data):
     
     return metrics
 
-def query_isp_info(identifier):
-    engine = get_db_engine()
-    
+def _normalize_identifier(identifier):
+    identifier = identifier.strip()
+    if identifier.isdigit():
+        return f"cnpj:{identifier}"
+    return "nome:" + " ".join(identifier.casefold().split())
+
+def _fetch_billing_dates(sf_ids):
     query = text("""
-        WITH RankedProducts AS (
-            SELECT 
-                c.Id as sf_id,
-                c.CA_CNPJ__c,
-                c.Name,
-                c.CA_SituacaoFinanceira__c,
-                c.ERP__c,
-                c.CA_DataUltFaturamento__c,
-                m.produto_sf_code,
-                m.pacote_id,
-                m.pacote_valor_unit,
-                SUM(m.valor_total) as valor_total,
-                m.isp_vencimento,
-                m.isp_sf_status,
-                MAX(m.tickets_contratados) as tickets_contratados,
-                MAX(m.tickets_distribuidos) as tickets_distribuidos,
-                m.pacote_metodo,
-                m.tickets_metodo,
-                (m.tickets_metodo * m.pacote_valor_unit) as valor_calculado,
-                ROW_NUMBER() OVER (PARTITION BY m.produto_sf_code ORDER BY m.isp_vencimento DESC) as rn
-            FROM DIM_SF_CONTAS c
-            LEFT JOIN COM_MATRIZ_PRECO_V2 m ON c.Id = m.isp_sf_id
-            WHERE """ + 
-            ("c.CA_CNPJ__c = :identifier" if identifier.isdigit() else "c.Name LIKE :identifier") +
-            """
-            GROUP BY 
-                c.Id,
-                c.CA_CNPJ__c,
-                c.Name,
-                c.CA_SituacaoFinanceira__c,
-                c.ERP__c,
-                c.CA_DataUltFaturamento__c,
-                m.produto_sf_code,
-                m.pacote_id,
-                m.pacote_valor_unit,
-                m.isp_vencimento,
-                m.isp_sf_status,
-                m.pacote_metodo,
-                m.tickets_metodo
-        )
-        SELECT *
-        FROM RankedProducts
-        WHERE rn = 1 AND produto_sf_code IS NOT NULL
-        ORDER BY produto_sf_code;
-    """)
+        SELECT Id, CA_DataUltFaturamento__c
+        FROM DIM_SF_CONTAS
+        WHERE Id IN :ids
+    """).bindparams(bindparam("ids", expanding=True))
+    with get_db_engine().connect() as conn:
+        return {row[0]: str(row[1]) for row in conn.execute(query, {"ids": list(sf_ids)})}
+
+def invalidate_isp_cache(sf_id=None):
+    """Remove um ISP (ou todos, se sf_id for None) do cache de prontuários"""
+    if sf_id is None:
+        _isp_cache.clear()
+        _isp_aliases.clear()
+    else:
+        _isp_cache.pop(sf_id)
+
+def _invalidate_refreshed_isps(sf_ids):
+    """ISPs recalculados na tabela de resumo saem do cache de prontuários"""
+    for sf_id in sf_ids:
+        invalidate_isp_cache(sf_id)
+
+add_refresh_listener(_invalidate_refreshed_isps)
+
+def invalidate_stale_isps():
+    """Invalida entradas cujo CA_DataUltFaturamento__c mudou desde o cache"""
+    cached = dict(_isp_cache.items())
+    if not cached:
+        return []
+    current = _fetch_billing_dates(cached.keys())
+    stale = [
+        sf_id for sf_id, entry in cached.items()
+        if current.get(sf_id) != entry["ultimo_faturamento_raw"]
+    ]
+    for sf_id in stale:
+        _isp_cache.pop(sf_id)
+    return stale
+
+def isp_cache_stats():
+    return {**_isp_cache.stats(), "aliases": len(_isp_aliases)}
+
+def _resolve_name(identifier):
+    """Candidatos (sf_id) para a Razão Social pelo índice local; None se o índice ainda não está pronto"""
+    return get_name_index().resolve(identifier)
+
+def get_business_metrics(isp_data):
+    """Métricas do ISP calculadas uma única vez e reaproveitadas por todos os consumidores"""
+    # A versão dos benchmarks entra na chave: métricas antigas não sobrevivem a uma atualização
+    key = (isp_data.content_hash(), benchmark_version())
+    metrics = _metrics_cache.get(key)
+    if metrics is None:
+        with span("metrics.calculate"):
+            metrics = calculate_business_metrics(isp_data)
+        _metrics_cache.set(key, metrics)
+    return metrics
+
+def metrics_cache_stats():
+    stats = _metrics_cache.stats()
+    return {**stats, "recalculos_evitados": stats["hits"]}
+
+@timed("isp.total")
+def query_isp_info(identifier, use_cache=True):
+    identifier = identifier.strip()
+    key = _normalize_identifier(identifier)
+    sf_id = _isp_aliases.get(key) if use_cache else None
+    if sf_id is None and _is_sf_account_id(identifier):
+        # Id da conta (ex.: sessão de chat retomada)
+        sf_id = identifier
+    elif sf_id is None and not identifier.isdigit():
+        with span("isp.name_resolve"):
+            candidates = _resolve_name(identifier)
+        if candidates == []:
+            # Índice pronto e nenhum nome contém a busca: não há o que procurar no banco
+            return None, ISP_NOT_FOUND_MESSAGE
+        sf_id = candidates[0] if candidates else None
+
+    if use_cache:
+        entry = _isp_cache.get(sf_id) if sf_id else None
+        if sf_id is None:
+            _isp_cache.record_miss()
+        if entry is not None:
+            try:
+                with span("isp.cache_validate"):
+                    fresh = not ISP_CACHE_VALIDATE or (
+                        _fetch_billing_dates([sf_id]).get(sf_id) == entry["ultimo_faturamento_raw"]
+                    )
+            except Exception:
+                fresh = False
+            if fresh:
+                _isp_aliases.set(key, sf_id)
+                _recent_lookups.append(sf_id)
+                return entry["data"], entry["response"]
+            _isp_cache.pop(sf_id)
+
+    if sf_id is not None:
+        data, response, ultimo_faturamento_raw = _fetch_isp_info(sf_id, by_id=True)
+    else:
+        data, response, ultimo_faturamento_raw = _fetch_isp_info(identifier)
+    if data:
+        _isp_cache.set(data.sf_id, {
+            "data": data,
+            "response": response,
+            "ultimo_faturamento_raw": ultimo_faturamento_raw,
+        })
+        _isp_aliases.set(key, data.sf_id)
+        if data.cnpj:
+            _isp_aliases.set(_normalize_identifier(str(data.cnpj)), data.sf_id)
+        _recent_lookups.append(data.sf_id)
+    return data, response
+
+def recent_lookup_counts():
+    """Quantas vezes cada sf_id foi buscado nas últimas ISP_LOOKUP_HISTORY consultas"""
+    counts = {}
+    for sf_id in list(_recent_lookups):
+        counts[sf_id] = counts.get(sf_id, 0) + 1
+    return counts
+
+def _isp_query_template():
+    """Resumo pré-calculado (ISP_PRODUTO_ATUAL) quando disponível; senão a CTE sobre a matriz.
+
+    A META é lida pela engine padrão, nunca pelo pool do chamador (ex.: prefetch).
+    """
+    return SUMMARY_QUERY_TEMPLATE if summary_available() else ISP_QUERY_TEMPLATE
+
+def _resolve_name_by_like(engine, identifier):
+    """sf_id de uma única conta cujo nome contém a busca (mesma ordem do índice: nome mais curto primeiro)"""
+    with engine.connect() as conn:
+        return conn.execute(text(
+            "SELECT Id FROM DIM_SF_CONTAS WHERE Name LIKE :identifier ORDER BY LENGTH(Name), Name LIMIT 1"
+        ), {"identifier": f"%{identifier}%"}).scalar()
+
+def _fetch_isp_info(identifier, by_id=False, template=None):
+    with span("isp.engine"):
+        engine = get_db_engine()
+    if not by_id and not identifier.isdigit():
+        # Índice de nomes ainda não pronto: o LIKE escolhe uma conta só, para o
+        # prontuário (e o cache por sf_id/CNPJ) não misturar produtos de vários ISPs
+        try:
+            with span("isp.name_like"):
+                sf_id = _resolve_name_by_like(engine, identifier)
+        except Exception as e:
+            return None, f"❌ Erro ao consultar o banco de dados: {str(e)}", None
+        if sf_id is None:
+            return None, ISP_NOT_FOUND_MESSAGE, None
+        return _fetch_isp_info(sf_id, by_id=True)
+
+    condition = "c.Id = :identifier" if by_id else "c.CA_CNPJ__c = :identifier"
+    template = template or _isp_query_template()
+    query = text(template.format(
+        partition="m.produto_sf_code",
+        condition=condition,
+        order_by="produto_sf_code"
+    ))
     
     try:
-        with engine.connect() as conn:
-            params = {"identifier": identifier if identifier.isdigit() else f"%{identifier}%"}
-            result = conn.execute(query, params)
-            rows = result.fetchall()
+        with span("isp.connect"):
+            conn = engine.connect()
+        with conn:
+            params = {"identifier": identifier}
+            with span("isp.query"):
+                result = conn.execute(query, params)
+                rows = result.fetchall()
             
             if not rows:
-                return None, "⚠️ Nenhum ISP encontrado com os dados informados. Por favor, verifique o CNPJ ou Razão Social."
+                if template is SUMMARY_QUERY_TEMPLATE:
+                    # Conta fora do resumo (ex.: linhas abaixo da marca d'água): confirma pela CTE
+                    return _fetch_isp_info(identifier, by_id, ISP_QUERY_TEMPLATE)
+                return None, ISP_NOT_FOUND_MESSAGE, None
             
-            # Dados base do ISP
-            base_data = {
-                "sf_id": rows[0][0],
-                "cnpj": rows[0][1],
-                "nome": rows[0][2],
-                "situacao_financeira": rows[0][3] or "Não especificado",
-                "erp": rows[0][4] or "Não disponível",
-                "ultimo_faturamento": format_date(rows[0][5]),
-                "vencimento": rows[0][10] or "Não especificado",
-                "status": rows[0][11] or "Não especificado"
-            }
-            
-            # Lista de produtos
-            produtos = []
-            total_faturamento = 0
-            
-            for row in rows:
-                if row[6]:  # Se tem produto
-                    valor_total = float(row[9]) if row[9] else 0
-                    total_faturamento += valor_total
-                    valor_calculado = float(row[16]) if row[16] else 0
-                    
-                    produtos.append({
-                        "nome": row[6],
-                        "pacote": row[7],
-                        "valor_unitario": f"R$ {row[8]:.2f}" if row[8] else "Não especificado",
-                        "valor_total": f"R$ {valor_total:.2f}",
-                        "tickets_contratados": row[12] or 0,
-                        "tickets_distribuidos": row[13] or 0,
-                        "pacote_metodo": row[14] or "Não especificado",
-                        "tickets_metodo": row[15] or 0,
-                        "valor_calculado": f"R$ {valor_calculado:.2f}"
-                    })
-            
-            data = {**base_data, "produtos": produtos, "total_faturamento": f"R$ {total_faturamento:.2f}"}
+            with span("isp.row_mapping"):
+                data = _build_isp_data(rows)
+                response = build_initial_response(data)
+            return data, response, str(rows[0][5])
+        
+    except Exception as e:
+        if template is SUMMARY_QUERY_TEMPLATE and not isinstance(e, PoolTimeout):
+            # Resumo indisponível (ex.: tabela removida): refaz pela CTE
+            mark_summary_unavailable()
+            return _fetch_isp_info(identifier, by_id, ISP_QUERY_TEMPLATE)
+        return None, f"❌ Erro ao consultar o banco de dados: {str(e)}", None
+
+def _build_isp_data(rows):
+    # Lista de produtos (valores numéricos; formatação só na exibição)
+    produtos = []
+    total_faturamento = 0.0
+    
+    for row in rows:
+        if row[6]:  # Se tem produto
+            valor_total = float(row[9]) if row[9] else 0.0
+            total_faturamento += valor_total
             
-            initial_response = f"""
+            produtos.append(ProdutoRecord(
+                nome=row[6],
+                pacote=row[7],
+                valor_unitario=float(row[8]) if row[8] else None,
+                valor_total=valor_total,
+                tickets_contratados=int(row[12] or 0),
+                tickets_distribuidos=int(row[13] or 0),
+                pacote_metodo=row[14] or "Não especificado",
+                tickets_metodo=int(row[15] or 0),
+                valor_calculado=float(row[16]) if row[16] else 0.0
+            ))
+    
+    # Dados base do ISP
+    return ISPRecord(
+        sf_id=rows[0][0],
+        cnpj=rows[0][1],
+        nome=rows[0][2],
+        situacao_financeira=rows[0][3] or "Não especificado",
+        erp=rows[0][4] or "Não disponível",
+        ultimo_faturamento=format_date(rows[0][5]),
+        vencimento=str(rows[0][10]) if rows[0][10] else "Não especificado",
+        status=rows[0][11] or "Não especificado",
+        produtos=produtos,
+        total_faturamento=total_faturamento
+    )
+
+def build_initial_response(data):
+    return f"""
 Aqui está o prontuário do ISP:
 
 💰 **Financeiro:**
-   * Faturamento total: {data['total_faturamento']}
-   * Vencimento: {data['vencimento']}
+   * Faturamento total: {format_currency(data.total_faturamento)}
+   * Vencimento: {data.vencimento}
 
 🔄 **Sistema:**
-   * ERP integrado: {data['erp']}
+   * ERP integrado: {data.erp}
 
 **Informações adicionais:**
-* Nome do ISP: {data['nome']}
-* CNPJ: {data['cnpj']}
-* Situação financeira: {data['situacao_financeira']}
+* Nome do ISP: {data.nome}
+* CNPJ: {data.cnpj}
+* Situação financeira: {data.situacao_financeira}
 
 Como posso ajudar você? Algumas sugestões:
 * Gostaria de analisar a performance dos produtos? 📦
 * Quer conhecer estratégias de vendas personalizadas? 🎯
 * Posso detalhar melhor a situação financeira? 💰
 """
-            return data, initial_response
-        
-    except Exception as e:
-        return None, f"❌ Erro ao consultar o banco de dados: {str(e)}"
 
-def process_follow_up_question(question, isp_data):
-    business_metrics = calculate_business_metrics(isp_data)
-    enhanced_data = {**isp_data, "business_metrics": business_metrics}
+def _is_sf_account_id(identifier):
+    return bool(SF_ACCOUNT_ID_PATTERN.match(identifier))
+
+def iter_isp_info_batch(identifiers, chunk_size=BATCH_CHUNK_SIZE, use_cache=True, engine=None):
+    """Busca vários ISPs (CNPJs, Ids ou nomes) em poucas consultas.
+
+    Gera tuplas (identificador, data, response) na ordem em que as contas
+    chegam do banco; identificadores não encontrados saem com data None.
+    As linhas são lidas em streaming e agrupadas por sf_id. `engine` permite
+    usar um pool separado (ex.: o pré-aquecimento).
+    """
+    pending = {}  # sf_id ou CNPJ -> [identificadores originais]
+    for identifier in dict.fromkeys(i.strip() for i in identifiers if i and i.strip()):
+        key = _normalize_identifier(identifier)
+        sf_id = _isp_aliases.get(key) if use_cache else None
+        if sf_id is None and _is_sf_account_id(identifier):
+            sf_id = identifier
+        elif sf_id is None and not identifier.isdigit():
+            candidates = _resolve_name(identifier)
+            if candidates == []:
+                yield identifier, None, ISP_NOT_FOUND_MESSAGE
+                continue
+            sf_id = candidates[0] if candidates else None
+        if sf_id is None and not identifier.isdigit():
+            # Nome não resolvido pelo índice: cai na busca individual por LIKE
+            yield (identifier, *query_isp_info(identifier, use_cache=use_cache))
+            continue
+        entry = _isp_cache.get(sf_id) if use_cache and sf_id else None
+        if entry is not None:
+            yield identifier, entry["data"], entry["response"]
+            continue
+        pending.setdefault(("id", sf_id) if sf_id else ("cnpj", identifier), []).append(identifier)
+
+    keys = list(pending)
+    for start in range(0, len(keys), chunk_size):
+        chunk = keys[start:start + chunk_size]
+        found = set()
+        for data, response, ultimo_faturamento_raw in _fetch_isp_info_chunk(chunk, engine):
+            _isp_cache.set(data.sf_id, {
+                "data": data,
+                "response": response,
+                "ultimo_faturamento_raw": ultimo_faturamento_raw,
+            })
+            if data.cnpj:
+                _isp_aliases.set(_normalize_identifier(str(data.cnpj)), data.sf_id)
+            for key in (("id", data.sf_id), ("cnpj", str(data.cnpj))):
+                if key in found or key not in pending:
+                    continue
+                found.add(key)
+                for identifier in pending[key]:
+                    _isp_aliases.set(_normalize_identifier(identifier), data.sf_id)
+                    yield identifier, data, response
+        for key in chunk:
+            if key not in found:
+                for identifier in pending[key]:
+                    yield identifier, None, ISP_NOT_FOUND_MESSAGE
+
+def query_isp_info_batch(identifiers, chunk_size=BATCH_CHUNK_SIZE, use_cache=True):
+    """Versão em lote de query_isp_info: {identificador: data} (None se não encontrado)"""
+    return {
+        identifier: data
+        for identifier, data, _response in iter_isp_info_batch(identifiers, chunk_size, use_cache)
+    }
+
+def _fetch_isp_info_chunk(keys, engine=None, template=None):
+    engine = engine or get_db_engine()
+    template = template or _isp_query_template()
+    ids = [value for kind, value in keys if kind == "id"]
+    cnpjs = [value for kind, value in keys if kind == "cnpj"]
+    query = text(template.format(
+        partition="c.Id, m.produto_sf_code",
+        condition="(c.Id IN :ids OR c.CA_CNPJ__c IN :cnpjs)",
+        order_by="sf_id, produto_sf_code"
+    )).bindparams(bindparam("ids", expanding=True), bindparam("cnpjs", expanding=True))
     
-    llm = get_llm()
-    output_parser = StrOutputParser()
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=BATCH_CHUNK_SIZE).execute(
+            query, {"ids": ids, "cnpjs": cnpjs}
+        )
+        found = set()
+        for _sf_id, group in groupby(result, key=lambda row: row[0]):
+            rows = list(group)
+            data = _build_isp_data(rows)
+            found.update((("id", data.sf_id), ("cnpj", str(data.cnpj))))
+            yield data, build_initial_response(data), str(rows[0][5])
+
+    missing = [key for key in keys if key not in found]
+    if missing and template is SUMMARY_QUERY_TEMPLATE:
+        # Contas fora do resumo (ex.: linhas abaixo da marca d'água): confirma pela CTE
+        yield from _fetch_isp_info_chunk(missing, engine, ISP_QUERY_TEMPLATE)
+
+def llm_cache_stats():
+    return get_llm_cache().stats()
+
+def _record_llm_latency(started, first_token_at, cached):
+    finished = time.perf_counter()
+    _llm_latencies.append({
+        "ttft_ms": ((first_token_at or finished) - started) * 1000,
+        "total_ms": (finished - started) * 1000,
+        "cached": cached,
+        "timestamp": time.time(),
+    })
+
+def llm_latency_stats():
+    """Latências das últimas respostas do chat (tempo até o 1º token e total)"""
+    records = [r for r in _llm_latencies if not r["cached"]]
+    if not records:
+        return {"requests": len(_llm_latencies), "llm_requests": 0}
+    return {
+        "requests": len(_llm_latencies),
+        "llm_requests": len(records),
+        "ttft_ms_avg": sum(r["ttft_ms"] for r in records) / len(records),
+        "total_ms_avg": sum(r["total_ms"] for r in records) / len(records),
+        "last": records[-1],
+    }
+
+def _answer_locally(question, isp_data, business_metrics):
+    """Perguntas diretas de métricas respondidas sem o LLM (INTENT_FAST_PATH=0 desliga)"""
+    if not INTENT_FAST_PATH:
+        return None
+    with span("chat.fast_path"):
+        return answer_locally(question, isp_data, business_metrics)
+
+def _follow_up_cache_key(question, isp_data):
+    return get_llm_cache().make_key(
+        question, f"{isp_data.content_hash()}:{benchmark_version()}", FOLLOW_UP_PROMPT_VERSION, LLM_MODEL_NAME
+    )
+
+def _follow_up_messages(question, isp_data, business_metrics):
+    """Mensagens e entrada do FOLLOW_UP_PROMPT (compartilhado pelas versões síncrona e assíncrona)"""
+    if business_metrics is None:
+        business_metrics = get_business_metrics(isp_data)
+    with span("chat.prompt_context"):
+        context = build_prompt_context(question, isp_data, business_metrics)
     
-    prompt = ChatPromptTemplate.from_template(FOLLOW_UP_PROMPT)
-    chain = prompt | llm | output_parser
+    from langchain.prompts import ChatPromptTemplate
     
-    response = chain.invoke({
-        "isp_name": isp_data["nome"],
+    inputs = {
+        "isp_name": isp_data.nome,
         "question": question,
-        "data": json.dumps(enhanced_data, ensure_ascii=False, indent=2)
-    })
-    
-    return response.strip()
\ No newline at end of file
+        "data": context.text
+    }
+    return ChatPromptTemplate.from_template(FOLLOW_UP_PROMPT).format_messages(**inputs), inputs
+
+def _record_chat_tokens(inputs, chunks):
+    # Estimativa (o streaming do Groq não devolve o uso de tokens)
+    prompt_tokens = estimate_tokens(FOLLOW_UP_PROMPT) + sum(estimate_tokens(str(v)) for v in inputs.values())
+    record_tokens("chat", prompt_tokens, estimate_tokens("".join(chunks)))
+
+def stream_follow_up_question(question, isp_data, business_metrics=None, use_cache=True, use_fast_path=True):
+    """Gera a resposta do chat em pedaços, à medida que os tokens chegam do LLM"""
+    with span("chat.total"):
+        started = time.perf_counter()
+        if business_metrics is None:
+            business_metrics = get_business_metrics(isp_data)
+        local_answer = _answer_locally(question, isp_data, business_metrics) if use_fast_path else None
+        if local_answer is not None:
+            _record_llm_latency(started, None, cached=True)
+            yield local_answer
+            return
+        
+        use_cache = use_cache and not LLM_CACHE_DISABLED
+        if use_cache:
+            with span("chat.cache_lookup"):
+                cache_key = _follow_up_cache_key(question, isp_data)
+                cached = get_llm_cache().get(cache_key)
+            if cached is not None:
+                _record_llm_latency(started, None, cached=True)
+                yield cached
+                return
+        
+        messages, inputs = _follow_up_messages(question, isp_data, business_metrics)
+        
+        chunks = []
+        first_token_at = None
+        with span("chat.llm"):
+            llm_started = time.perf_counter()
+            for chunk in _llm_gateway.stream(messages):
+                if first_token_at is None and chunk:
+                    first_token_at = time.perf_counter()
+                    observe("chat.llm_first_token", first_token_at - llm_started)
+                chunks.append(chunk)
+                yield chunk
+        _record_chat_tokens(inputs, chunks)
+        
+        _record_llm_latency(started, first_token_at, cached=False)
+        if use_cache:
+            get_llm_cache().set(cache_key, "".join(chunks).strip(), LLM_MODEL_NAME)
+
+async def astream_follow_up_question(question, isp_data, business_metrics=None, use_cache=True, use_fast_path=True):
+    """Versão assíncrona de stream_follow_up_question (LLM via astream, cache em thread)"""
+    with span("chat.total"):
+        started = time.perf_counter()
+        if business_metrics is None:
+            business_metrics = get_business_metrics(isp_data)
+        local_answer = _answer_locally(question, isp_data, business_metrics) if use_fast_path else None
+        if local_answer is not None:
+            _record_llm_latency(started, None, cached=True)
+            yield local_answer
+            return
+        
+        use_cache = use_cache and not LLM_CACHE_DISABLED
+        if use_cache:
+            with span("chat.cache_lookup"):
+                cache_key = _follow_up_cache_key(question, isp_data)
+                cached = await asyncio.to_thread(get_llm_cache().get, cache_key)
+            if cached is not None:
+                _record_llm_latency(started, None, cached=True)
+                yield cached
+                return
+        
+        messages, inputs = _follow_up_messages(question, isp_data, business_metrics)
+        
+        chunks = []
+        first_token_at = None
+        with span("chat.llm"):
+            llm_started = time.perf_counter()
+            async for chunk in _llm_gateway.astream(messages):
+                if first_token_at is None and chunk:
+                    first_token_at = time.perf_counter()
+                    observe("chat.llm_first_token", first_token_at - llm_started)
+                chunks.append(chunk)
+                yield chunk
+        _record_chat_tokens(inputs, chunks)
+        
+        _record_llm_latency(started, first_token_at, cached=False)
+        if use_cache:
+            await asyncio.to_thread(get_llm_cache().set, cache_key, "".join(chunks).strip(), LLM_MODEL_NAME)
+
+def process_follow_up_question(question, isp_data, business_metrics=None, use_cache=True, use_fast_path=True):
+    return "".join(
+        stream_follow_up_question(question, isp_data, business_metrics, use_cache, use_fast_path)
+    ).strip()